@@ -210,7 +210,7 @@ class FeiFei:
                         if wsa_server.get_instance().is_connected(username):
                             content = {'Topic': 'human', 'Data': {'Key': 'log', 'Value': "思考中..."}, 'Username' : username, 'robot': f'{cfg.fay_url}/robot/Thinking.jpg'}
                             wsa_server.get_instance().add_cmd(content)
-                        text = nlp_cognitive_stream.question(interact.data["msg"], username, interact.data.get("observation", None), interact.data.get("pure_mode", False))
+                        text = nlp_cognitive_stream.question(interact.data["msg"], username, interact.data.get("observation", None), interact.data.get("pure_mode", False), interact.data.get("use_tools", None))
 
                     else: 
                         text = answer
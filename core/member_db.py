@@ -22,6 +22,23 @@ class Member_Db:
 
     def __init__(self) -> None:
         self.lock = threading.Lock()
+        # 进程内的用户资料缓存，写操作时同步更新或失效，流式对话中按句查询不再打开数据库
+        self._uid_cache = {}      # username -> uid（不存在为0）
+        self._model_cache = {}    # username -> current_model_id
+        self._username_cache = {} # uid -> username
+
+    def _invalidate(self, *usernames):
+        """清除指定用户的缓存，不指定时清空全部"""
+        if not usernames:
+            self._uid_cache.clear()
+            self._model_cache.clear()
+            self._username_cache.clear()
+            return
+        for username in usernames:
+            uid = self._uid_cache.pop(username, None)
+            self._model_cache.pop(username, None)
+            if uid:
+                self._username_cache.pop(uid, None)
            
    
 
@@ -53,6 +70,7 @@ class Member_Db:
             c.execute('INSERT INTO T_Member (username) VALUES (?)', (username,))
             conn.commit()
             conn.close()
+            self._invalidate(username)
             return "success"
         else:
            return f"Username '{username}' already exists."
@@ -66,6 +84,7 @@ class Member_Db:
             c.execute('UPDATE T_Member SET username = ? WHERE username = ?', (new_username, username))
             conn.commit()
             conn.close()
+            self._invalidate(username, new_username)
             return "success"
         else:
             return f"Username '{new_username}' already exists."
@@ -78,6 +97,7 @@ class Member_Db:
         c.execute('DELETE FROM T_Member WHERE username = ?', (username,))
         conn.commit()
         conn.close()
+        self._invalidate(username)
         return "success"
 
     # 检查用户名是否已存在
@@ -94,18 +114,27 @@ class Member_Db:
 
     #根据username查询uid
     def find_user(self, username):
+        uid = self._uid_cache.get(username)
+        if uid is not None:
+            return uid
         conn = sqlite3.connect('memory/user_profiles.db')
         c = conn.cursor()
         c.execute('SELECT * FROM T_Member WHERE username = ?', (username,))
         result = c.fetchone()
         conn.close()
         if result is None:
-            return 0
+            uid = 0
         else:
-           return result[0]
+            uid = result[0]
+            self._username_cache[uid] = username
+        self._uid_cache[username] = uid
+        return uid
         
     #根据uid查询username
     def find_username_by_uid(self, uid):
+        username = self._username_cache.get(uid)
+        if username is not None:
+            return username
         conn = sqlite3.connect('memory/user_profiles.db')
         c = conn.cursor()
         c.execute('SELECT username FROM T_Member WHERE id = ?', (uid,))
@@ -143,6 +172,7 @@ class Member_Db:
                  (model_id, username))
         conn.commit()
         conn.close()
+        self._model_cache[username] = model_id if model_id else None
         
         return True, "设置成功"
 
@@ -158,16 +188,19 @@ class Member_Db:
         返回:
             模型ID，如果未设置返回None
         """
+        if username in self._model_cache:
+            return self._model_cache[username]
         conn = sqlite3.connect('memory/user_profiles.db')
         c = conn.cursor()
         c.execute('SELECT current_model_id FROM T_Member WHERE username = ?', (username,))
         result = c.fetchone()
         conn.close()
         
-        if result is None:
-            return None
-        
-        return result[0] if result[0] else None
+        model_id = result[0] if result and result[0] else None
+        if result is not None:
+            # 不存在的用户不缓存，add_user之后仍能查到
+            self._model_cache[username] = model_id
+        return model_id
 
 
 
@@ -180,6 +213,8 @@ class Member_Db:
             results = c.fetchall()
             conn.commit()
             conn.close()
+            # 任意SQL可能修改用户数据，清空缓存
+            self._invalidate()
             return results
         except Exception as e:
             return f"执行时发生错误：{str(e)}"
@@ -8,6 +8,10 @@ from typing import Dict, Any, Optional
 from core import model_db
 from utils import util
 
+# 已解析的模型属性：model_id -> (attribute_json, 属性字典)。模型信息本身由model_db缓存，
+# attribute_json变化（模型被更新）时重新解析
+_attributes_cache: Dict[str, tuple] = {}
+
 
 def get_model_attributes(model_id: str) -> Optional[Dict[str, Any]]:
     """
@@ -23,14 +27,21 @@ def get_model_attributes(model_id: str) -> Optional[Dict[str, Any]]:
     model_info = db.get_model_by_id(model_id)
     
     if model_info is None:
+        _attributes_cache.pop(model_id, None)
         util.log(1, f"[模型属性] 模型不存在: {model_id}")
         return None
     
     try:
         # 解析属性JSON
         attribute_json = model_info.get('attribute_json', '{}')
+        cached = _attributes_cache.get(model_id)
+        if cached is not None and isinstance(attribute_json, str) and cached[0] == attribute_json:
+            return dict(cached[1]) if isinstance(cached[1], dict) else cached[1]
         if isinstance(attribute_json, str):
             attributes = json.loads(attribute_json)
+            _attributes_cache[model_id] = (attribute_json, attributes)
+            if isinstance(attributes, dict):
+                attributes = dict(attributes)
         else:
             attributes = attribute_json
         
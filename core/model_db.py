@@ -34,6 +34,8 @@ class Model_Db:
 
     def __init__(self) -> None:
         self.lock = threading.Lock()
+        # get_model_by_id的进程内缓存，更新/删除模型时失效
+        self._model_cache = {}
 
     def init_db(self):
         """初始化数据库表"""
@@ -121,6 +123,7 @@ class Model_Db:
             
             conn.commit()
             conn.close()
+            self._model_cache.pop(model_id, None)
             
             util.log(1, f"模型创建成功: {name} (ID: {model_id}, model3d_url: {model3d_url}, idle_model_url: {idle_model_url}, talking_model_url: {talking_model_url})")
             return True, model_id
@@ -141,6 +144,10 @@ class Model_Db:
         返回:
             模型信息字典，如果不存在返回None
         """
+        if model_id in self._model_cache:
+            cached = self._model_cache[model_id]
+            return dict(cached) if cached is not None else None
+        
         conn = sqlite3.connect('memory/user_profiles.db')
         conn.text_factory = str
         c = conn.cursor()
@@ -153,9 +160,10 @@ class Model_Db:
         conn.close()
         
         if row is None:
+            self._model_cache[model_id] = None
             return None
         
-        return {
+        model_info = {
             'id': row[0],
             'model_id': row[1],
             'name': row[2],
@@ -170,6 +178,8 @@ class Model_Db:
             'idle_model_url': row[11] if len(row) > 11 else None,
             'talking_model_url': row[12] if len(row) > 12 else None
         }
+        self._model_cache[model_id] = model_info
+        return dict(model_info)
 
     @synchronized
     def get_model_list(self, username=None, include_global=True):
@@ -307,6 +317,7 @@ class Model_Db:
             
             conn.commit()
             conn.close()
+            self._model_cache.pop(model_id, None)
             
             util.log(1, f"模型更新成功: {model_id}, model3d_url: {model3d_url}, idle_model_url: {idle_model_url}, talking_model_url: {talking_model_url}")
             return True, "更新成功"
@@ -354,6 +365,7 @@ class Model_Db:
             
             conn.commit()
             conn.close()
+            self._model_cache.pop(model_id, None)
             
             util.log(1, f"模型删除成功: {model_id}, 文件URL: {file_urls}")
             return True, "删除成功", file_urls
@@ -388,6 +400,7 @@ class Model_Db:
             
             conn.commit()
             conn.close()
+            self._model_cache.pop(model_id, None)
             
             util.log(1, f"模型硬删除成功: {model_id}")
             return True, "删除成功"
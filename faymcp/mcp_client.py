@@ -43,6 +43,15 @@ async def _await_or_value(obj, timeout: Optional[float] = None):
     return obj
 
 
+def _read_only_hint(annotations: Any) -> bool:
+    """Whether MCP tool annotations declare the tool read-only (readOnlyHint)."""
+    if annotations is None:
+        return False
+    if isinstance(annotations, dict):
+        return bool(annotations.get("readOnlyHint"))
+    return bool(getattr(annotations, "readOnlyHint", False))
+
+
 class McpClient:
     """
     兼容多版本 mcp 的 MCP 客户端，支持 SSE 与 STDIO。
@@ -158,6 +167,7 @@ class McpClient:
                         "name": name,
                         "description": description,
                         "inputSchema": dict(input_schema),
+                        "read_only": _read_only_hint(getattr(tool, "annotations", None)),
                     })
                 elif isinstance(tool, dict) and tool.get("name"):
                     name = str(tool.get("name", "")).strip()
@@ -168,6 +178,7 @@ class McpClient:
                         "description": str(tool.get("description", "") or ""),
                         "inputSchema": dict(tool.get("inputSchema") or {})
                         if isinstance(tool.get("inputSchema"), dict) else {},
+                        "read_only": _read_only_hint(tool.get("annotations")),
                     }
                     if "enabled" in tool:
                         entry["enabled"] = bool(tool["enabled"])
@@ -195,7 +206,7 @@ class McpClient:
             self._tool_cache_timestamp = time.time()
             self.tools = [self._clone_tool_entry(entry) for entry in cloned]  # backward compatibility
         if self.server_id is not None:
-            tool_registry.set_server_tools(self.server_id, tools, self._enabled_lookup)
+            tool_registry.set_server_tools(self.server_id, tools, self._enabled_lookup, client=self)
 
     def _get_tool_cache_copy(self) -> List[Dict[str, Any]]:
         with self._tools_lock:
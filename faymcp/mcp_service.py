@@ -14,6 +14,7 @@ from typing import Any, Dict, List
 from flask_cors import CORS
 from faymcp.mcp_client import McpClient
 from faymcp import tool_registry
+from faymcp import tool_cache
 from utils import util
 
 
@@ -31,6 +32,9 @@ MCP_DATA_FILE = os.path.join(os.path.dirname(__file__), 'data', 'mcp_servers.jso
 # MCP工具状态数据文件路径
 MCP_TOOL_STATES_FILE = os.path.join(os.path.dirname(__file__), 'data', 'mcp_tool_states.json')
 
+# MCP工具结果缓存时间数据文件路径
+MCP_TOOL_CACHE_FILE = os.path.join(os.path.dirname(__file__), 'data', 'mcp_tool_cache.json')
+
 # 确保data目录存在
 os.makedirs(os.path.dirname(MCP_DATA_FILE), exist_ok=True)
 
@@ -139,6 +143,41 @@ mcp_servers = load_mcp_servers()
 # 初始化MCP工具状态数据
 mcp_tool_states = load_mcp_tool_states()
 
+# 加载MCP工具结果缓存时间（秒），键为服务器ID，值为工具名称->缓存时间的字典
+def load_mcp_tool_cache_ttls():
+    try:
+        if os.path.exists(MCP_TOOL_CACHE_FILE):
+            with open(MCP_TOOL_CACHE_FILE, 'r', encoding='utf-8') as f:
+                ttls = json.load(f)
+            converted_ttls = {}
+            for server_id_str, tools in ttls.items():
+                try:
+                    converted_ttls[int(server_id_str)] = {name: float(ttl) for name, ttl in tools.items()}
+                except (ValueError, TypeError, AttributeError):
+                    continue
+            return converted_ttls
+        return {}
+    except Exception as e:
+        util.log(1, f"加载MCP工具缓存时间数据失败: {e}")
+        return {}
+
+# 保存MCP工具结果缓存时间
+def save_mcp_tool_cache_ttls():
+    try:
+        ttls_to_save = {str(server_id): tools for server_id, tools in mcp_tool_cache_ttls.items()}
+        with open(MCP_TOOL_CACHE_FILE, 'w', encoding='utf-8') as f:
+            json.dump(ttls_to_save, f, ensure_ascii=False, indent=4)
+        return True
+    except Exception as e:
+        util.log(1, f"保存MCP工具缓存时间数据失败: {e}")
+        return False
+
+# 初始化MCP工具结果缓存时间，交给工具注册表
+mcp_tool_cache_ttls = load_mcp_tool_cache_ttls()
+for _server_id, _tools in mcp_tool_cache_ttls.items():
+    for _tool_name, _ttl in _tools.items():
+        tool_registry.set_tool_cache_ttl(_server_id, _tool_name, _ttl)
+
 # 工具状态管理函数
 def get_tool_state(server_id, tool_name):
     """获取工具的启用状态，默认为True"""
@@ -331,8 +370,8 @@ def call_mcp_tool(server_id, method, params=None):
         if not client:
             return False, "未找到服务器连接"
             
-        # 调用工具
-        return client.call_tool(method, params)
+        # 调用工具（可缓存的只读工具优先使用缓存结果）
+        return tool_cache.call(server_id, method, params, lambda: client.call_tool(method, params))
     except Exception as e:
         util.log(1, f"调用MCP工具失败: {e}")
         return False, f"调用MCP工具失败: {str(e)}"
@@ -1071,6 +1110,63 @@ def toggle_tool_state(server_id, tool_name):
             "message": f"切换工具状态失败: {str(e)}"
         }), 500
 
+# API路由 - 设置工具结果的缓存时间
+@app.route('/api/mcp/servers/<int:server_id>/tools/<string:tool_name>/cache', methods=['POST'])
+def set_tool_cache_ttl(server_id, tool_name):
+    """
+    设置工具结果的缓存时间（秒），0表示不缓存。
+    只应对相同参数总是返回相同结果的只读工具开启缓存；同一服务器上的写入类工具调用成功后缓存自动失效
+    """
+    try:
+        data = request.json or {}
+        try:
+            ttl = max(0.0, float(data.get('ttl', 0) or 0))
+        except (TypeError, ValueError):
+            return jsonify({
+                "success": False,
+                "message": "缓存时间必须是数字"
+            }), 400
+
+        if not any(s['id'] == server_id for s in mcp_servers):
+            return jsonify({
+                "success": False,
+                "message": "服务器不存在"
+            }), 404
+
+        tools = mcp_tool_cache_ttls.setdefault(server_id, {})
+        if ttl > 0:
+            tools[tool_name] = ttl
+        else:
+            tools.pop(tool_name, None)
+        save_mcp_tool_cache_ttls()
+        tool_registry.set_tool_cache_ttl(server_id, tool_name, ttl)
+        tool_cache.invalidate_tool(tool_name)
+
+        util.log(1, f"工具 {tool_name} 的结果缓存时间已设置为 {ttl:g} 秒")
+        return jsonify({
+            "success": True,
+            "tool_name": tool_name,
+            "ttl": ttl
+        })
+    except Exception as e:
+        util.log(1, f"设置工具缓存时间失败: {e}")
+        return jsonify({
+            "success": False,
+            "message": f"设置工具缓存时间失败: {str(e)}"
+        }), 500
+
+# API路由 - 获取工具结果缓存的命中统计
+@app.route('/api/mcp/tool-cache/stats', methods=['GET'])
+def get_tool_cache_stats():
+    """
+    获取工具结果缓存的命中率，可用server_id参数只看某个服务器
+    """
+    server_id = request.args.get('server_id', type=int)
+    return jsonify({
+        "success": True,
+        "stats": tool_cache.stats(server_id)
+    })
+
 # 启动连接检查
 def start_connection_check():
     """
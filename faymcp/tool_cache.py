@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+TTL cache for the results of idempotent MCP tool calls.
+
+Entries are keyed by (server id, tool name, canonical JSON of the arguments),
+so servers exposing a tool of the same name never answer for each other. Whether a tool is cacheable, and for how long,
+comes from tool_registry (get_tool_cache_ttl). A successful call of a write
+tool (not cacheable and not marked read-only) drops every cached result of the
+same server, so reads never outlive a write that went through this process.
+"""
+
+from __future__ import annotations
+
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from faymcp import tool_registry
+
+# Upper bound on cached results; the least recently used ones are dropped first.
+MAX_ENTRIES = 1024
+
+_lock = threading.Lock()
+_entries: "OrderedDict[Tuple[int, str, str], Tuple[float, Any]]" = OrderedDict()
+_stats: Dict[str, int] = {"hits": 0, "misses": 0, "stores": 0, "invalidations": 0}
+_tool_stats: Dict[str, Dict[str, int]] = {}
+
+
+def make_key(server_id: int, tool_name: str, params: Optional[Dict[str, Any]]) -> Tuple[int, str, str]:
+    """Cache key for a call: the server, the tool name and its arguments as canonical JSON."""
+    canonical = json.dumps(params or {}, ensure_ascii=False, sort_keys=True,
+                           separators=(",", ":"), default=str)
+    return server_id, tool_name, canonical
+
+
+def _count(tool_name: str, field: str) -> None:
+    # Caller holds _lock.
+    _stats[field] += 1
+    counters = _tool_stats.setdefault(tool_name, {"hits": 0, "misses": 0})
+    if field in counters:
+        counters[field] += 1
+
+
+def get(server_id: int, tool_name: str, params: Optional[Dict[str, Any]]) -> Tuple[bool, Any]:
+    """Return (found, result) for a cached, unexpired result of this server."""
+    key = make_key(server_id, tool_name, params)
+    now = time.time()
+    with _lock:
+        entry = _entries.get(key)
+        if entry is not None and entry[0] > now:
+            _entries.move_to_end(key)
+            _count(tool_name, "hits")
+            return True, entry[1]
+        if entry is not None:
+            del _entries[key]
+        _count(tool_name, "misses")
+        return False, None
+
+
+def put(server_id: int, tool_name: str, params: Optional[Dict[str, Any]], result: Any, ttl: float) -> None:
+    """Cache a successful result of this server for ttl seconds."""
+    if ttl <= 0:
+        return
+    key = make_key(server_id, tool_name, params)
+    with _lock:
+        _entries[key] = (time.time() + ttl, result)
+        _entries.move_to_end(key)
+        _stats["stores"] += 1
+        while len(_entries) > MAX_ENTRIES:
+            _entries.popitem(last=False)
+
+
+def invalidate_server(server_id: int) -> int:
+    """Drop every cached result produced by a server. Returns how many were dropped."""
+    with _lock:
+        stale = [key for key in _entries if key[0] == server_id]
+        for key in stale:
+            del _entries[key]
+        if stale:
+            _stats["invalidations"] += 1
+        return len(stale)
+
+
+def invalidate_tool(tool_name: str) -> int:
+    """Drop every cached result of one tool, e.g. after its TTL was changed."""
+    with _lock:
+        stale = [key for key in _entries if key[1] == tool_name]
+        for key in stale:
+            del _entries[key]
+        return len(stale)
+
+
+def call(
+    server_id: int,
+    tool_name: str,
+    params: Optional[Dict[str, Any]],
+    invoke: Callable[[], Tuple[bool, Any]],
+) -> Tuple[bool, Any]:
+    """
+    Run invoke() through the cache for a call of tool_name on server_id.
+
+    Cacheable tools are answered from the cache when possible and their
+    successful results are stored. A successful call of a write tool
+    invalidates the server's cached results.
+    """
+    ttl = tool_registry.get_tool_cache_ttl(server_id, tool_name)
+    if ttl > 0:
+        found, result = get(server_id, tool_name, params)
+        if found:
+            return True, result
+    success, result = invoke()
+    if success:
+        if ttl > 0:
+            put(server_id, tool_name, params, result, ttl)
+        elif not tool_registry.is_read_only(server_id, tool_name):
+            invalidate_server(server_id)
+    return success, result
+
+
+def stats(server_id: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Hit/miss counters overall and per tool, and the number of live entries.
+    With server_id, only the tools and entries of that server are reported.
+    """
+    now = time.time()
+    with _lock:
+        entries = [key for key, entry in _entries.items()
+                   if entry[0] > now and (server_id is None or key[0] == server_id)]
+        tools = {name: dict(counters) for name, counters in _tool_stats.items()}
+        totals = dict(_stats)
+    if server_id is not None:
+        names = {entry["name"] for entry in tool_registry.get_server_tools(server_id)}
+        tools = {name: counters for name, counters in tools.items() if name in names}
+        totals["hits"] = sum(counters["hits"] for counters in tools.values())
+        totals["misses"] = sum(counters["misses"] for counters in tools.values())
+    lookups = totals["hits"] + totals["misses"]
+    totals["hit_rate"] = round(totals["hits"] / lookups, 4) if lookups else None
+    totals["entries"] = len(entries)
+    totals["tools"] = tools
+    return totals
+
+
+def reset() -> None:
+    """Clear all cached results and counters. Intended for unit tests."""
+    with _lock:
+        _entries.clear()
+        _tool_stats.clear()
+        for field in _stats:
+            _stats[field] = 0
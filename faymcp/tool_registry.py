@@ -7,13 +7,18 @@ This module keeps an in-memory snapshot of tools reported by each MCP server.
 It exposes a simple API so different components (service UI, LLM pipeline,
 background clients) can publish updates and read the latest view without
 re-querying the servers on every request.
+
+Clients that publish their tools are remembered as well, so the LLM pipeline
+can dispatch a tool call in-process (call_tool) instead of going through the
+HTTP endpoint of the MCP service.
 """
 
 from __future__ import annotations
 
+import json
 import threading
 import time
-from typing import Any, Callable, Dict, List, Optional
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
 ToolEntry = Dict[str, Any]
 
@@ -21,37 +26,72 @@ _lock = threading.RLock()
 _server_tools: Dict[int, Dict[str, ToolEntry]] = {}
 _aggregated_cache: List[ToolEntry] = []
 _aggregated_cache_timestamp: float = 0.0
+# fingerprint of the aggregated tool list; the timestamp only moves when it changes
+_aggregated_signature: Optional[str] = None
+_clients: Dict[int, Any] = {}
+# tool name -> ids of the servers offering it (enabled and available), newest first
+_tool_index: Dict[str, List[int]] = {}
+# (server_id, tool name) -> seconds a result of the tool may be served from tool_cache
+_cache_ttls: Dict[Tuple[int, str], float] = {}
 
 
 def _clone_entry(entry: ToolEntry) -> ToolEntry:
     """Return a shallow copy so callers cannot mutate the registry state."""
     clone = dict(entry)
     clone["inputSchema"] = dict(entry.get("inputSchema") or {})
+    clone["cache_ttl"] = _cache_ttls.get((entry.get("server_id"), entry.get("name")), 0.0)
     return clone
 
 
+def _signature(tools: List[ToolEntry]) -> str:
+    """Fingerprint of what prompt builders read from the aggregated tools."""
+    return json.dumps(
+        [(tool["name"], tool.get("description", ""), tool.get("inputSchema") or {}, tool.get("enabled", True))
+         for tool in tools],
+        ensure_ascii=False, sort_keys=True, default=str,
+    )
+
+
 def _rebuild_cache_locked() -> None:
-    """Recompute the aggregated enabled+available tool cache."""
-    global _aggregated_cache, _aggregated_cache_timestamp
+    """
+    Recompute the aggregated enabled+available tool cache. The cache
+    timestamp is only bumped when the aggregated tool list actually changed,
+    so periodic refreshes reporting the same tools keep it stable.
+    """
+    global _aggregated_cache, _aggregated_cache_timestamp, _aggregated_signature, _tool_index
     aggregated: Dict[str, ToolEntry] = {}
+    offered: Dict[str, List[ToolEntry]] = {}
     for tools in _server_tools.values():
         for name, entry in tools.items():
             if not entry.get("available"):
                 continue
             if not entry.get("enabled", True):
                 continue
+            offered.setdefault(name, []).append(entry)
             cached = aggregated.get(name)
             if cached and cached.get("last_checked", 0.0) >= entry.get("last_checked", 0.0):
                 continue
             aggregated[name] = _clone_entry(entry)
     _aggregated_cache = sorted(aggregated.values(), key=lambda item: item["name"])
-    _aggregated_cache_timestamp = time.time()
+    signature = _signature(_aggregated_cache)
+    if signature != _aggregated_signature:
+        _aggregated_signature = signature
+        # strictly increasing, even for two changes within one clock tick
+        _aggregated_cache_timestamp = max(time.time(), _aggregated_cache_timestamp + 1e-6)
+    _tool_index = {
+        name: [
+            entry["server_id"]
+            for entry in sorted(entries, key=lambda item: item.get("last_checked", 0.0), reverse=True)
+        ]
+        for name, entries in offered.items()
+    }
 
 
 def set_server_tools(
     server_id: int,
     tools: Optional[List[Dict[str, Any]]],
     enabled_lookup: Optional[Callable[[str], bool]] = None,
+    client: Any = None,
 ) -> None:
     """
     Publish the latest tool list reported by a server.
@@ -61,10 +101,15 @@ def set_server_tools(
         tools: Iterable of tool definitions (dict-like) returned by MCP.
         enabled_lookup: Optional callback used to hydrate the enabled flag from
             persisted state managed elsewhere (e.g. UI selections).
+        client: Optional connected client of the server (anything with a
+            call_tool(name, params) -> (success, result) method), used by
+            call_tool for in-process dispatch.
     """
     now = time.time()
     normalized_tools = tools or []
     with _lock:
+        if client is not None:
+            _clients[server_id] = client
         server_map = _server_tools.setdefault(server_id, {})
 
         # Mark existing entries unavailable; they will be re-enabled if present.
@@ -83,6 +128,7 @@ def set_server_tools(
                     "inputSchema": {},
                     "available": False,
                     "enabled": True,
+                    "read_only": False,
                     "server_id": server_id,
                     "last_checked": 0.0,
                 },
@@ -90,6 +136,7 @@ def set_server_tools(
             entry["description"] = str(raw_tool.get("description") or "")
             input_schema = raw_tool.get("inputSchema")
             entry["inputSchema"] = dict(input_schema) if isinstance(input_schema, dict) else {}
+            entry["read_only"] = bool(raw_tool.get("read_only"))
             entry["available"] = True
             entry["server_id"] = server_id
             entry["last_checked"] = now
@@ -112,6 +159,7 @@ def set_server_tools(
 def remove_server(server_id: int) -> None:
     """Completely remove cached data for a server."""
     with _lock:
+        _clients.pop(server_id, None)
         if server_id in _server_tools:
             del _server_tools[server_id]
             _rebuild_cache_locked()
@@ -182,8 +230,72 @@ def get_all_tools(include_disabled: bool = True) -> List[ToolEntry]:
         return results
 
 
+def set_tool_cache_ttl(server_id: int, tool_name: str, ttl: float) -> None:
+    """Make a tool's results cacheable for ttl seconds (0 disables caching)."""
+    with _lock:
+        if ttl and ttl > 0:
+            _cache_ttls[(server_id, tool_name)] = float(ttl)
+        else:
+            _cache_ttls.pop((server_id, tool_name), None)
+
+
+def get_tool_cache_ttl(server_id: int, tool_name: str) -> float:
+    """Seconds a result of the tool may be reused; 0 when it is not cacheable."""
+    with _lock:
+        return _cache_ttls.get((server_id, tool_name), 0.0)
+
+
+def is_read_only(server_id: int, tool_name: str) -> bool:
+    """Whether the server declared the tool read-only (MCP readOnlyHint)."""
+    with _lock:
+        entry = _server_tools.get(server_id, {}).get(tool_name)
+        return bool(entry and entry.get("read_only"))
+
+
+def resolve_tool(tool_name: str) -> List[Tuple[int, Any]]:
+    """Return (server_id, client) for every connected server offering an enabled tool, newest first."""
+    with _lock:
+        return [
+            (server_id, _clients[server_id])
+            for server_id in _tool_index.get(tool_name, ())
+            if server_id in _clients
+        ]
+
+
+def call_tool(tool_name: str, params: Optional[Dict[str, Any]] = None) -> Tuple[bool, Any, Optional[int]]:
+    """
+    Call an enabled tool in-process through the client of a server offering it.
+
+    Servers are tried newest first until one succeeds. The raw MCP result is
+    returned without any serialization. Calls go through tool_cache, so
+    cacheable tools may be answered without reaching the server.
+
+    Returns:
+        (success, result or error message, server_id). server_id is None when
+        no connected server in this process offers the tool.
+    """
+    from faymcp import tool_cache
+
+    candidates = resolve_tool(tool_name)
+    if not candidates:
+        return False, f"没有提供 {tool_name} 工具的在线服务器", None
+    error: Any = None
+    server_id: Optional[int] = None
+    for server_id, client in candidates:
+        try:
+            success, result = tool_cache.call(
+                server_id, tool_name, params, lambda: client.call_tool(tool_name, params or {})
+            )
+        except Exception as exc:
+            success, result = False, f"调用工具失败: {type(exc).__name__}: {exc}"
+        if success:
+            return True, result, server_id
+        error = result
+    return False, error, server_id
+
+
 def get_cache_timestamp() -> float:
-    """Expose the timestamp of the last aggregated cache refresh."""
+    """Expose the timestamp of the last change of the aggregated tool list."""
     with _lock:
         return _aggregated_cache_timestamp
 
@@ -192,8 +304,13 @@ def reset() -> None:
     """
     Reset all cached data. Intended for unit tests to ensure a clean slate.
     """
-    global _server_tools, _aggregated_cache, _aggregated_cache_timestamp
+    global _server_tools, _aggregated_cache, _aggregated_cache_timestamp, _aggregated_signature
+    global _clients, _tool_index, _cache_ttls
     with _lock:
         _server_tools = {}
         _aggregated_cache = []
         _aggregated_cache_timestamp = 0.0
+        _aggregated_signature = None
+        _clients = {}
+        _tool_index = {}
+        _cache_ttls = {}
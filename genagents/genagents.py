@@ -11,6 +11,10 @@ from utils import util
 
 from genagents.modules.interaction import *
 from genagents.modules.memory_stream import *
+from genagents.modules.embedding_store import (
+  has_embedding_store, load_embeddings, save_embeddings)
+from genagents.modules.node_journal import NodeJournal, has_nodes, load_nodes
+from genagents.modules.memory_tiering import MemoryTiering
 
 
 # ############################################################################
@@ -21,15 +25,18 @@ class GenerativeAgent:
   def __init__(self, agent_folder=None):
     if agent_folder: 
       # 检查记忆目录是否存在
-      memory_stream_exists = check_if_file_exists(f"{agent_folder}/memory_stream/nodes.json") and check_if_file_exists(f"{agent_folder}/memory_stream/embeddings.json")
+      memory_stream_dir = f"{agent_folder}/memory_stream"
+      memory_stream_exists = has_nodes(memory_stream_dir)
       
-      # 加载记忆流数据
+      # 加载记忆流数据（nodes.json快照 + 追加日志）
       try:
         if memory_stream_exists:
-          with open(f"{agent_folder}/memory_stream/embeddings.json", 'r', encoding='utf-8') as json_file:
-            embeddings = json.load(json_file)
-          with open(f"{agent_folder}/memory_stream/nodes.json", 'r', encoding='utf-8') as json_file:
-            nodes = json.load(json_file)
+          nodes = load_nodes(memory_stream_dir)
+          if has_embedding_store(memory_stream_dir): 
+            embeddings = load_embeddings(memory_stream_dir, 
+                                         [ConceptNode(node) for node in nodes])
+          else: 
+            embeddings = {}
         else:
           embeddings = {}
           nodes = []
@@ -43,6 +50,11 @@ class GenerativeAgent:
       # 从配置文件实时加载数字人属性
       self.scratch = self._load_scratch_from_config()
       self.memory_stream = MemoryStream(nodes, embeddings)
+      # 补齐日志中尚未保存embedding的节点，之后的变更实时追加到日志
+      self.memory_stream.restore_embeddings()
+      self.memory_stream.journal = NodeJournal(memory_stream_dir)
+      # 超出热记忆上限的旧观察归档到memory_stream/archive
+      self.memory_stream.tiering = MemoryTiering(memory_stream_dir)
 
     else: 
       self.id = uuid.uuid4()
@@ -123,13 +135,21 @@ class GenerativeAgent:
           self.memory_stream.embeddings = {}
       
       # Saving the agent's memory stream. This includes saving the embeddings 
-      # as well as the nodes. 
-      with open(f"{storage}/memory_stream/embeddings.json", "w", encoding='utf-8') as json_file:
-        json.dump(self.memory_stream.embeddings, 
-                  json_file, ensure_ascii=False, indent=2)
-      with open(f"{storage}/memory_stream/nodes.json", "w", encoding='utf-8') as json_file:
-        json.dump([node.package() for node in self.memory_stream.seq_nodes], 
-                  json_file, ensure_ascii=False, indent=2)
+      # as well as the nodes. Embeddings go to the binary store, which only 
+      # appends the rows added since the last save. 
+      self.memory_stream.embeddings = save_embeddings(
+        self.memory_stream.embeddings, f"{storage}/memory_stream", 
+        self.memory_stream.seq_nodes)
+
+      # Nodes are already in the journal of the folder they were loaded from, 
+      # so saving there only folds the journal into nodes.json once it has 
+      # grown. Any other folder gets a full snapshot. 
+      journal = self.memory_stream.journal
+      if journal is None or not journal.is_for(f"{storage}/memory_stream"): 
+        NodeJournal(f"{storage}/memory_stream").compact(
+          self.memory_stream.seq_nodes)
+      elif journal.needs_compaction(): 
+        journal.compact(self.memory_stream.seq_nodes)
 
       # Saving the agent's meta information. 
       with open(f"{storage}/meta.json", "w", encoding='utf-8') as json_file:
@@ -149,17 +169,19 @@ class GenerativeAgent:
   def get_self_description(self): 
     return str(self.scratch)
 
-  def remember(self, content, time_step=0): 
+  def remember(self, content, time_step=0, importance=None): 
     """
     Add a new observation to the memory stream. 
 
     Parameters:
       content: The content of the current memory record that we are adding to
         the agent's memory stream. 
+      importance: The importance score if it was already computed (e.g. in a 
+        batch); scored by the LLM otherwise. 
     Returns: 
       None
     """
-    self.memory_stream.remember(content, time_step)
+    self.memory_stream.remember(content, time_step, importance)
 
 
   def reflect(self, anchor, time_step=0): 
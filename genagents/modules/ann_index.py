@@ -0,0 +1,404 @@
+import os
+import sys
+import time
+import threading
+
+import numpy as np
+
+
+# ##############################################################################
+# ###                        APPROXIMATE NN (IVF) INDEX                      ###
+# ##############################################################################
+
+class IVFIndex:
+  """
+  Inverted-file index over the rows of a RetrievalEngine's embedding matrix.
+
+  The vectors themselves stay in the engine; the index only keeps a set of
+  spherical k-means centroids and the cluster of every row. A query is
+  compared against the centroids, and only the rows of the nprobe closest
+  clusters get an exact cosine score, plus the rows of the nfar farthest
+  clusters, which pin down the minimum that min-max normalization needs.
+  Every other row is scored with the similarity of its centroid; the engine
+  then rescores exactly whichever of those still make the blended shortlist.
+
+  Below min_rows the index stays untrained and retrieval is exact. Once
+  trained, new rows are assigned incrementally, and the centroids are
+  retrained whenever the number of rows has doubled since the last training.
+  Training runs in a background thread started by refresh(); queries keep
+  using exact search (or the previous centroids) until it has finished, and
+  the next refresh() swaps the new centroids in, so k-means never stalls a
+  retrieval.
+
+  Clustering only pays off when the embeddings have structure. After every
+  training the recall@recall_k of the probed clusters is measured on a
+  sample of the indexed vectors; below min_recall (e.g. the random vectors
+  of the mock embedding backend) the index is dropped and retrieval stays
+  exact until the stream has doubled again.
+
+  With memory tiering on, the hot tier is held at MEMORY_HOT_MAX_NODES,
+  which by default is well below min_rows: the index is meant for streams
+  that are not tiered, or whose cap has been raised past min_rows.
+  """
+  def __init__(self, nprobe=16, nfar=2, nlist=None, min_rows=4096,
+               train_iterations=8, min_recall=0.9, recall_k=30,
+               recall_queries=32, background=True, seed=0):
+    self.nprobe = nprobe
+    self.nfar = nfar
+    self.nlist = nlist
+    self.min_rows = min_rows
+    self.train_iterations = train_iterations
+    self.min_recall = min_recall
+    self.recall_k = recall_k
+    self.recall_queries = recall_queries
+    self.background = background
+    self.seed = seed
+    self.recall = None
+    self._lock = threading.Lock()
+    self._generation = 0
+    self.reset()
+
+
+  def reset(self):
+    with self._lock:
+      # A training still running for the old rows is discarded on arrival.
+      self._generation += 1
+      self._ready = None
+      self._training = False
+    self.centroids = None
+    self.trained_size = 0
+    self._assign = np.full(0, -1, dtype=np.int32)
+
+
+  @property
+  def is_trained(self):
+    return self.centroids is not None
+
+
+  @property
+  def is_training(self):
+    return self._training
+
+
+  def needs_training(self, size):
+    if size < self.min_rows:
+      return False
+    return not self.trained_size or size >= 2 * self.trained_size
+
+
+  def _ensure(self, size):
+    if size <= self._assign.shape[0]:
+      return
+    grown = np.full(max(size, self._assign.shape[0] * 2, 64), -1,
+                    dtype=np.int32)
+    grown[:self._assign.shape[0]] = self._assign
+    self._assign = grown
+
+
+  @staticmethod
+  def _nearest(centroids, unit_vectors, chunk=4096):
+    out = np.empty(unit_vectors.shape[0], dtype=np.int32)
+    for start in range(0, unit_vectors.shape[0], chunk):
+      block = unit_vectors[start:start + chunk] @ centroids.T
+      out[start:start + chunk] = block.argmax(axis=1)
+    return out
+
+
+  def refresh(self, matrix, norms, has_embedding, size):
+    """
+    Called before a query. Swaps in the centroids of a finished background
+    training, assigning the rows appended meanwhile, and starts a new
+    training once needs_training(size). Never waits for k-means unless
+    background is off.
+
+    Parameters:
+      matrix: the engine's float32 embedding matrix
+      norms: the engine's row norms
+      has_embedding: bool mask of rows that hold an embedding
+      size: the number of live rows
+    Returns:
+      None
+    """
+    with self._lock:
+      ready, self._ready = self._ready, None
+      start = not self._training and self.needs_training(size)
+      if start:
+        self._training = True
+        generation = self._generation
+    if ready is not None:
+      self._install(ready, matrix, norms, has_embedding, size)
+    if not start:
+      return
+    # Rows are only appended, so the first size rows stay valid for the
+    # training even if the engine grows (or reallocates) its matrix.
+    self.trained_size = size
+    rows = np.flatnonzero(has_embedding[:size] & (norms[:size] > 0))
+    if not self.background:
+      self._train_job(generation, matrix, norms, rows, size)
+      self.refresh(matrix, norms, has_embedding, size)
+      return
+    threading.Thread(target=self._train_job,
+                     args=(generation, matrix, norms, rows, size),
+                     daemon=True).start()
+
+
+  def _train_job(self, generation, matrix, norms, rows, size):
+    try:
+      result = self._fit(matrix, norms, rows, size)
+    except Exception as e:
+      print(f"训练IVF索引时出错: {str(e)}")
+      result = None
+    with self._lock:
+      if generation != self._generation:
+        return
+      self._training = False
+      self._ready = result
+
+
+  def _fit(self, matrix, norms, rows, size):
+    """
+    Spherical k-means over (a sample of) rows, the assignment of every row
+    and the measured recall. Touches no index state, so it can run in the
+    background. Returns (centroids, rows, labels, recall, size) or None when
+    there are too few usable rows.
+    """
+    if rows.size < self.min_rows:
+      return None
+    rng = np.random.default_rng(self.seed)
+    nlist = self.nlist or int(np.clip(np.sqrt(rows.size), 16, 1024))
+    nlist = min(nlist, rows.size)
+
+    sample = rows
+    if rows.size > 64 * nlist:
+      sample = np.sort(rng.choice(rows, 64 * nlist, replace=False))
+    data = matrix[sample] / norms[sample, None]
+
+    centroids = data[rng.choice(data.shape[0], nlist, replace=False)].copy()
+    for _ in range(self.train_iterations):
+      labels = self._nearest(centroids, data)
+      sums = np.zeros_like(centroids)
+      np.add.at(sums, labels, data)
+      lengths = np.linalg.norm(sums, axis=1)
+      filled = lengths > 0
+      centroids[filled] = sums[filled] / lengths[filled, None]
+
+    unit = matrix[rows] / norms[rows, None]
+    labels = self._nearest(centroids, unit)
+    recall = self._measure_recall(centroids, unit, labels, rng)
+    return centroids, rows, labels, recall, size
+
+
+  def _install(self, result, matrix, norms, has_embedding, size):
+    centroids, rows, labels, self.recall, trained = result
+    if self.recall < self.min_recall:
+      print(f"IVF索引召回率 {self.recall:.2f} 低于 {self.min_recall}，继续使用精确检索")
+      self.centroids = None
+      self._assign = np.full(0, -1, dtype=np.int32)
+      return
+    assign = np.full(max(size, 64), -1, dtype=np.int32)
+    assign[rows] = labels
+    # Rows appended while the training ran.
+    extra = np.flatnonzero(has_embedding[trained:size]
+                           & (norms[trained:size] > 0)) + trained
+    if extra.size:
+      assign[extra] = self._nearest(centroids, matrix[extra] / norms[extra, None])
+    self._assign = assign
+    self.centroids = centroids
+
+
+  def train(self, matrix, norms, has_embedding, size):
+    """
+    Trains the index synchronously (see refresh() for the background path)
+    and assigns every row to its nearest centroid.
+
+    Parameters:
+      matrix: the engine's float32 embedding matrix
+      norms: the engine's row norms
+      has_embedding: bool mask of rows that hold an embedding
+      size: the number of live rows
+    Returns:
+      None
+    """
+    self.reset()
+    self.trained_size = size
+    rows = np.flatnonzero(has_embedding[:size] & (norms[:size] > 0))
+    result = self._fit(matrix, norms, rows, size)
+    if result is not None:
+      self._install(result, matrix, norms, has_embedding, size)
+
+
+  def _measure_recall(self, centroids, unit, assign, rng):
+    """
+    Returns the share of the exact top recall_k neighbours that fall in the
+    nprobe clusters probed for the query, averaged over recall_queries of
+    the indexed vectors used as queries (each query's own row excluded).
+    """
+    k = min(self.recall_k, unit.shape[0] - 1)
+    if k <= 0:
+      return 1.0
+    picks = rng.choice(unit.shape[0], min(self.recall_queries, unit.shape[0]),
+                       replace=False)
+    queries = unit[picks]
+    sims = queries @ unit.T
+    sims[np.arange(picks.size), picks] = -np.inf
+    centroid_sims = queries @ centroids.T
+    nprobe = min(self.nprobe, centroids.shape[0])
+    hits = 0
+    for i in range(picks.size):
+      top = np.argpartition(-sims[i], k - 1)[:k]
+      probe = np.argpartition(-centroid_sims[i], nprobe - 1)[:nprobe]
+      hits += int(np.isin(assign[top], probe).sum())
+    return hits / (k * picks.size)
+
+
+  def add(self, row, vector, norm):
+    """
+    Assigns a single new row to its nearest centroid.
+    """
+    if not self.is_trained:
+      return
+    self._ensure(row + 1)
+    if norm > 0:
+      self._assign[row] = int(np.argmax(self.centroids @ (vector / norm)))
+
+
+  def search(self, rows, query_unit):
+    """
+    Splits the candidate rows into the ones to score exactly and an
+    approximate relevance for all of them.
+
+    Parameters:
+      rows: int array of candidate rows
+      query_unit: the L2-normalized query embedding
+    Returns:
+      probed: bool mask over rows, True for rows in the nprobe closest and
+        the nfar farthest clusters
+      approx: float array over rows, the cosine similarity of each row's
+        centroid to the query (nan for rows without a cluster)
+    """
+    centroid_sims = self.centroids @ query_unit
+    nprobe = min(self.nprobe, centroid_sims.shape[0])
+    probe = np.zeros(centroid_sims.shape[0], dtype=bool)
+    probe[np.argpartition(-centroid_sims, nprobe - 1)[:nprobe]] = True
+    nfar = min(self.nfar, centroid_sims.shape[0])
+    if nfar > 0:
+      probe[np.argpartition(centroid_sims, nfar - 1)[:nfar]] = True
+
+    self._ensure(int(rows.max()) + 1 if rows.size else 0)
+    assign = self._assign[rows]
+    clustered = assign >= 0
+    probed = np.zeros(rows.shape[0], dtype=bool)
+    probed[clustered] = probe[assign[clustered]]
+    approx = np.full(rows.shape[0], np.nan, dtype=np.float64)
+    approx[clustered] = centroid_sims[assign[clustered]]
+    return probed, approx
+
+
+# ##############################################################################
+# ###                            RECALL BENCHMARK                            ###
+# ##############################################################################
+
+def memory_vectors(memory_stream_dir, batch_size=256):
+  """
+  Embeds the contents of a memory stream with the configured embedding
+  backend (EMBEDDING_BACKEND in settings), the vectors retrieval will
+  actually see. Returns (nodes, vectors) for the nodes with content.
+  """
+  from simulation_engine import embedding_provider
+  from simulation_engine.settings import (
+    EMBEDDING_BACKEND, EMBEDDING_CACHE_SIZE, EMBEDDING_LOCAL_MODEL)
+  from genagents.modules.memory_stream import ConceptNode
+  from genagents.modules.node_journal import load_nodes
+
+  embedding_provider.configure(EMBEDDING_BACKEND, EMBEDDING_LOCAL_MODEL,
+                               EMBEDDING_CACHE_SIZE)
+  nodes = [ConceptNode(node) for node in load_nodes(memory_stream_dir)
+           if node.get("content")]
+  provider = embedding_provider.get_provider()
+  vectors = np.concatenate([
+    np.asarray(provider.embed_batch([node.content for node
+                                     in nodes[start:start + batch_size]]),
+               dtype=np.float32)
+    for start in range(0, len(nodes), batch_size)]) if nodes else None
+  return nodes, vectors
+
+
+def benchmark_recall(nodes, vectors, k=30, queries=64,
+                     nprobe_values=(1, 2, 4, 8, 16, 32, 64),
+                     hp=(0, 1, 0.5), seed=0):
+  """
+  Compares IVF-backed retrieval against exact search. queries of the rows
+  are held out and used as queries against the rest. For every nprobe it
+  reports recall@k of the pure relevance ranking and of the blended
+  retrieve() ranking, plus the average query latency.
+
+  Parameters:
+    nodes: objects with node_type, created, last_retrieved and importance
+    vectors: their embeddings, e.g. from memory_vectors()
+    k: n_count of the retrieval
+    queries: number of held-out rows used as queries
+    nprobe_values: nprobe settings to evaluate
+    hp: [recency_w, relevance_w, importance_w] for the blended ranking, by
+      default the weights MemoryStream.retrieve uses
+  Returns:
+    A list of dicts, one per nprobe.
+  """
+  from genagents.modules.retrieval_engine import RetrievalEngine, top_k_indices
+
+  rng = np.random.default_rng(seed)
+  held_out = np.zeros(len(nodes), dtype=bool)
+  held_out[rng.choice(len(nodes), queries, replace=False)] = True
+  query_vectors = vectors[held_out]
+
+  engine = RetrievalEngine()
+  engine.ann.min_rows = len(nodes) + 1
+  for node, vector, skip in zip(nodes, vectors, held_out):
+    if not skip:
+      engine.append(node, vector)
+  rows = engine.candidate_rows("all")
+
+  def run(queries):
+    relevance_hits, blend_hits, started = [], [], time.time()
+    for query in queries:
+      relevance_hits.append(top_k_indices(engine.relevance(rows, query), k))
+      blend_hits.append(top_k_indices(engine.score(rows, query, hp, k)[0], k))
+    return relevance_hits, blend_hits, (time.time() - started) / len(queries)
+
+  exact_relevance, exact_blend, exact_latency = run(query_vectors)
+
+  # Train without the recall gate, the point here is to measure recall.
+  engine.ann.min_rows = 0
+  engine.ann.min_recall = 0
+  engine.ann.train(engine._matrix, engine._norms, engine._has_embedding,
+                   engine.size)
+  results = []
+  for nprobe in nprobe_values:
+    engine.ann.nprobe = nprobe
+    ann_relevance, ann_blend, latency = run(query_vectors)
+    recall = np.mean([np.intersect1d(a, b).size / k
+                      for a, b in zip(exact_relevance, ann_relevance)])
+    blend_recall = np.mean([np.intersect1d(a, b).size / k
+                            for a, b in zip(exact_blend, ann_blend)])
+    results.append({"nprobe": nprobe,
+                    "nlist": engine.ann.centroids.shape[0],
+                    "relevance_recall": float(recall),
+                    "retrieve_recall": float(blend_recall),
+                    "latency_ms": latency * 1000,
+                    "exact_latency_ms": exact_latency * 1000})
+  return results
+
+
+if __name__ == "__main__":
+  # Usage: python -m genagents.modules.ann_index <agent memory_stream dir>
+  if len(sys.argv) < 2 or not os.path.isdir(sys.argv[1]):
+    print("usage: python -m genagents.modules.ann_index <memory_stream_dir>")
+    sys.exit(1)
+  nodes, vectors = memory_vectors(sys.argv[1])
+  if len(nodes) < 1024:
+    print(f"only {len(nodes)} memories, too few to benchmark")
+    sys.exit(1)
+  for r in benchmark_recall(nodes, vectors):
+    print(f"nlist={r['nlist']:4d} nprobe={r['nprobe']:3d}  "
+          f"relevance recall@30={r['relevance_recall']:.3f}  "
+          f"retrieve recall@30={r['retrieve_recall']:.3f}  "
+          f"{r['latency_ms']:.2f}ms (exact {r['exact_latency_ms']:.2f}ms)")
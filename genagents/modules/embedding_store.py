@@ -0,0 +1,400 @@
+import os
+import sys
+import json
+from collections.abc import MutableMapping
+
+import numpy as np
+
+
+# ##############################################################################
+# ###                            EMBEDDING STORE                             ###
+# ##############################################################################
+
+# On-disk layout inside <agent_folder>/memory_stream/:
+#   embeddings.f32         raw little-endian float32 matrix, one row per node
+#   embeddings.index.json  sidecar with the matrix shape, the node_ids whose
+#                          row holds no embedding and, once nodes have been
+#                          dropped (e.g. archived by memory tiering), "ids":
+#                          the node_id of every row as [first_id, length]
+#                          runs. Without "ids", row i is node_id i.
+# embeddings.json (content str -> list of floats) is the legacy format; it is
+# still read when no binary store exists and removed once the binary store has
+# been written.
+EMBEDDINGS_BIN = "embeddings.f32"
+EMBEDDINGS_INDEX = "embeddings.index.json"
+LEGACY_EMBEDDINGS_JSON = "embeddings.json"
+STORE_VERSION = 2
+
+
+def _id_runs(ids):
+  runs = []
+  for node_id in ids:
+    if runs and runs[-1][0] + runs[-1][1] == node_id:
+      runs[-1][1] += 1
+    else:
+      runs.append([node_id, 1])
+  return runs
+
+
+def _expand_runs(runs):
+  return [start + i for start, length in runs for i in range(length)]
+
+
+def _write_json_atomic(path, data):
+  tmp_path = f"{path}.tmp"
+  with open(tmp_path, "w", encoding="utf-8") as f:
+    json.dump(data, f, ensure_ascii=False)
+    f.flush()
+    os.fsync(f.fileno())
+  os.replace(tmp_path, path)
+
+
+def has_embedding_store(memory_stream_dir):
+  """
+  Returns True if memory_stream_dir holds embeddings in either the binary or
+  the legacy JSON format.
+  """
+  if os.path.exists(os.path.join(memory_stream_dir, EMBEDDINGS_INDEX)):
+    return True
+  legacy_path = os.path.join(memory_stream_dir, LEGACY_EMBEDDINGS_JSON)
+  return os.path.exists(legacy_path) and os.path.getsize(legacy_path) > 2
+
+
+class EmbeddingStore(MutableMapping):
+  """
+  Embeddings of a memory stream backed by a memory-mapped float32 matrix.
+
+  It keeps the dict interface the memory stream has always used (content str
+  -> vector), so MemoryStream and the retrieval engine need no changes, but
+  nothing is parsed at load time: rows are read from the memmap only when a
+  content is looked up. Embeddings added since the last save are kept as
+  float32 rows keyed by node_id (content only for texts no node is bound to
+  yet) and appended to the matrix by save().
+  """
+  def __init__(self, memory_stream_dir=None, seq_nodes=()):
+    self.dim = None
+    self._count = 0
+    self._missing = set()
+    # node_id -> row, or None while row i is node_id i
+    self._rows = None
+    self._matrix = None
+    self._pending = dict()
+    self._pending_rows = dict()
+    self._content_to_id = dict()
+
+    if memory_stream_dir:
+      self._open(memory_stream_dir)
+    self.bind(seq_nodes)
+
+
+  def _open(self, memory_stream_dir):
+    index_path = os.path.join(memory_stream_dir, EMBEDDINGS_INDEX)
+    bin_path = os.path.join(memory_stream_dir, EMBEDDINGS_BIN)
+    if not os.path.exists(index_path) or not os.path.exists(bin_path):
+      return
+    with open(index_path, "r", encoding="utf-8") as f:
+      index = json.load(f)
+    self.dim = index.get("dim")
+    self._count = int(index.get("count", 0))
+    self._missing = set(index.get("missing", []))
+    runs = index.get("ids")
+    self._rows = (None if runs is None else
+                  {node_id: row for row, node_id in enumerate(_expand_runs(runs))})
+    if self._count > 0 and self.dim:
+      self._matrix = np.memmap(bin_path, dtype="<f4", mode="r",
+                               shape=(self._count, self.dim))
+
+
+  def close(self):
+    """
+    Drops the memory map so the underlying file can be replaced.
+    """
+    self._matrix = None
+
+
+  def bind(self, seq_nodes):
+    """
+    Rebuilds the content -> node_id lookup from the memory stream's nodes.
+    The keys are the nodes' own content strings, so no text is duplicated.
+    """
+    self._content_to_id = dict()
+    for node in seq_nodes:
+      self._content_to_id.setdefault(node.content, node.node_id)
+    for content in [c for c in self._pending if c in self._content_to_id]:
+      self._pending_rows[self._content_to_id[content]] = self._pending.pop(content)
+
+
+  def _stored_ids(self):
+    """The node_id of every stored row, in row order."""
+    if self._rows is None:
+      return list(range(self._count))
+    return sorted(self._rows, key=self._rows.get)
+
+
+  def _stored_row(self, node_id):
+    if self._matrix is None or node_id is None or node_id in self._missing:
+      return None
+    row = node_id if self._rows is None else self._rows.get(node_id)
+    if row is None or row >= self._count:
+      return None
+    return self._matrix[row]
+
+
+  def __getitem__(self, content):
+    node_id = self._content_to_id.get(content)
+    if node_id in self._pending_rows:
+      return self._pending_rows[node_id]
+    if content in self._pending:
+      return self._pending[content]
+    row = self._stored_row(node_id)
+    if row is None:
+      raise KeyError(content)
+    return row
+
+
+  def __setitem__(self, content, embedding):
+    vec = self._valid_vector(embedding)
+    if vec is not None:
+      embedding = vec
+    node_id = self._content_to_id.get(content)
+    if node_id is None:
+      self._pending[content] = embedding
+    else:
+      self._pending.pop(content, None)
+      self._pending_rows[node_id] = embedding
+
+
+  def __delitem__(self, content):
+    node_id = self._content_to_id.get(content)
+    if content in self._pending:
+      del self._pending[content]
+    elif node_id in self._pending_rows:
+      del self._pending_rows[node_id]
+    elif node_id is not None:
+      self._missing.add(self._content_to_id.pop(content))
+    else:
+      raise KeyError(content)
+
+
+  def __iter__(self):
+    for content in self._pending:
+      yield content
+    for content, node_id in self._content_to_id.items():
+      if (content not in self._pending
+          and (node_id in self._pending_rows
+               or self._stored_row(node_id) is not None)):
+        yield content
+
+
+  def __len__(self):
+    return sum(1 for _ in self)
+
+
+  @property
+  def pending_count(self):
+    """
+    The number of embeddings held in memory until the next save().
+    """
+    return len(self._pending_rows) + len(self._pending)
+
+
+  def _valid_vector(self, embedding):
+    if embedding is None:
+      return None
+    try:
+      vec = np.array(embedding, dtype="<f4").reshape(-1)
+    except (TypeError, ValueError):
+      return None
+    if vec.size == 0 or (self.dim and vec.size != self.dim):
+      return None
+    return vec
+
+
+  def save(self, memory_stream_dir, seq_nodes):
+    """
+    Persists the embeddings of seq_nodes. Rows for nodes that already exist on
+    disk are left untouched; new rows are appended to embeddings.f32 and the
+    sidecar is replaced atomically. The matrix is only rewritten in full when
+    older rows changed or stored nodes are gone (e.g. archived), and then
+    holds rows for the nodes of seq_nodes only, so the file never keeps rows
+    for dropped nodes.
+
+    Parameters:
+      memory_stream_dir: the agent's memory_stream folder
+      seq_nodes: the MemoryStream's list of ConceptNodes
+    Returns:
+      None
+    """
+    os.makedirs(memory_stream_dir, exist_ok=True)
+    bin_path = os.path.join(memory_stream_dir, EMBEDDINGS_BIN)
+    index_path = os.path.join(memory_stream_dir, EMBEDDINGS_INDEX)
+
+    self.bind(seq_nodes)
+    id_to_content = {node.node_id: node.content for node in seq_nodes}
+    live_ids = sorted(id_to_content)
+
+    if self.dim is None:
+      for embedding in [*self._pending_rows.values(), *self._pending.values()]:
+        vec = self._valid_vector(embedding)
+        if vec is not None:
+          self.dim = int(vec.size)
+          break
+    if self.dim is None:
+      # Nothing to store yet.
+      self.close()
+      with open(bin_path, "wb"):
+        pass
+      _write_json_atomic(index_path, {"version": STORE_VERSION, "dim": None,
+                                      "count": 0, "missing": []})
+      self._count = 0
+      self._missing = set()
+      self._rows = None
+      self._remove_legacy(memory_stream_dir)
+      return
+
+    # Older rows only need rewriting if a node that was saved without an
+    # embedding got one since, or if stored nodes were dropped. New nodes
+    # are appended as long as their ids follow the stored ones.
+    stored_ids = self._stored_ids()
+    stored = set(stored_ids)
+    new_ids = [node_id for node_id in live_ids if node_id not in stored]
+    rewrite = (self._matrix is None and self._count > 0
+               or not os.path.exists(bin_path)
+               or any(node_id not in id_to_content for node_id in stored_ids)
+               or bool(stored_ids and new_ids and new_ids[0] < stored_ids[-1]))
+    if not rewrite:
+      rewrite = any(node_id in stored and node_id in self._missing
+                    for node_id in self._pending_rows)
+    row_ids = live_ids if rewrite else stored_ids + new_ids
+    start = 0 if rewrite else len(stored_ids)
+
+    missing = set() if rewrite else self._missing & stored
+    block = np.zeros((len(row_ids) - start, self.dim), dtype="<f4")
+    for offset, node_id in enumerate(row_ids[start:]):
+      # Duplicate contents share the row of their first node.
+      source_id = self._content_to_id[id_to_content[node_id]]
+      if source_id in self._pending_rows:
+        vec = self._valid_vector(self._pending_rows[source_id])
+      else:
+        vec = self._stored_row(source_id)
+      if vec is None:
+        missing.add(node_id)
+      else:
+        block[offset] = vec
+
+    self.close()
+    if rewrite:
+      tmp_path = f"{bin_path}.tmp"
+      with open(tmp_path, "wb") as f:
+        f.write(block.tobytes())
+        f.flush()
+        os.fsync(f.fileno())
+      os.replace(tmp_path, bin_path)
+    else:
+      with open(bin_path, "r+b") as f:
+        # Drop a tail left behind by an interrupted save before appending.
+        f.truncate(len(stored_ids) * self.dim * 4)
+        f.seek(0, os.SEEK_END)
+        f.write(block.tobytes())
+        f.flush()
+        os.fsync(f.fileno())
+
+    index = {"version": STORE_VERSION, "dim": self.dim,
+             "count": len(row_ids), "missing": sorted(missing)}
+    identity = not row_ids or row_ids[-1] == len(row_ids) - 1
+    if not identity:
+      index["ids"] = _id_runs(row_ids)
+    _write_json_atomic(index_path, index)
+    self._count = len(row_ids)
+    self._missing = missing
+    self._pending_rows = dict()
+    self._open(memory_stream_dir)
+    self._remove_legacy(memory_stream_dir)
+
+
+  def _remove_legacy(self, memory_stream_dir):
+    legacy_path = os.path.join(memory_stream_dir, LEGACY_EMBEDDINGS_JSON)
+    if os.path.exists(legacy_path):
+      os.remove(legacy_path)
+
+
+def load_embeddings(memory_stream_dir, seq_nodes):
+  """
+  Opens the embeddings of a memory stream folder. The binary store is memory
+  mapped; a legacy embeddings.json is parsed once and kept as pending rows so
+  that the next save converts it.
+
+  Parameters:
+    memory_stream_dir: the agent's memory_stream folder
+    seq_nodes: the MemoryStream's list of ConceptNodes
+  Returns:
+    An EmbeddingStore
+  """
+  if os.path.exists(os.path.join(memory_stream_dir, EMBEDDINGS_INDEX)):
+    return EmbeddingStore(memory_stream_dir, seq_nodes)
+
+  store = EmbeddingStore(None, seq_nodes)
+  legacy_path = os.path.join(memory_stream_dir, LEGACY_EMBEDDINGS_JSON)
+  if os.path.exists(legacy_path) and os.path.getsize(legacy_path) > 2:
+    with open(legacy_path, "r", encoding="utf-8") as f:
+      store.update(json.load(f))
+  return store
+
+
+def save_embeddings(embeddings, memory_stream_dir, seq_nodes):
+  """
+  Saves embeddings (an EmbeddingStore or a plain content -> vector dict) of
+  seq_nodes into memory_stream_dir and returns the EmbeddingStore that now
+  backs them.
+  """
+  if not isinstance(embeddings, EmbeddingStore):
+    store = load_embeddings(memory_stream_dir, seq_nodes)
+    store.update(embeddings or {})
+    embeddings = store
+  embeddings.save(memory_stream_dir, seq_nodes)
+  return embeddings
+
+
+def migrate_memory_dir(memory_root, keep_backup=True):
+  """
+  One-shot migration of every agent folder under memory_root (e.g. the
+  memory/User_* directories) from embeddings.json to the binary store.
+
+  Parameters:
+    memory_root: the top-level memory folder
+    keep_backup: keep the old file as embeddings.json.bak
+  Returns:
+    The list of memory_stream folders that were migrated.
+  """
+  from genagents.modules.memory_stream import ConceptNode
+
+  migrated = []
+  for root, dirs, files in os.walk(memory_root):
+    if (os.path.basename(root) != "memory_stream"
+        or LEGACY_EMBEDDINGS_JSON not in files):
+      continue
+    nodes = []
+    nodes_path = os.path.join(root, "nodes.json")
+    if os.path.exists(nodes_path) and os.path.getsize(nodes_path) > 2:
+      with open(nodes_path, "r", encoding="utf-8") as f:
+        nodes = [ConceptNode(node) for node in json.load(f)]
+
+    legacy_path = os.path.join(root, LEGACY_EMBEDDINGS_JSON)
+    if keep_backup:
+      with open(legacy_path, "rb") as src, open(f"{legacy_path}.bak", "wb") as dst:
+        dst.write(src.read())
+    store = EmbeddingStore(None, nodes)
+    with open(legacy_path, "r", encoding="utf-8") as f:
+      content = f.read().strip()
+    store.update(json.loads(content) if content else {})
+    store.save(root, nodes)
+    migrated.append(root)
+    print(f"已迁移: {root} ({len(nodes)} 个节点)")
+  return migrated
+
+
+if __name__ == "__main__":
+  # Usage: python -m genagents.modules.embedding_store [memory_root]
+  memory_root = sys.argv[1] if len(sys.argv) > 1 else "memory"
+  migrated = migrate_memory_dir(memory_root)
+  print(f"迁移完成，共 {len(migrated)} 个记忆目录")
@@ -12,6 +12,8 @@ from simulation_engine.settings import *
 from simulation_engine.global_methods import *
 from simulation_engine.gpt_structure import *
 from simulation_engine.llm_json_parser import *
+from genagents.modules.retrieval_engine import RetrievalEngine, top_k_indices
+from genagents.modules.embedding_store import EmbeddingStore
 
 
 def run_gpt_generate_importance(
@@ -393,12 +395,22 @@ def extract_relevance(seq_nodes, embeddings, focal_pt):
 # ###                              CONCEPT NODE                              ###
 # ##############################################################################
 
+def _intern(value): 
+  return sys.intern(value) if type(value) is str else value
+
+
 class ConceptNode: 
+  # Nodes are kept for every loaded agent, so they carry no __dict__; content 
+  # and node_type strings are interned, which also lets the embedding store 
+  # and the agents' nodes share one copy of each text. 
+  __slots__ = ("node_id", "node_type", "content", "importance", "created", 
+               "last_retrieved", "pointer_id")
+
   def __init__(self, node_dict): 
     # Loading the content of a memory node in the memory stream. 
     self.node_id = node_dict["node_id"]
-    self.node_type = node_dict["node_type"]
-    self.content = node_dict["content"]
+    self.node_type = _intern(node_dict["node_type"])
+    self.content = _intern(node_dict["content"])
     self.importance = node_dict["importance"]
     # 确保created是整数类型
     self.created = int(node_dict["created"]) if node_dict["created"] is not None else 0
@@ -442,8 +454,28 @@ class MemoryStream:
       self.seq_nodes += [new_node]
       self.id_to_node[new_node.node_id] = new_node
 
+    # Embeddings are held by an EmbeddingStore keyed by node_id, so a plain 
+    # content -> vector dict is converted (and its text keys dropped) here. 
+    if isinstance(embeddings, EmbeddingStore): 
+      embeddings.bind(self.seq_nodes)
+    elif embeddings is not None: 
+      store = EmbeddingStore(None, self.seq_nodes)
+      store.update(embeddings)
+      embeddings = store
     self.embeddings = embeddings
 
+    # Column store used for scoring; rebuilt lazily whenever seq_nodes or 
+    # embeddings are replaced from the outside. 
+    self.engine = RetrievalEngine()
+
+    # Optional NodeJournal that persists every new node and last_retrieved 
+    # update as it happens. 
+    self.journal = None
+
+    # Optional MemoryTiering; when set, retrieve() falls back to its cold 
+    # archive for queries the hot nodes answer poorly. 
+    self.tiering = None
+
 
   def count_observations(self): 
     """
@@ -462,8 +494,36 @@ class MemoryStream:
     return count
 
 
+  def mark_retrieved(self, nodes, time_step): 
+    """
+    Applies what a stateful retrieve() does to the nodes it returns to nodes 
+    that came from a stateless one: their last_retrieved, the retrieval 
+    engine's recency column and the journal. Lets a caller record a 
+    retrieval only once it knows the nodes were actually used. Archived 
+    fallback nodes are copies and are left alone, as in retrieve(). 
+
+    Parameters:
+      nodes: ConceptNodes returned by retrieve(..., stateless=True)
+      time_step: the time_step the retrieval was made at
+    Returns: 
+      None
+    """
+    hot = [node for node in nodes 
+           if self.id_to_node.get(node.node_id) is node]
+    if not hot: 
+      return
+    self.engine.sync(self.seq_nodes, self.embeddings)
+    hot_ids = {node.node_id for node in hot}
+    rows = [row for row, node in enumerate(self.seq_nodes) 
+            if node.node_id in hot_ids]
+    for node in hot: 
+      node.last_retrieved = time_step
+    self.engine.mark_retrieved(rows, time_step)
+    self._journal("mark_retrieved", [node.node_id for node in hot], time_step)
+
+
   def retrieve(self, focal_points, time_step, n_count=120, curr_filter="all",
-               hp=[0, 1, 0.5], stateless=False, verbose=False): 
+               hp=[0, 1, 0.5], stateless=False, verbose=False, ranked=False): 
     """
     Retrieve elements from the memory stream. 
 
@@ -476,81 +536,90 @@ class MemoryStream:
         Acceptable values are 'all', 'reflection', 'observation' 
       hp: Hyperparameter for [recency_w, relevance_w, importance_w]
       verbose: verbose
+      ranked: if True, the nodes are returned best score first (archived 
+        fallback nodes last) instead of in creation order 
     Returns: 
       retrieved: A dictionary whose keys are a focal_pt query str, and whose
         values are a list of nodes that are retrieved for that query str. 
     """
-    curr_nodes = []
-
     # If the memory stream is empty, we return an empty dictionary.
     if len(self.seq_nodes) == 0:
       return dict()
 
-    # Filtering for the desired node type. curr_filter can be one of the three
-    # elements: 'all', 'reflection', 'observation' 
-    if curr_filter == "all": 
-      curr_nodes = self.seq_nodes
-    else: 
-      for curr_node in self.seq_nodes: 
-        if curr_node.node_type == curr_filter: 
-          curr_nodes += [curr_node]
-
     # 确保embeddings不为None
     if self.embeddings is None:
       print("警告: 在retrieve方法中，embeddings为None，初始化为空字典")
       self.embeddings = {}
 
+    # Filtering for the desired node type. curr_filter can be one of the three
+    # elements: 'all', 'reflection', 'observation' 
+    self.engine.sync(self.seq_nodes, self.embeddings)
+    rows = self.engine.candidate_rows(curr_filter)
+    if rows.size == 0: 
+      return {focal_pt: [] for focal_pt in focal_points}
+
+    # All focal points are embedded in one batch and scored together: the 
+    # query-independent recency and importance columns are shared, and the 
+    # relevance of every focal point is one (queries x nodes) product. 
+    try:
+      focal_embeddings = get_text_embeddings(list(focal_points))
+    except Exception as e:
+      print(f"获取焦点嵌入向量时出错: {str(e)}")
+      focal_embeddings = [None] * len(focal_points)
+    scores = self.engine.score_batch(rows, focal_embeddings, hp, n_count)
+
     # <retrieved> is the main dictionary that we are returning
     retrieved = dict() 
-    for focal_pt in focal_points: 
-      # Calculating the component dictionaries and normalizing them.
-      x = extract_recency(curr_nodes)
-      recency_out = normalize_dict_floats(x, 0, 1)
-      x = extract_importance(curr_nodes)
-      importance_out = normalize_dict_floats(x, 0, 1)  
-      x = extract_relevance(curr_nodes, self.embeddings, focal_pt)
-      relevance_out = normalize_dict_floats(x, 0, 1)
-      
-      # Computing the final scores that combines the component values. 
-      master_out = dict()
-      for key in recency_out.keys(): 
-        recency_w = hp[0]
-        relevance_w = hp[1]
-        importance_w = hp[2]
-        master_out[key] = (recency_w * recency_out[key]
-                         + relevance_w * relevance_out[key] 
-                         + importance_w * importance_out[key])
-
+    for focal_pt, focal_embedding, (master_out, recency_out, relevance_out, 
+        importance_out) in zip(focal_points, focal_embeddings, scores): 
       if verbose: 
-        master_out = top_highest_x_values(master_out, len(master_out.keys()))
-        for key, val in master_out.items(): 
-          print (self.id_to_node[key].content, val)
-          print (recency_w*recency_out[key]*1, 
-                 relevance_w*relevance_out[key]*1, 
-                 importance_w*importance_out[key]*1)
-
-      # Extracting the highest x values.
-      # <master_out> has the key of node.id and value of float. Once we get  
-      # the highest x values, we want to translate the node.id into nodes 
-      # and return the list of nodes.
-      master_out = top_highest_x_values(master_out, n_count)
-      master_nodes = [self.id_to_node[key] for key in list(master_out.keys())]
-
-      # **Sort the master_nodes list by last_retrieved in descending order**
-      master_nodes = sorted(master_nodes, key=lambda node: node.created, reverse=False)
+        for i in top_k_indices(master_out, master_out.shape[0]): 
+          print (self.seq_nodes[rows[i]].content, master_out[i])
+          print (hp[0]*recency_out[i], 
+                 hp[1]*relevance_out[i], 
+                 hp[2]*importance_out[i])
+
+      # Extracting the highest x values and translating the rows back into 
+      # nodes. 
+      top_rows = rows[top_k_indices(master_out, n_count)]
+      master_nodes = [self.seq_nodes[row] for row in top_rows]
+
+      # Archived nodes are only looked at when the best hot match is weak. 
+      # They are copies from the cold tier, so their last_retrieved is left 
+      # alone below. 
+      cold_nodes = []
+      if (self.tiering is not None and self.tiering.fallback_enabled 
+          and top_rows.size): 
+        best = float(self.engine.relevance(top_rows, focal_embedding, 
+                                           exact=True).max())
+        cold_nodes = self.tiering.fallback(focal_embedding, best)
+
+      # **Sort the master_nodes list by created in ascending order**
+      if not ranked: 
+        master_nodes = sorted(master_nodes, key=lambda node: node.created, reverse=False)
 
       # We do not want to update the last retrieved time_step for these nodes
       # if we are in a stateless mode. 
       if not stateless: 
         for n in master_nodes: 
           n.last_retrieved = time_step
+        self.engine.mark_retrieved(top_rows, time_step)
+        self._journal("mark_retrieved", 
+                      [n.node_id for n in master_nodes], time_step)
+
+      if cold_nodes and ranked: 
+        master_nodes = master_nodes + cold_nodes
+      elif cold_nodes: 
+        master_nodes = sorted(master_nodes + cold_nodes, 
+                              key=lambda node: node.created)
         
       retrieved[focal_pt] = master_nodes
     
     return retrieved 
 
 
-  def _add_node(self, time_step, node_type, content, importance, pointer_id):
+  def _add_node(self, time_step, node_type, content, importance, pointer_id, 
+                embedding=None):
     """
     Adding a new node to the memory stream. 
 
@@ -560,12 +629,16 @@ class MemoryStream:
       content: the str content of the memory record
       importance: int score of the importance score
       pointer_id: the str of the parent node 
+      embedding: the content's embedding if the caller already computed it 
+        (e.g. as part of a batch); computed here otherwise 
     Returns: 
       retrieved: A dictionary whose keys are a focal_pt query str, and whose
         values are a list of nodes that are retrieved for that query str. 
     """
     node_dict = dict()
-    node_dict["node_id"] = len(self.seq_nodes)
+    # Ids keep counting past nodes that were moved to the archive. 
+    node_dict["node_id"] = (self.seq_nodes[-1].node_id + 1 
+                            if self.seq_nodes else 0)
     node_dict["node_type"] = node_type
     node_dict["content"] = content
     node_dict["importance"] = importance
@@ -582,16 +655,59 @@ class MemoryStream:
         self.embeddings = {}
     
     try:
-        self.embeddings[content] = get_text_embedding(content)
+        if embedding is None:
+          embedding = get_text_embedding(content)
+        self.embeddings[content] = embedding
     except Exception as e:
         print(f"获取文本嵌入时出错: {str(e)}")
         # 如果获取嵌入失败，使用空列表代替
         self.embeddings[content] = []
 
+    # Keep the column store in step with seq_nodes. 
+    self.engine.track(self.seq_nodes, self.embeddings, new_node, 
+                      self.embeddings[content])
+    self._journal("append_node", new_node)
+
+
+  def _journal(self, method, *args):
+    if self.journal is None:
+      return
+    try:
+      getattr(self.journal, method)(*args)
+    except Exception as e:
+      print(f"写入记忆日志时出错: {str(e)}")
 
-  def remember(self, content, time_step=0):
-    score = generate_importance_score([content])[0]
-    self._add_node(time_step, "observation", content, score, None)
+
+  def restore_embeddings(self): 
+    """
+    Recomputes the embeddings of nodes that have none, e.g. nodes replayed 
+    from the journal after a crash that happened before the embeddings were 
+    saved. 
+
+    Parameters:
+      None
+    Returns: 
+      The number of embeddings that were recomputed. 
+    """
+    if self.embeddings is None:
+      self.embeddings = {}
+    missing = list(dict.fromkeys(node.content for node in self.seq_nodes 
+                                 if node.content not in self.embeddings))
+    if not missing: 
+      return 0
+    try:
+      for content, embedding in zip(missing, get_text_embeddings(missing)): 
+        self.embeddings[content] = embedding
+    except Exception as e:
+      print(f"获取文本嵌入时出错: {str(e)}")
+      return 0
+    return len(missing)
+
+
+  def remember(self, content, time_step=0, importance=None):
+    if importance is None: 
+      importance = generate_importance_score([content])[0]
+    self._add_node(time_step, "observation", content, importance, None)
 
 
   def reflect(self, anchor, reflection_count=5, 
@@ -601,6 +717,12 @@ class MemoryStream:
     reflections = generate_reflection(records, anchor, reflection_count)
     scores = generate_importance_score(reflections)
 
+    try:
+      embeddings = get_text_embeddings(reflections)
+    except Exception as e:
+      print(f"获取文本嵌入时出错: {str(e)}")
+      embeddings = [None] * len(reflections)
+
     for count, reflection in enumerate(reflections): 
       self._add_node(time_step, "reflection", reflections[count], 
-                     scores[count], record_ids)
+                     scores[count], record_ids, embeddings[count])
@@ -0,0 +1,277 @@
+import os
+
+import numpy as np
+
+from simulation_engine.settings import *
+from simulation_engine import embedding_provider
+from genagents.modules.embedding_store import (
+  EmbeddingStore, has_embedding_store, load_embeddings, save_embeddings)
+from genagents.modules.memory_stream import ConceptNode, generate_reflection
+from genagents.modules.node_journal import NodeJournal, load_nodes
+from genagents.modules.retrieval_engine import top_k_indices
+
+
+# ##############################################################################
+# ###                              COLD ARCHIVE                              ###
+# ##############################################################################
+
+# Archived nodes live in <agent_folder>/memory_stream/archive/, in the same
+# formats as the hot tier: nodes.json + nodes.journal.jsonl, embeddings.f32 +
+# embeddings.index.json. Node ids are kept, so pointer_ids keep resolving.
+ARCHIVE_DIR = "archive"
+
+# Anchor used to fold a batch of archived observations into one reflection.
+SUMMARY_ANCHOR = "对这段时间经历的总结"
+
+
+class MemoryArchive:
+  """
+  The cold tier of one memory stream. Nothing is read until the first search
+  or add. The first search gathers the archived vectors into one normalized
+  float32 matrix, which is kept until the next add().
+  """
+  def __init__(self, memory_stream_dir):
+    self.archive_dir = os.path.join(memory_stream_dir, ARCHIVE_DIR)
+    self._nodes = None
+    self._embeddings = None
+    self._journal = None
+    self._matrix = None
+    self._matrix_nodes = None
+
+
+  def _load(self):
+    if self._nodes is not None:
+      return
+    self._nodes = [ConceptNode(node) for node in load_nodes(self.archive_dir)]
+    if has_embedding_store(self.archive_dir):
+      self._embeddings = load_embeddings(self.archive_dir, self._nodes)
+    else:
+      self._embeddings = EmbeddingStore(None, self._nodes)
+    self._journal = NodeJournal(self.archive_dir)
+
+
+  def __len__(self):
+    self._load()
+    return len(self._nodes)
+
+
+  def add(self, nodes, embeddings):
+    """
+    Moves nodes (and their embeddings) into the archive. Nodes that are
+    already archived, e.g. after a crash halfway through tiering, are skipped.
+
+    Parameters:
+      nodes: ConceptNodes to archive
+      embeddings: their embedding vectors (or None), aligned with nodes
+    Returns:
+      None
+    """
+    self._load()
+    archived = {node.node_id for node in self._nodes}
+    for node, embedding in zip(nodes, embeddings):
+      if node.node_id in archived:
+        continue
+      self._nodes.append(node)
+      if embedding is not None:
+        self._embeddings[node.content] = embedding
+      self._journal.append_node(node)
+    self._nodes.sort(key=lambda node: node.node_id)
+    self._embeddings = save_embeddings(self._embeddings, self.archive_dir,
+                                       self._nodes)
+    self._matrix = None
+    self._matrix_nodes = None
+    if self._journal.needs_compaction():
+      self._journal.compact(self._nodes)
+
+
+  def _unit_matrix(self, dim):
+    """
+    Returns (nodes, matrix): the archived nodes that have a dim-sized,
+    non-zero embedding and their unit vectors as one float32 matrix.
+    """
+    if self._matrix is not None and self._matrix.shape[1] == dim:
+      return self._matrix_nodes, self._matrix
+    nodes = []
+    matrix = np.empty((len(self._nodes), dim), dtype=np.float32)
+    for node in self._nodes:
+      vector = self._embeddings.get(node.content)
+      if vector is not None and len(vector) == dim:
+        matrix[len(nodes)] = vector
+        nodes.append(node)
+    matrix = matrix[:len(nodes)]
+    norms = np.linalg.norm(matrix, axis=1)
+    usable = norms > 0
+    self._matrix = matrix[usable] / norms[usable, None]
+    self._matrix_nodes = [node for node, ok in zip(nodes, usable) if ok]
+    return self._matrix_nodes, self._matrix
+
+
+  def search(self, focal_embedding, n_count):
+    """
+    Returns up to n_count (node, cosine similarity) pairs of the archived
+    nodes most relevant to focal_embedding, best first.
+    """
+    self._load()
+    if focal_embedding is None or not self._nodes:
+      return []
+    query = np.asarray(focal_embedding, dtype=np.float32).reshape(-1)
+    query_norm = float(np.linalg.norm(query))
+    if query_norm == 0:
+      return []
+    nodes, matrix = self._unit_matrix(query.size)
+    if not nodes:
+      return []
+    scores = matrix @ (query / query_norm)
+    return [(nodes[i], float(scores[i]))
+            for i in top_k_indices(scores, n_count)]
+
+
+# ##############################################################################
+# ###                             MEMORY TIERING                             ###
+# ##############################################################################
+
+class MemoryTiering:
+  """
+  Keeps the live MemoryStream bounded. run() moves observations that are
+  neither recent nor important into the MemoryArchive, folding every batch
+  of them into a reflection that stays hot. retrieve() only consults the
+  archive when the best hot node is a poor match for the query, and only
+  with a real embedding backend: mock vectors are random, so their cosine
+  similarities say nothing about relevance.
+
+  Parameters:
+    max_hot: number of nodes the hot tier may hold before run() archives
+      (0 disables tiering)
+    recent_window: the newest nodes that are never archived
+    keep_importance: observations at or above this importance stay hot
+    batch_size: observations folded into one summary reflection
+    fallback_threshold: the archive is searched when the best raw cosine
+      similarity among the hot results is below this
+    fallback_count: archived nodes added to a retrieval at most
+  """
+  def __init__(self, memory_stream_dir, max_hot=MEMORY_HOT_MAX_NODES,
+               recent_window=500, keep_importance=80, batch_size=50,
+               fallback_threshold=0.35, fallback_count=5, summarize=True):
+    self.memory_stream_dir = memory_stream_dir
+    self.archive = MemoryArchive(memory_stream_dir)
+    self.max_hot = max_hot
+    self.recent_window = recent_window
+    self.keep_importance = keep_importance
+    self.batch_size = batch_size
+    self.fallback_threshold = fallback_threshold
+    self.fallback_count = fallback_count
+    self.summarize = summarize
+
+
+  def select_cold(self, memory_stream):
+    """
+    Returns the observations to archive, oldest first: just enough to bring
+    the hot tier back to max_hot, never touching reflections, the
+    recent_window newest nodes or important observations.
+    """
+    seq_nodes = memory_stream.seq_nodes
+    excess = len(seq_nodes) - self.max_hot
+    if not self.max_hot or excess <= 0:
+      return []
+    cold = []
+    for node in seq_nodes[:max(len(seq_nodes) - self.recent_window, 0)]:
+      if node.node_type != "observation":
+        continue
+      try:
+        important = float(node.importance) >= self.keep_importance
+      except (TypeError, ValueError):
+        important = False
+      if not important:
+        cold.append(node)
+    # Every batch adds one summary back, so archive a little more.
+    count = excess
+    while self.summarize and count - -(-count // self.batch_size) < excess:
+      count += 1
+    return cold[:count]
+
+
+  def _summary(self, batch):
+    if not self.summarize:
+      return None
+    try:
+      reflections = generate_reflection(batch, SUMMARY_ANCHOR, 1)
+    except Exception as e:
+      print(f"生成记忆归档总结时出错: {str(e)}")
+      return None
+    return reflections[0] if reflections else None
+
+
+  def run(self, memory_stream, time_step):
+    """
+    Archives cold observations of memory_stream and replaces each batch of
+    them with a summary reflection.
+
+    Parameters:
+      memory_stream: the agent's MemoryStream
+      time_step: current time_step, used for the summary reflections
+    Returns:
+      The number of nodes that were archived.
+    """
+    cold = self.select_cold(memory_stream)
+    if not cold:
+      return 0
+
+    summaries = []
+    for start in range(0, len(cold), self.batch_size):
+      batch = cold[start:start + self.batch_size]
+      self.archive.add(batch, [memory_stream.embeddings.get(node.content)
+                               for node in batch])
+      summary = self._summary(batch)
+      if summary:
+        importance = max(int(float(node.importance or 0)) for node in batch)
+        summaries.append((summary, importance,
+                          [node.node_id for node in batch]))
+
+    # Drop the archived nodes from the hot tier. Rows of the embedding store
+    # are keyed by node_id, so only contents no hot node shares are removed.
+    cold_ids = {node.node_id for node in cold}
+    memory_stream.seq_nodes = [node for node in memory_stream.seq_nodes
+                               if node.node_id not in cold_ids]
+    memory_stream.id_to_node = {node.node_id: node
+                                for node in memory_stream.seq_nodes}
+    hot_contents = {node.content for node in memory_stream.seq_nodes}
+    for node in cold:
+      if node.content not in hot_contents and node.content in memory_stream.embeddings:
+        del memory_stream.embeddings[node.content]
+
+    for summary, importance, pointer_ids in summaries:
+      memory_stream._add_node(time_step, "reflection", summary, importance,
+                              pointer_ids)
+
+    # The journal is additive, so the hot snapshot has to be rewritten for
+    # the archived nodes to stay out of it.
+    memory_stream.embeddings = save_embeddings(
+      memory_stream.embeddings, self.memory_stream_dir, memory_stream.seq_nodes)
+    journal = memory_stream.journal
+    if journal is None or not journal.is_for(self.memory_stream_dir):
+      journal = NodeJournal(self.memory_stream_dir)
+    journal.compact(memory_stream.seq_nodes)
+    print(f"已归档 {len(cold)} 条记忆，新增 {len(summaries)} 条总结")
+    return len(cold)
+
+
+  @property
+  def fallback_enabled(self):
+    return (self.fallback_count > 0 and embedding_provider.get_provider().name
+            != embedding_provider.MockEmbeddingProvider.name)
+
+
+  def fallback(self, focal_embedding, best_hot_relevance):
+    """
+    Returns archived nodes for a query whose hot results are weak (best raw
+    cosine similarity below fallback_threshold), otherwise []. Always []
+    under the mock embedding backend.
+    """
+    if not self.fallback_enabled or best_hot_relevance >= self.fallback_threshold:
+      return []
+    try:
+      hits = self.archive.search(focal_embedding, self.fallback_count)
+    except Exception as e:
+      print(f"检索归档记忆时出错: {str(e)}")
+      return []
+    return [node for node, score in hits if score > best_hot_relevance]
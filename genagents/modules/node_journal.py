@@ -0,0 +1,183 @@
+import os
+import json
+import threading
+
+
+# ##############################################################################
+# ###                              NODE JOURNAL                              ###
+# ##############################################################################
+
+# On-disk layout inside <agent_folder>/memory_stream/:
+#   nodes.json           snapshot, the packaged ConceptNodes (unchanged format)
+#   nodes.journal.jsonl  one JSON record per line, applied on top of the
+#                        snapshot at load time:
+#                          {"op": "add", "node": {...packaged node...}}
+#                          {"op": "retrieved", "ids": [...], "t": time_step}
+# Replaying a record is idempotent (it overwrites by node_id), so a crash
+# between writing a snapshot and truncating the journal is harmless.
+NODES_SNAPSHOT = "nodes.json"
+NODES_JOURNAL = "nodes.journal.jsonl"
+
+# Fold the journal into the snapshot once it holds this many records, or once
+# it is larger than the snapshot itself.
+COMPACT_RECORDS = 500
+
+
+def _read_snapshot(memory_stream_dir):
+  snapshot_path = os.path.join(memory_stream_dir, NODES_SNAPSHOT)
+  if not os.path.exists(snapshot_path) or os.path.getsize(snapshot_path) <= 2:
+    return []
+  with open(snapshot_path, "r", encoding="utf-8") as f:
+    return json.load(f)
+
+
+def _read_journal(memory_stream_dir):
+  """
+  Returns the journal records. A torn trailing line (the process died while
+  writing it) is skipped, so a crash loses at most that last record.
+  """
+  journal_path = os.path.join(memory_stream_dir, NODES_JOURNAL)
+  if not os.path.exists(journal_path):
+    return []
+  records = []
+  with open(journal_path, "r", encoding="utf-8") as f:
+    for line in f:
+      line = line.strip()
+      if not line:
+        continue
+      try:
+        records.append(json.loads(line))
+      except json.JSONDecodeError:
+        print(f"警告: 跳过损坏的记忆日志记录: {journal_path}")
+  return records
+
+
+def has_nodes(memory_stream_dir):
+  """
+  Returns True if memory_stream_dir holds any nodes, either in the snapshot or
+  in the journal.
+  """
+  for name in (NODES_SNAPSHOT, NODES_JOURNAL):
+    path = os.path.join(memory_stream_dir, name)
+    if os.path.exists(path) and os.path.getsize(path) > 2:
+      return True
+  return False
+
+
+def load_nodes(memory_stream_dir):
+  """
+  Loads the packaged nodes of a memory stream: the nodes.json snapshot with
+  the journal replayed on top of it.
+
+  Parameters:
+    memory_stream_dir: the agent's memory_stream folder
+  Returns:
+    A list of node dictionaries ordered by node_id.
+  """
+  nodes = dict()
+  for node in _read_snapshot(memory_stream_dir):
+    nodes[node["node_id"]] = node
+  for record in _read_journal(memory_stream_dir):
+    op = record.get("op")
+    if op == "add" and record.get("node"):
+      nodes[record["node"]["node_id"]] = record["node"]
+    elif op == "retrieved":
+      for node_id in record.get("ids", []):
+        if node_id in nodes:
+          nodes[node_id]["last_retrieved"] = record.get("t")
+  return [nodes[node_id] for node_id in sorted(nodes)]
+
+
+class NodeJournal:
+  """
+  Append-only log of memory stream changes for one memory_stream folder.
+  MemoryStream writes one record per new node and one per retrieval, so
+  persisting a turn costs O(1) regardless of how long the history is; the
+  full nodes.json is only rewritten by compact().
+  """
+  def __init__(self, memory_stream_dir):
+    self.memory_stream_dir = os.path.abspath(memory_stream_dir)
+    self.journal_path = os.path.join(self.memory_stream_dir, NODES_JOURNAL)
+    self.snapshot_path = os.path.join(self.memory_stream_dir, NODES_SNAPSHOT)
+    self._lock = threading.Lock()
+    self.records = len(_read_journal(self.memory_stream_dir))
+    self._repair_tail()
+
+
+  def _repair_tail(self):
+    """
+    Cuts a torn last line so the next record starts on a line of its own.
+    """
+    if not os.path.exists(self.journal_path):
+      return
+    with open(self.journal_path, "rb+") as f:
+      data = f.read()
+      if data and not data.endswith(b"\n"):
+        f.truncate(data.rfind(b"\n") + 1)
+
+
+  def is_for(self, memory_stream_dir):
+    return os.path.abspath(memory_stream_dir) == self.memory_stream_dir
+
+
+  def _append(self, record):
+    line = json.dumps(record, ensure_ascii=False) + "\n"
+    with self._lock:
+      os.makedirs(self.memory_stream_dir, exist_ok=True)
+      # The file is opened per record rather than held open so that clearing
+      # the memory folder keeps working on Windows.
+      with open(self.journal_path, "a", encoding="utf-8") as f:
+        f.write(line)
+        f.flush()
+        os.fsync(f.fileno())
+      self.records += 1
+
+
+  def append_node(self, node):
+    """
+    Records a node that was just added to the memory stream.
+    """
+    self._append({"op": "add", "node": node.package()})
+
+
+  def mark_retrieved(self, node_ids, time_step):
+    """
+    Records a last_retrieved update for the given nodes.
+    """
+    node_ids = [int(node_id) for node_id in node_ids]
+    if node_ids:
+      self._append({"op": "retrieved", "ids": node_ids, "t": time_step})
+
+
+  def needs_compaction(self):
+    if self.records >= COMPACT_RECORDS:
+      return True
+    if not os.path.exists(self.journal_path):
+      return False
+    if not os.path.exists(self.snapshot_path):
+      return self.records > 0
+    return os.path.getsize(self.journal_path) > os.path.getsize(self.snapshot_path)
+
+
+  def compact(self, seq_nodes):
+    """
+    Folds the journal into a fresh nodes.json snapshot of seq_nodes and
+    empties the journal.
+
+    Parameters:
+      seq_nodes: the MemoryStream's list of ConceptNodes
+    Returns:
+      None
+    """
+    with self._lock:
+      os.makedirs(self.memory_stream_dir, exist_ok=True)
+      tmp_path = f"{self.snapshot_path}.tmp"
+      with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump([node.package() for node in seq_nodes],
+                  f, ensure_ascii=False, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+      os.replace(tmp_path, self.snapshot_path)
+      if os.path.exists(self.journal_path):
+        os.remove(self.journal_path)
+      self.records = 0
@@ -0,0 +1,414 @@
+import numpy as np
+
+from genagents.modules.ann_index import IVFIndex
+
+
+# ##############################################################################
+# ###                            RETRIEVAL ENGINE                            ###
+# ##############################################################################
+
+RECENCY_DECAY = 0.99
+DEFAULT_RELEVANCE = 0.5
+DEFAULT_IMPORTANCE = 50.0
+
+# With the IVF index active, this many blended candidates per requested node
+# (and at least RERANK_MIN) are rescored with exact relevance.
+RERANK_FACTOR = 4
+RERANK_MIN = 120
+
+
+def _coerce_int(value):
+  """
+  Mirrors the tolerant int conversion used by extract_recency: strings are
+  parsed, unparsable or missing values fall back to 0.
+  """
+  if value is None:
+    return 0
+  if isinstance(value, str):
+    try:
+      return int(value)
+    except ValueError:
+      return 0
+  return value
+
+
+def _coerce_importance(value):
+  """
+  Mirrors extract_importance: strings are parsed as float, unparsable values
+  fall back to the default importance of 50.
+  """
+  if isinstance(value, str):
+    try:
+      return float(value)
+    except ValueError:
+      return DEFAULT_IMPORTANCE
+  if value is None:
+    return DEFAULT_IMPORTANCE
+  return float(value)
+
+
+def normalize_array(values, target_min=0, target_max=1):
+  """
+  Vectorized counterpart of normalize_dict_floats. Min-max scales the input
+  array to [target_min, target_max]; a constant array collapses to the
+  midpoint value exactly like the dictionary version.
+
+  Parameters:
+    values: 1-D (or 2-D, normalized row by row) numpy array.
+    target_min: The minimum value of the target range.
+    target_max: The maximum value of the target range.
+  Returns:
+    A new float64 array with the normalized values.
+  """
+  values = np.asarray(values, dtype=np.float64)
+  if values.size == 0:
+    return values
+  min_val = values.min(axis=-1, keepdims=True)
+  range_val = values.max(axis=-1, keepdims=True) - min_val
+  flat = range_val == 0
+  safe_range = np.where(flat, 1.0, range_val)
+  out = (values - min_val) * (target_max - target_min) / safe_range + target_min
+  return np.where(flat, (target_max - target_min) / 2, out)
+
+
+def top_k_indices(scores, k):
+  """
+  Returns the positions of the k highest scores, highest first. Ties are
+  broken by position so the result matches a stable descending sort (which
+  is what top_highest_x_values does on an insertion-ordered dict), but only
+  the top-k slice is ever sorted.
+
+  Parameters:
+    scores: 1-D numpy array of scores.
+    k: The number of positions to return.
+  Returns:
+    A 1-D int array of positions into scores.
+  """
+  n = scores.shape[0]
+  if k <= 0 or n == 0:
+    return np.empty(0, dtype=np.int64)
+  if k >= n:
+    return np.argsort(-scores, kind="stable")
+
+  part = np.argpartition(-scores, k - 1)[:k]
+  threshold = scores[part].min()
+  above = np.flatnonzero(scores > threshold)
+  ties = np.flatnonzero(scores == threshold)[:k - above.shape[0]]
+  chosen = np.concatenate([above, ties])
+  return chosen[np.lexsort((chosen, -scores[chosen]))]
+
+
+class RetrievalEngine:
+  """
+  Column store backing MemoryStream.retrieve. Row i always describes
+  seq_nodes[i]: a float32 embedding matrix (with precomputed row norms) plus
+  created, last_retrieved, importance and node type columns. Retrieval is
+  then a single matrix-vector product, vectorized normalization and an
+  argpartition top-k instead of per-node Python dictionaries. For long
+  streams the product is restricted to an IVF shortlist (see ann_index).
+  """
+  def __init__(self):
+    self.dim = None
+    self.size = 0
+    self._capacity = 0
+    self._matrix = np.zeros((0, 0), dtype=np.float32)
+    self._norms = np.zeros(0, dtype=np.float32)
+    self._has_embedding = np.zeros(0, dtype=bool)
+    self._created = np.zeros(0, dtype=np.int64)
+    self._last_retrieved = np.zeros(0, dtype=np.int64)
+    self._importance = np.zeros(0, dtype=np.float64)
+    self._type_codes = np.zeros(0, dtype=np.int16)
+    self._type_lookup = dict()
+
+    # Identity of the containers the columns were built from, used to detect
+    # callers that swap seq_nodes or embeddings wholesale.
+    self._nodes_ref = None
+    self._embeddings_ref = None
+
+    # Bumped by mark_retrieved so batched scoring knows when the recency
+    # column has to be renormalized.
+    self._retrieved_version = 0
+
+    # Approximate nearest-neighbour shortlist for relevance, only used once
+    # the stream has grown past ann.min_rows.
+    self.ann = IVFIndex()
+
+
+  def _reserve(self, capacity):
+    if capacity <= self._capacity:
+      return
+    new_capacity = max(capacity, self._capacity * 2, 64)
+    dim = self.dim or 0
+
+    def grow(arr, shape, dtype):
+      out = np.zeros(shape, dtype=dtype)
+      out[:self.size] = arr[:self.size]
+      return out
+
+    self._matrix = grow(self._matrix, (new_capacity, dim), np.float32)
+    self._norms = grow(self._norms, new_capacity, np.float32)
+    self._has_embedding = grow(self._has_embedding, new_capacity, bool)
+    self._created = grow(self._created, new_capacity, np.int64)
+    self._last_retrieved = grow(self._last_retrieved, new_capacity, np.int64)
+    self._importance = grow(self._importance, new_capacity, np.float64)
+    self._type_codes = grow(self._type_codes, new_capacity, np.int16)
+    self._capacity = new_capacity
+
+
+  def _type_code(self, node_type):
+    if node_type not in self._type_lookup:
+      self._type_lookup[node_type] = len(self._type_lookup)
+    return self._type_lookup[node_type]
+
+
+  def _set_embedding(self, row, embedding):
+    if embedding is None:
+      return
+    try:
+      vec = np.asarray(embedding, dtype=np.float32).reshape(-1)
+    except (TypeError, ValueError):
+      return
+    if vec.size == 0:
+      return
+    if self.dim is None:
+      self.dim = vec.size
+      self._matrix = np.zeros((self._capacity, self.dim), dtype=np.float32)
+    if vec.size != self.dim:
+      return
+    self._matrix[row] = vec
+    self._norms[row] = np.linalg.norm(vec)
+    self._has_embedding[row] = True
+    self.ann.add(row, vec, self._norms[row])
+
+
+  def append(self, node, embedding):
+    """
+    Appends one node (and its embedding, if any) as the next row.
+
+    Parameters:
+      node: ConceptNode that was just appended to seq_nodes
+      embedding: the node's embedding vector, or None
+    Returns:
+      None
+    """
+    self._reserve(self.size + 1)
+    row = self.size
+    self._created[row] = _coerce_int(getattr(node, "created", 0))
+    self._last_retrieved[row] = _coerce_int(getattr(node, "last_retrieved", 0))
+    self._importance[row] = _coerce_importance(getattr(node, "importance", None))
+    self._type_codes[row] = self._type_code(getattr(node, "node_type", None))
+    self._has_embedding[row] = False
+    self.size += 1
+    self._set_embedding(row, embedding)
+
+
+  def rebuild(self, seq_nodes, embeddings):
+    """
+    Rebuilds every column from scratch.
+
+    Parameters:
+      seq_nodes: the MemoryStream's list of ConceptNodes
+      embeddings: dictionary of content str -> embedding vector
+    Returns:
+      None
+    """
+    ann = self.ann
+    self.__init__()
+    self.ann = ann
+    self.ann.reset()
+    lookup = embeddings or {}
+    self._reserve(len(seq_nodes))
+    for node in seq_nodes:
+      self.append(node, lookup.get(node.content))
+    self._nodes_ref = seq_nodes
+    self._embeddings_ref = embeddings
+
+
+  def sync(self, seq_nodes, embeddings):
+    """
+    Makes sure the columns describe seq_nodes, rebuilding them if the node
+    list or the embeddings dictionary was replaced or resized behind our back.
+    """
+    if (seq_nodes is not self._nodes_ref
+        or embeddings is not self._embeddings_ref
+        or len(seq_nodes) != self.size):
+      self.rebuild(seq_nodes, embeddings)
+
+
+  def track(self, seq_nodes, embeddings, node, embedding):
+    """
+    Appends a node that was just added to seq_nodes when the columns already
+    mirror everything before it. Otherwise the columns are stale anyway and
+    the next sync() rebuilds them.
+    """
+    if (seq_nodes is self._nodes_ref
+        and embeddings is self._embeddings_ref
+        and self.size == len(seq_nodes) - 1):
+      self.append(node, embedding)
+
+
+  def mark_retrieved(self, rows, time_step):
+    """
+    Records the new last_retrieved time_step for the given rows.
+    """
+    self._last_retrieved[np.asarray(rows, dtype=np.int64)] = _coerce_int(time_step)
+    self._retrieved_version += 1
+
+
+  def candidate_rows(self, curr_filter="all"):
+    """
+    Returns the rows that pass the node_type filter, in chronological order.
+    """
+    if curr_filter == "all":
+      return np.arange(self.size)
+    code = self._type_lookup.get(curr_filter)
+    if code is None:
+      return np.empty(0, dtype=np.int64)
+    return np.flatnonzero(self._type_codes[:self.size] == code)
+
+
+  def recency(self, rows):
+    """
+    Vectorized extract_recency: decay ** (max_last_retrieved - last_retrieved)
+    """
+    last = self._last_retrieved[rows]
+    if last.size == 0:
+      return last.astype(np.float64)
+    return np.power(RECENCY_DECAY, (last.max() - last).astype(np.float64))
+
+
+  def importance(self, rows):
+    """
+    Vectorized extract_importance.
+    """
+    return self._importance[rows]
+
+
+  def relevance(self, rows, focal_embedding, exact=False):
+    """
+    Vectorized extract_relevance: cosine similarity of every candidate row
+    against the focal embedding as one matrix-vector product. Rows without a
+    usable embedding score the default relevance of 0.5. Once the IVF index
+    is trained, rows outside the probed clusters get their centroid's
+    similarity instead of an exact score, unless exact is set.
+    """
+    return self._relevance(rows, focal_embedding, exact)[0]
+
+
+  def _query_unit(self, focal_embedding):
+    if self.dim is None or focal_embedding is None:
+      return None
+    try:
+      query = np.asarray(focal_embedding, dtype=np.float32).reshape(-1)
+    except (TypeError, ValueError):
+      return None
+    if query.size != self.dim:
+      return None
+    query_norm = float(np.linalg.norm(query))
+    if query_norm == 0:
+      return None
+    return query / query_norm
+
+
+  def _exact(self, rows, query_unit):
+    return (self._matrix[rows] @ query_unit) / self._norms[rows]
+
+
+  def _relevance(self, rows, focal_embedding, exact=False):
+    """
+    Returns the relevance of rows, a mask of the rows that only got the
+    approximate (centroid) score, and the normalized query.
+    """
+    out = np.full(rows.shape[0], DEFAULT_RELEVANCE, dtype=np.float64)
+    coarse = np.zeros(rows.shape[0], dtype=bool)
+    query_unit = self._query_unit(focal_embedding)
+    if query_unit is None:
+      return out, coarse, None
+
+    usable = self._has_embedding[rows] & (self._norms[rows] > 0)
+    if not exact:
+      self.ann.refresh(self._matrix, self._norms, self._has_embedding, self.size)
+    if not exact and self.ann.is_trained:
+      probed, approx = self.ann.search(rows, query_unit)
+      coarse = usable & ~(probed | np.isnan(approx))
+      out[coarse] = approx[coarse]
+      usable = usable & ~coarse
+    usable_rows = rows[usable]
+    if usable_rows.size:
+      out[usable] = self._exact(usable_rows, query_unit)
+    return out, coarse, query_unit
+
+
+  def _relevance_matrix(self, rows, focal_embeddings):
+    """
+    Exact relevance of rows against every focal embedding as a single
+    (queries x rows) matrix product.
+    """
+    out = np.full((len(focal_embeddings), rows.shape[0]), DEFAULT_RELEVANCE,
+                  dtype=np.float64)
+    units = [self._query_unit(embedding) for embedding in focal_embeddings]
+    valid = [i for i, unit in enumerate(units) if unit is not None]
+    usable = np.flatnonzero(self._has_embedding[rows] & (self._norms[rows] > 0))
+    if valid and usable.size:
+      usable_rows = rows[usable]
+      queries = np.stack([units[i] for i in valid])
+      out[np.ix_(valid, usable)] = ((queries @ self._matrix[usable_rows].T)
+                                    / self._norms[usable_rows])
+    return out
+
+
+  def score(self, rows, focal_embedding, hp, n_count=None):
+    """
+    Returns the blended retrieval score together with its three normalized
+    components (recency, relevance, importance) for the given rows.
+
+    When part of the relevance column is only approximate (IVF index), the
+    rows that make the blended shortlist of RERANK_FACTOR * n_count are
+    rescored exactly and the blend is recomputed, so the final top n_count
+    is ranked on exact scores.
+    """
+    return next(self.score_batch(rows, [focal_embedding], hp, n_count))
+
+
+  def score_batch(self, rows, focal_embeddings, hp, n_count=None):
+    """
+    Batched score(): yields (master, recency, relevance, importance) for each
+    focal embedding in order. Importance is normalized once, and relevance
+    for all queries is one matrix product (per query once the IVF index is
+    trained). Recency only depends on last_retrieved, so it is normalized
+    once and redone only if mark_retrieved ran between two queries, which is
+    what keeps a stateful multi-query retrieve identical to querying one
+    focal point at a time.
+    """
+    importance_out = normalize_array(self.importance(rows), 0, 1)
+    self.ann.refresh(self._matrix, self._norms, self._has_embedding, self.size)
+    relevance_matrix = None
+    if not self.ann.is_trained:
+      relevance_matrix = self._relevance_matrix(rows, focal_embeddings)
+
+    recency_version = None
+    for i, focal_embedding in enumerate(focal_embeddings):
+      if recency_version != self._retrieved_version:
+        recency_out = normalize_array(self.recency(rows), 0, 1)
+        recency_version = self._retrieved_version
+
+      if relevance_matrix is not None:
+        relevance, coarse, query_unit = relevance_matrix[i], None, None
+      else:
+        relevance, coarse, query_unit = self._relevance(rows, focal_embedding)
+
+      def blend(relevance):
+        relevance_out = normalize_array(relevance, 0, 1)
+        return (hp[0] * recency_out
+                + hp[1] * relevance_out
+                + hp[2] * importance_out), relevance_out
+
+      master_out, relevance_out = blend(relevance)
+      if coarse is not None and coarse.any():
+        shortlist = max(RERANK_MIN, RERANK_FACTOR * (n_count or 0))
+        candidates = top_k_indices(master_out, shortlist)
+        candidates = candidates[coarse[candidates]]
+        if candidates.size:
+          relevance[candidates] = self._exact(rows[candidates], query_unit)
+          master_out, relevance_out = blend(relevance)
+      yield master_out, recency_out, relevance_out, importance_out
@@ -531,7 +531,7 @@ def direct_llm_api_call(data):
     直接调用 LLM API（当 feiFei 未初始化时使用）
     """
     try:
-        import openai
+        from llm.llm_clients import get_llm_registry
         
         # 加载配置
         config_util.load_config()
@@ -549,32 +549,18 @@ def direct_llm_api_call(data):
                 else:
                     messages.append({'role': 'user', 'content': content})
         
-        # 使用配置中的API设置，不做任何修改
-        base_url = config_util.gpt_base_url
-        api_key = config_util.key_gpt_api_key
-        model_name = config_util.gpt_model_engine or 'gpt-3.5-turbo'
-        
-        util.log(1, f"[API] 直接调用LLM API，base_url: {base_url}, model: {model_name}")
-        
-        # 使用配置的API设置
-        client = openai.OpenAI(
-            api_key=api_key,
-            base_url=base_url
-        )
+        # 使用配置中的API设置，与对话共用连接池
+        util.log(1, f"[API] 直接调用LLM API，base_url: {config_util.gpt_base_url}, model: {config_util.gpt_model_engine}")
         
         # 调用 API
-        response = client.chat.completions.create(
-            model=model_name,
-            messages=messages,
-            stream=False
-        )
+        response = get_llm_registry().invoke("direct", messages)
         
         # 返回 OpenAI 兼容格式
         return jsonify({
             'choices': [{
                 'message': {
                     'role': 'assistant',
-                    'content': response.choices[0].message.content
+                    'content': response.content
                 }
             }]
         })
@@ -603,6 +589,51 @@ def api_get_run_status():
     except Exception as e:
         return jsonify({'status': False, 'message': f'获取运行状态时出错: {e}'}), 500
 
+@__app.route('/api/agent-cache-stats', methods=['get'])
+def api_agent_cache_stats():
+    # 获取代理缓存的命中/未命中/淘汰统计
+    try:
+        from llm.nlp_cognitive_stream import get_agent_cache_stats
+        return jsonify({'success': True, 'stats': get_agent_cache_stats()})
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'获取代理缓存统计时出错: {e}'}), 500
+
+@__app.route('/api/llm-client-stats', methods=['get'])
+def api_llm_client_stats():
+    # 获取各LLM端点进行中的请求数和各用途当前使用的模型
+    try:
+        from llm.llm_clients import get_llm_registry
+        return jsonify({'success': True, 'stats': get_llm_registry().stats()})
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'获取LLM客户端统计时出错: {e}'}), 500
+
+@__app.route('/api/segmentation-stats', methods=['get'])
+def api_segmentation_stats():
+    # 获取最近回复的首块文本、首句耗时统计和当前分句参数
+    try:
+        from utils.sentence_segmenter import get_segmentation_stats
+        return jsonify({'success': True, 'stats': get_segmentation_stats()})
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'获取分句统计时出错: {e}'}), 500
+
+@__app.route('/api/tool-router-stats', methods=['get'])
+def api_tool_router_stats():
+    # 获取工具快速路由跳过规划器的次数和估算节省的时间
+    try:
+        from llm.nlp_cognitive_stream import get_tool_router_stats
+        return jsonify({'success': True, 'stats': get_tool_router_stats()})
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'获取工具路由统计时出错: {e}'}), 500
+
+@__app.route('/api/knowledge-base-status', methods=['get'])
+def api_knowledge_base_status():
+    # 获取本地知识库的加载进度
+    try:
+        from llm.nlp_cognitive_stream import get_knowledge_base_status
+        return jsonify({'success': True, 'status': get_knowledge_base_status()})
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'获取知识库状态时出错: {e}'}), 500
+
 @__app.route('/api/adopt-msg', methods=['POST'])
 def adopt_msg():
     # 采纳消息
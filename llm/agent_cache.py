@@ -0,0 +1,171 @@
+import threading
+from collections import OrderedDict
+
+from utils import util
+
+# 每个记忆节点除embedding外的大致内存占用（ConceptNode、内容文本、索引项）
+NODE_OVERHEAD_BYTES = 400
+
+
+def estimate_agent_bytes(agent):
+    """
+    粗略估算一个GenerativeAgent常驻内存的大小（字节）
+
+    只看节点数和检索列存储的矩阵，不遍历节点内容，保证每次插入时的开销很小。
+    """
+    memory_stream = getattr(agent, "memory_stream", None)
+    if memory_stream is None:
+        return 0
+    total = len(memory_stream.seq_nodes or []) * NODE_OVERHEAD_BYTES
+    engine = getattr(memory_stream, "engine", None)
+    if engine is not None:
+        total += engine._matrix.nbytes
+    embeddings = memory_stream.embeddings
+    if embeddings is not None and engine is not None and engine.dim:
+        # 尚未落盘的embedding保存在内存中，已落盘的按需内存映射
+        total += getattr(embeddings, "pending_count", 0) * engine.dim * 4
+    return total
+
+
+def agent_is_dirty(agent):
+    """
+    agent是否有尚未写入磁盘快照的数据：未保存的embedding或未合并的追加日志
+    """
+    memory_stream = getattr(agent, "memory_stream", None)
+    if memory_stream is None:
+        return False
+    embeddings = memory_stream.embeddings
+    if embeddings:
+        if getattr(embeddings, "pending_count", len(embeddings)) > 0:
+            return True
+    journal = memory_stream.journal
+    return journal is not None and journal.records > 0
+
+
+class AgentCache:
+    """
+    按LRU淘汰的agent缓存，替代原来永不释放的agents字典。
+
+    保留dict的常用接口（get、in、[]、items等），遍历类方法返回快照，
+    淘汰可以在其他线程遍历时安全发生。超过max_agents或memory_budget_mb
+    时淘汰最久未使用的agent，淘汰前调用on_evict把数据写回磁盘；下次
+    create_agent时从磁盘重新加载。
+    """
+    def __init__(self, max_agents=64, memory_budget_mb=0, on_evict=None):
+        self.max_agents = max_agents
+        self.memory_budget_mb = memory_budget_mb
+        self.on_evict = on_evict
+        self._agents = OrderedDict()
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def lookup(self, key):
+        """
+        查找agent并计入命中/未命中统计，命中时刷新为最近使用
+        """
+        with self._lock:
+            agent = self._agents.get(key)
+            if agent is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._agents.move_to_end(key)
+            return agent
+
+    def get(self, key, default=None):
+        with self._lock:
+            agent = self._agents.get(key)
+            if agent is None:
+                return default
+            self._agents.move_to_end(key)
+            return agent
+
+    def __getitem__(self, key):
+        agent = self.get(key)
+        if agent is None:
+            raise KeyError(key)
+        return agent
+
+    def __setitem__(self, key, agent):
+        with self._lock:
+            self._agents[key] = agent
+            self._agents.move_to_end(key)
+            self._evict(keep=key)
+
+    def __delitem__(self, key):
+        with self._lock:
+            del self._agents[key]
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._agents
+
+    def __len__(self):
+        return len(self._agents)
+
+    def __bool__(self):
+        return len(self._agents) > 0
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def keys(self):
+        with self._lock:
+            return list(self._agents.keys())
+
+    def values(self):
+        with self._lock:
+            return list(self._agents.values())
+
+    def items(self):
+        with self._lock:
+            return list(self._agents.items())
+
+    def pop(self, key, default=None):
+        with self._lock:
+            return self._agents.pop(key, default)
+
+    def clear(self):
+        with self._lock:
+            self._agents.clear()
+
+    def estimated_bytes(self):
+        return sum(estimate_agent_bytes(agent) for agent in self.values())
+
+    def _over_budget(self):
+        if self.max_agents and len(self._agents) > self.max_agents:
+            return True
+        if self.memory_budget_mb:
+            return self.estimated_bytes() > self.memory_budget_mb * 1024 * 1024
+        return False
+
+    def _evict(self, keep=None):
+        while len(self._agents) > 1 and self._over_budget():
+            key = next(iter(self._agents))
+            if key == keep:
+                break
+            agent = self._agents.pop(key)
+            self.evictions += 1
+            if self.on_evict is not None:
+                try:
+                    self.on_evict(key, agent)
+                except Exception as e:
+                    util.log(1, f"淘汰代理{key}时写回记忆出错: {str(e)}")
+            util.log(1, f"代理缓存已满，淘汰代理: {key}")
+
+    def stats(self):
+        """
+        返回缓存的命中、未命中、淘汰次数及当前占用
+        """
+        with self._lock:
+            return {
+                "size": len(self._agents),
+                "max_agents": self.max_agents,
+                "memory_budget_mb": self.memory_budget_mb,
+                "estimated_mb": round(self.estimated_bytes() / 1024 / 1024, 2),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
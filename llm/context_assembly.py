@@ -0,0 +1,180 @@
+import time
+import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+from utils import util
+
+# question()各上下文阶段的超时（秒），从开始准备上下文时算起；None表示必须等待完成。
+# model决定加载哪个角色和按哪个模型取历史，不能用默认值代替，必须等待（用户模型已缓存，通常很快）
+CONTEXT_STAGE_TIMEOUTS = {
+    "model": None,
+    "agent": None,
+    "memory": 3.0,
+    "knowledge": 2.0,
+    "history": 2.0,
+    "tools": 3.0,
+}
+
+
+class _Stage:
+    __slots__ = ("future", "timeout", "default", "required", "elapsed", "status")
+
+    def __init__(self, timeout, default, required):
+        self.future = Future()
+        self.timeout = timeout
+        self.default = default
+        self.required = required
+        self.elapsed = None
+        self.status = "pending"
+
+
+class ContextAssembler:
+    """
+    question()在生成第一个token之前的上下文准备阶段。
+
+    相互独立的获取步骤提交到同一个线程池并发执行；依赖其他阶段结果的阶段
+    （after）在前置阶段完成后才被调度，不会占着工作线程等待；前置阶段超时的，
+    到时即以前置阶段的默认值调度，不会被卡住的前置阶段拖住。每个阶段有自己的
+    超时：超时或出错时返回默认值（空上下文），不阻塞本轮对话，迟到的结果被丢弃。
+    report()把各阶段的耗时写入日志。
+    """
+    def __init__(self, executor, label=""):
+        self.executor = executor
+        self.label = label
+        self.started = time.time()
+        self._stages = {}
+        self._lock = threading.Lock()
+
+    def submit(self, name, fn, timeout=None, default=None, after=None, required=False):
+        """
+        提交一个阶段
+
+        参数:
+            name: 阶段名
+            fn: 阶段函数；指定after时以前置阶段的结果为参数调用
+            timeout: 超时秒数，从开始准备上下文时算起，None表示一直等待
+            default: 超时或出错时使用的结果
+            after: 前置阶段名，前置阶段出错或超时时以它的default作为参数；
+                前置阶段是required的，出错时本阶段不执行，以同样的异常结束
+            required: 出错时get()直接抛出异常，而不是返回default
+        """
+        stage = _Stage(timeout, default, required)
+        with self._lock:
+            self._stages[name] = stage
+
+        def run(*args):
+            if not stage.future.set_running_or_notify_cancel():
+                return
+            begin = time.time()
+            try:
+                result = fn(*args)
+            except BaseException as e:
+                stage.elapsed = time.time() - begin
+                stage.future.set_exception(e)
+            else:
+                stage.elapsed = time.time() - begin
+                stage.future.set_result(result)
+
+        if after is None:
+            self.executor.submit(run)
+            return
+
+        prerequisite = self._stages[after]
+        scheduled = []
+
+        def start(value):
+            # 前置阶段完成和超时只有先发生的一个生效
+            with self._lock:
+                if scheduled:
+                    return
+                scheduled.append(True)
+            try:
+                self.executor.submit(run, value)
+            except RuntimeError as e:
+                # 线程池已关闭（程序退出中）
+                stage.future.set_exception(e)
+
+        def schedule(done):
+            try:
+                value = done.result()
+            except Exception as e:
+                if prerequisite.required:
+                    # 必需的前置阶段没有可用的默认值，不能拿default继续（例如以错误的模型加载角色）
+                    if not stage.future.done():
+                        stage.future.set_exception(e)
+                    return
+                self._failed(after, prerequisite, e)
+                value = prerequisite.default
+            start(value)
+
+        def expire():
+            if not prerequisite.future.done():
+                util.log(1, f"[上下文] {after} 阶段超过 {prerequisite.timeout} 秒未完成，{name} 阶段以默认值继续")
+                start(prerequisite.default)
+
+        prerequisite.future.add_done_callback(schedule)
+        if (prerequisite.timeout is not None and not prerequisite.required
+                and not prerequisite.future.done()):
+            timer = threading.Timer(max(0.0, self.started + prerequisite.timeout - time.time()), expire)
+            timer.daemon = True
+            timer.start()
+
+    def get(self, name):
+        """
+        取阶段结果，最多等到该阶段的超时时间
+        """
+        stage = self._stages[name]
+        if stage.timeout is None:
+            remaining = None
+        else:
+            remaining = max(0.0, self.started + stage.timeout - time.time())
+        try:
+            result = stage.future.result(remaining)
+            stage.status = "ok"
+            return result
+        except FutureTimeoutError:
+            stage.status = "timeout"
+            util.log(1, f"[上下文] {name} 阶段超过 {stage.timeout} 秒未完成，本轮不使用该部分上下文")
+            return stage.default
+        except Exception as e:
+            if stage.required:
+                stage.status = "error"
+                raise
+            self._failed(name, stage, e)
+            return stage.default
+
+    def _failed(self, name, stage, error):
+        with self._lock:
+            if stage.status == "error":
+                return
+            stage.status = "error"
+        util.log(1, f"[上下文] {name} 阶段出错: {str(error)}，本轮不使用该部分上下文")
+
+    def timings(self):
+        """
+        返回各阶段的状态和耗时（毫秒），未完成的阶段耗时为None
+        """
+        return {
+            name: {
+                "status": stage.status,
+                "elapsed_ms": None if stage.elapsed is None else round(stage.elapsed * 1000, 1),
+            }
+            for name, stage in self._stages.items()
+        }
+
+    def report(self):
+        """
+        把本次上下文准备的总耗时和各阶段耗时写入日志
+        """
+        parts = []
+        for name, timing in self.timings().items():
+            if timing["status"] == "timeout":
+                parts.append(f"{name} 超时")
+            elif timing["elapsed_ms"] is None:
+                parts.append(f"{name} -")
+            else:
+                suffix = "(出错)" if timing["status"] == "error" else ""
+                parts.append(f"{name} {timing['elapsed_ms']:.0f}ms{suffix}")
+        total = (time.time() - self.started) * 1000
+        label = f"{self.label} " if self.label else ""
+        util.log(1, f"[上下文] {label}准备耗时 {total:.0f}ms：{'，'.join(parts)}")
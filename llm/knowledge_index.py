@@ -0,0 +1,765 @@
+import os
+import re
+import copy
+import json
+import math
+import time
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from scheduler.thread_manager import MyThread
+from simulation_engine import embedding_provider
+from simulation_engine.gpt_structure import get_text_embeddings
+from utils import util
+
+# 中日韩统一表意文字（含扩展A与兼容区）
+_CJK = "㐀-䶿一-鿿豈-﫿"
+_CJK_RE = re.compile(rf"[{_CJK}]")
+_TOKEN_RE = re.compile(rf"[{_CJK}]+|[^\W{_CJK}]+")
+# 句末标点之后断句
+_SENTENCE_RE = re.compile(r'(?<=[。！？])')
+
+# 分块的最大字符数
+CHUNK_CHARS = 300
+# 词法、向量两路各取前多少个分块参与融合排序
+FUSION_CANDIDATES = 50
+# 倒数排名融合（RRF）的平滑常数
+RRF_K = 60
+# 向量相似度低于此值的分块不参与融合
+MIN_VECTOR_SIMILARITY = 0.2
+
+
+def tokenize(text):
+    """
+    分词：连续的中文按二元组（bigram）切分，单个汉字保留为一元词；
+    其他语言按单词切分。全部转为小写。
+    """
+    tokens = []
+    for run in _TOKEN_RE.findall(text.lower()):
+        if _CJK_RE.match(run):
+            if len(run) == 1:
+                tokens.append(run)
+            else:
+                tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+        else:
+            tokens.append(run)
+    return tokens
+
+
+def chunk_text(content, max_chars=CHUNK_CHARS):
+    """
+    按句子把文档切成不超过max_chars个字符的分块，保留原有的换行；超长的句子按长度硬切
+    """
+    chunks, current = [], ""
+    for line in (content or "").split("\n"):
+        separator = "\n"
+        for sentence in _SENTENCE_RE.split(line):
+            sentence = sentence.strip()
+            while len(sentence) > max_chars:
+                if current:
+                    chunks.append(current)
+                    current = ""
+                chunks.append(sentence[:max_chars])
+                sentence = sentence[max_chars:]
+            if not sentence:
+                continue
+            if current and len(current) + len(separator) + len(sentence) > max_chars:
+                chunks.append(current)
+                current = ""
+            current = current + separator + sentence if current else sentence
+            separator = ""
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+class KnowledgeIndex:
+    """
+    本地知识库的分块索引：BM25倒排索引加可选的分块向量矩阵，
+    两路排名用倒数排名融合（RRF）合并。
+
+    在知识库加载时构建一次；词法检索只遍历查询词对应的倒排表，
+    向量检索是与内存中矩阵的一次乘法，查询时不读任何文件。
+    文件变化时用updated()得到新索引，只重建变化文件的部分，旧索引不受影响。
+    """
+    def __init__(self, knowledge_base, k1=1.5, b=0.75, vectors=None):
+        self.source = knowledge_base
+        self.k1 = k1
+        self.b = b
+        self.chunks = []      # [(file_name, chunk)]，只追加，可与新索引共享
+        self.lengths = []     # 每个分块的词数
+        self.postings = {}    # term -> [(chunk_id, tf)]
+        self.file_chunks = {}     # file_name -> [chunk_id]
+        self.file_terms = {}      # file_name -> {term}
+        self.file_vectors = {}    # file_name -> float32矩阵，行与file_chunks对齐
+        self.chunk_count = 0
+        self.total_length = 0
+        self.matrix = None        # 所有分块向量（已归一化）
+        self.matrix_ids = None    # matrix每一行对应的chunk_id
+
+        vectors = vectors or {}
+        for file_name, content in (knowledge_base or {}).items():
+            self._add_file(file_name, content, vectors.get(file_name))
+        self._build_matrix()
+
+    @property
+    def avg_length(self):
+        count = self.chunk_count
+        return (self.total_length / count) if count else 0.0
+
+    @property
+    def has_vectors(self):
+        return self.matrix is not None
+
+    def idf(self, token):
+        posting = self.postings.get(token)
+        if not posting:
+            return 0.0
+        total = self.chunk_count
+        return math.log(1 + (total - len(posting) + 0.5) / (len(posting) + 0.5))
+
+    def _add_file(self, file_name, content, vectors=None):
+        chunk_ids, terms, additions = [], set(), {}
+        for chunk in chunk_text(content):
+            tokens = tokenize(chunk)
+            chunk_id = len(self.chunks)
+            self.chunks.append((file_name, chunk))
+            self.lengths.append(len(tokens))
+            self.chunk_count += 1
+            self.total_length += len(tokens)
+            chunk_ids.append(chunk_id)
+            counts = {}
+            for token in tokens:
+                counts[token] = counts.get(token, 0) + 1
+            for token, tf in counts.items():
+                additions.setdefault(token, []).append((chunk_id, tf))
+            terms.update(counts)
+        # 倒排表整体替换而不是原地追加，共享它的旧索引不受影响
+        for token, items in additions.items():
+            self.postings[token] = self.postings.get(token, []) + items
+        self.file_chunks[file_name] = chunk_ids
+        self.file_terms[file_name] = terms
+        if vectors is not None and len(vectors) == len(chunk_ids):
+            self.file_vectors[file_name] = vectors
+
+    def _build_matrix(self):
+        """
+        把各文件的分块向量拼成一个矩阵；维度不一致的文件（embedding后端切换中途）不参与
+        """
+        self.matrix, self.matrix_ids = None, None
+        if not self.file_vectors:
+            return
+        dims = {}
+        for vectors in self.file_vectors.values():
+            dims[vectors.shape[1]] = dims.get(vectors.shape[1], 0) + len(vectors)
+        dim = max(dims, key=dims.get)
+        blocks, ids = [], []
+        for file_name, vectors in self.file_vectors.items():
+            if vectors.shape[1] == dim and len(vectors):
+                blocks.append(vectors)
+                ids.extend(self.file_chunks[file_name])
+        if not blocks:
+            return
+        matrix = np.vstack(blocks).astype(np.float32, copy=False)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        self.matrix = matrix / np.where(norms == 0, 1.0, norms)
+        self.matrix_ids = np.asarray(ids, dtype=np.int64)
+
+    def remove_file(self, file_name):
+        """
+        从索引中移除一个文件，只修改该文件用到的词的倒排表
+        """
+        chunk_ids = self.file_chunks.pop(file_name, None)
+        terms = self.file_terms.pop(file_name, set())
+        self.file_vectors.pop(file_name, None)
+        if chunk_ids is None:
+            return
+        removed = set(chunk_ids)
+        for token in terms:
+            posting = [item for item in self.postings.get(token, []) if item[0] not in removed]
+            if posting:
+                self.postings[token] = posting
+            else:
+                self.postings.pop(token, None)
+        self.chunk_count -= len(chunk_ids)
+        self.total_length -= sum(self.lengths[chunk_id] for chunk_id in chunk_ids)
+
+    def set_file(self, file_name, content, vectors=None):
+        """
+        新增或替换一个文件的索引
+        """
+        self.remove_file(file_name)
+        self._add_file(file_name, content, vectors)
+
+    def updated(self, knowledge_base, changed=(), removed=(), vectors=None):
+        """
+        返回应用了文件变化的新索引，当前索引保持不变，可以继续被并发查询。
+
+        未变化文件的倒排表、分块和向量与当前索引共享；已失效的分块多于有效分块时整体重建。
+
+        参数:
+            knowledge_base: 变化后的知识库字典
+            changed: 新增或修改的文件名
+            removed: 被删除的文件名
+            vectors: 变化文件的分块向量 {file_name: 矩阵}
+        """
+        vectors = vectors or {}
+        if len(self.chunks) - self.chunk_count > max(self.chunk_count, 1000):
+            all_vectors = {name: v for name, v in self.file_vectors.items() if name not in changed}
+            all_vectors.update(vectors)
+            return KnowledgeIndex(knowledge_base, self.k1, self.b, all_vectors)
+        index = copy.copy(self)
+        index.source = knowledge_base
+        index.postings = dict(self.postings)
+        index.file_chunks = dict(self.file_chunks)
+        index.file_terms = dict(self.file_terms)
+        index.file_vectors = dict(self.file_vectors)
+        for file_name in removed:
+            index.remove_file(file_name)
+        for file_name in changed:
+            if file_name in knowledge_base:
+                index.set_file(file_name, knowledge_base[file_name], vectors.get(file_name))
+            else:
+                index.remove_file(file_name)
+        index._build_matrix()
+        return index
+
+    def _lexical_ranking(self, query):
+        k1, b, avg_length = self.k1, self.b, self.avg_length or 1.0
+        scores = {}
+        for token in set(tokenize(query)):
+            posting = self.postings.get(token)
+            if not posting:
+                continue
+            idf = self.idf(token)
+            for chunk_id, tf in posting:
+                norm = k1 * (1 - b + b * self.lengths[chunk_id] / avg_length)
+                scores[chunk_id] = scores.get(chunk_id, 0.0) + idf * tf * (k1 + 1) / (tf + norm)
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+        return [chunk_id for chunk_id, _ in ranked[:FUSION_CANDIDATES]]
+
+    def _vector_ranking(self, query_vector):
+        if self.matrix is None or query_vector is None:
+            return []
+        query = np.asarray(query_vector, dtype=np.float32).reshape(-1)
+        norm = float(np.linalg.norm(query))
+        if query.size != self.matrix.shape[1] or norm == 0:
+            return []
+        similarities = self.matrix @ (query / norm)
+        count = min(FUSION_CANDIDATES, len(similarities))
+        top = np.argpartition(-similarities, count - 1)[:count]
+        top = top[np.argsort(-similarities[top], kind="stable")]
+        return [int(self.matrix_ids[i]) for i in top
+                if similarities[i] >= MIN_VECTOR_SIMILARITY]
+
+    def search(self, query, max_results=3, chunks_per_file=3, query_vector=None):
+        """
+        在知识库中搜索相关内容
+
+        参数:
+            query: 查询内容
+            max_results: 最大返回结果数（按文件）
+            chunks_per_file: 每个文件返回的最相关分块数
+            query_vector: 查询的embedding，为None时只做词法检索
+
+        返回:
+            list: [{'file_name', 'score', 'content'}]，按得分从高到低
+        """
+        if not self.file_chunks or not query:
+            return []
+
+        # 倒数排名融合：每一路中排名为r的分块得1/(RRF_K+r)分
+        scores = {}
+        for ranking in (self._lexical_ranking(query), self._vector_ranking(query_vector)):
+            for rank, chunk_id in enumerate(ranking, 1):
+                scores[chunk_id] = scores.get(chunk_id, 0.0) + 1.0 / (RRF_K + rank)
+
+        # 按文件汇总：文件得分为其命中分块得分之和
+        by_file = {}
+        for chunk_id, score in scores.items():
+            by_file.setdefault(self.chunks[chunk_id][0], []).append((score, chunk_id))
+
+        results = []
+        for file_name, matched in by_file.items():
+            matched.sort(key=lambda item: (-item[0], item[1]))
+            results.append({
+                'file_name': file_name,
+                'score': sum(score for score, _ in matched),
+                'content': '\n'.join(self.chunks[chunk_id][1]
+                                     for _, chunk_id in matched[:chunks_per_file]),
+            })
+
+        results.sort(key=lambda x: x['score'], reverse=True)
+        return results[:max_results]
+
+
+class ParsedDocumentCache:
+    """
+    知识库文件解析结果的磁盘缓存，以路径+修改时间+大小为键。
+
+    重启后未变化的Office文件直接使用缓存的文本，不再重新解析。
+    分块的embedding存放在旁边的float32矩阵文件（.f32）中，条目里记录
+    所在的行、行数、维度和生成它的embedding后端。
+    """
+    def __init__(self, cache_path):
+        self.cache_path = cache_path
+        self.vectors_path = os.path.splitext(cache_path)[0] + '.f32'
+        self._entries = None
+        self._vectors = {}    # 路径 -> float32矩阵
+        self._dirty = False
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if self._entries is not None:
+            return
+        self._entries = {}
+        if not os.path.exists(self.cache_path):
+            return
+        try:
+            with open(self.cache_path, 'r', encoding='utf-8') as f:
+                entries = json.load(f)
+            if isinstance(entries, dict):
+                self._entries = entries
+        except Exception:
+            self._entries = {}
+        self._load_vectors()
+
+    def _load_vectors(self):
+        located = {path: entry['vectors'] for path, entry in self._entries.items()
+                   if isinstance(entry.get('vectors'), dict)}
+        if not located:
+            return
+        try:
+            flat = np.fromfile(self.vectors_path, dtype=np.float32)
+        except (OSError, ValueError):
+            flat = np.empty(0, dtype=np.float32)
+        expected = max(info['offset'] + info['rows'] * info['dim'] for info in located.values())
+        for path, info in located.items():
+            # 矩阵文件与索引不一致（例如写入中途退出）时丢弃向量，下次重新生成
+            if flat.size != expected:
+                self._entries[path].pop('vectors', None)
+                continue
+            start = info['offset']
+            block = flat[start:start + info['rows'] * info['dim']]
+            self._vectors[path] = block.reshape(info['rows'], info['dim'])
+
+    def get(self, file_path, stat):
+        """
+        返回缓存的文本；文件不在缓存中或已变化时返回None
+        """
+        with self._lock:
+            self._load()
+            entry = self._entries.get(os.path.abspath(file_path))
+        if (entry and entry.get('mtime') == stat.st_mtime
+                and entry.get('size') == stat.st_size):
+            return entry.get('content')
+        return None
+
+    def put(self, file_path, stat, content):
+        path = os.path.abspath(file_path)
+        with self._lock:
+            self._load()
+            self._entries[path] = {
+                'mtime': stat.st_mtime,
+                'size': stat.st_size,
+                'content': content,
+            }
+            self._vectors.pop(path, None)
+            self._dirty = True
+
+    def get_vectors(self, file_path, stat, backend):
+        """
+        返回缓存的分块向量；文件已变化或向量由其他embedding后端生成时返回None
+        """
+        path = os.path.abspath(file_path)
+        with self._lock:
+            self._load()
+            entry = self._entries.get(path)
+            if (not entry or entry.get('mtime') != stat.st_mtime
+                    or entry.get('size') != stat.st_size):
+                return None
+            info = entry.get('vectors')
+            if not info or info.get('backend') != backend:
+                return None
+            return self._vectors.get(path)
+
+    def put_vectors(self, file_path, stat, backend, vectors):
+        path = os.path.abspath(file_path)
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        with self._lock:
+            self._load()
+            entry = self._entries.get(path)
+            if (not entry or entry.get('mtime') != stat.st_mtime
+                    or entry.get('size') != stat.st_size):
+                return
+            entry['vectors'] = {'backend': backend, 'offset': 0,
+                                'rows': int(vectors.shape[0]), 'dim': int(vectors.shape[1])}
+            self._vectors[path] = vectors
+            self._dirty = True
+
+    def discard(self, file_path):
+        path = os.path.abspath(file_path)
+        with self._lock:
+            self._load()
+            self._vectors.pop(path, None)
+            if self._entries.pop(path, None) is not None:
+                self._dirty = True
+
+    def save(self):
+        """
+        有改动时写回磁盘（先写临时文件再替换），向量矩阵按条目顺序紧凑重写
+        """
+        with self._lock:
+            if not self._dirty:
+                return
+            os.makedirs(os.path.dirname(self.cache_path) or '.', exist_ok=True)
+            offset = 0
+            tmp_vectors = self.vectors_path + '.tmp'
+            with open(tmp_vectors, 'wb') as f:
+                for path, entry in self._entries.items():
+                    vectors = self._vectors.get(path)
+                    if vectors is None or not entry.get('vectors'):
+                        entry.pop('vectors', None)
+                        continue
+                    entry['vectors']['offset'] = offset
+                    vectors.tofile(f)
+                    offset += vectors.size
+            tmp_path = self.cache_path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self._entries, f, ensure_ascii=False)
+            os.replace(tmp_vectors, self.vectors_path)
+            os.replace(tmp_path, self.cache_path)
+            self._dirty = False
+
+
+class ChunkEmbedder:
+    """
+    用与记忆流相同的embedding后端为知识库分块生成向量。
+    mock后端的向量没有语义，此时不生成向量，只做词法检索。
+    """
+    def __init__(self, batch_size=64):
+        self.batch_size = batch_size
+
+    @property
+    def enabled(self):
+        return embedding_provider.get_provider().name != embedding_provider.MockEmbeddingProvider.name
+
+    @property
+    def backend(self):
+        """
+        标识生成向量的后端，后端或模型变化后缓存的向量不再使用
+        """
+        provider = embedding_provider.get_provider()
+        return f"{provider.name}:{getattr(provider, 'model_name', '')}:{provider.dim}"
+
+    def embed(self, texts):
+        """
+        分批生成向量，返回float32矩阵 (len(texts), dim)
+        """
+        rows = []
+        for start in range(0, len(texts), self.batch_size):
+            rows.extend(get_text_embeddings(list(texts[start:start + self.batch_size])))
+        return np.asarray(rows, dtype=np.float32).reshape(len(texts), -1)
+
+    def embed_query(self, query):
+        if not self.enabled or not query or not query.strip():
+            return None
+        return self.embed([query])[0]
+
+
+class KnowledgeBase(dict):
+    """
+    一份不再修改的知识库快照：文件名到内容的映射，index为对应的倒排索引
+    """
+    def __init__(self, contents=None, index=None):
+        super().__init__(contents or {})
+        self.index = index if index is not None else KnowledgeIndex(self)
+        self.index.source = self
+
+
+class KnowledgeBaseWatcher:
+    """
+    后台轮询知识库目录的文件变化，拥有知识库内容、倒排索引和解析缓存。
+
+    每次检测到变化都在后台构建新的KnowledgeBase快照，再用一次赋值整体替换；
+    查询方只读取snapshot属性，不做任何文件系统操作，也不需要加锁。
+    首次加载时未命中解析缓存的文件交给进程池并行解析，解析完的文件分批
+    发布到快照中，加载期间已经可以用部分知识库回答问题。
+    """
+    # 首次加载期间两次发布快照的最小间隔（秒）
+    PUBLISH_INTERVAL = 1.0
+
+    def __init__(self, data_dir, parse_file, parse_cache=None, interval=5.0,
+                 workers=0, max_file_mb=0, embedder=None):
+        self.data_dir = data_dir
+        self.parse_file = parse_file    # (file_path) -> 文本，无法读取时返回None；进程池中调用，须可pickle
+        self.parse_cache = parse_cache
+        self.embedder = embedder
+        self.interval = interval
+        self.workers = workers or min(4, os.cpu_count() or 1)
+        self.max_file_mb = max_file_mb
+        self.snapshot = KnowledgeBase()
+        self.loaded = False
+        self._file_times = {}
+        self._refresh_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._status = {
+            'state': 'idle',   # idle / loading / ready
+            'total': 0,
+            'done': 0,
+            'cached': 0,
+            'skipped': 0,
+            'failed': 0,
+            'started_at': None,
+            'finished_at': None,
+        }
+
+    def _scan(self):
+        files = {}
+        if not os.path.exists(self.data_dir):
+            return files
+        for entry in os.scandir(self.data_dir):
+            try:
+                if entry.is_file():
+                    files[entry.name] = (entry.path, entry.stat())
+            except OSError:
+                continue
+        return files
+
+    def _too_large(self, file_name, stat):
+        if self.max_file_mb and stat.st_size > self.max_file_mb * 1024 * 1024:
+            util.log(1, f"知识库文件 {file_name} 超过 {self.max_file_mb}MB，已跳过")
+            return True
+        return False
+
+    def _cached(self, file_path, stat):
+        if self.parse_cache is None:
+            return None
+        return self.parse_cache.get(file_path, stat)
+
+    def _parsed(self, file_name, file_path, stat, content):
+        if content is not None and self.parse_cache is not None:
+            self.parse_cache.put(file_path, stat, content)
+        return content
+
+    def _read(self, file_name, file_path, stat):
+        content = self._cached(file_path, stat)
+        if content is not None:
+            return content
+        try:
+            content = self.parse_file(file_path)
+        except Exception as e:
+            util.log(1, f"加载知识库文件 {file_name} 时出错: {str(e)}")
+            return None
+        return self._parsed(file_name, file_path, stat, content)
+
+    def _chunk_vectors(self, file_name, file_path, stat, content):
+        """
+        返回文件各分块的向量（优先读缓存），未启用向量检索时返回None
+        """
+        if self.embedder is None or not content or not self.embedder.enabled:
+            return None
+        chunks = chunk_text(content)
+        backend = self.embedder.backend
+        if self.parse_cache is not None:
+            vectors = self.parse_cache.get_vectors(file_path, stat, backend)
+            if vectors is not None and len(vectors) == len(chunks):
+                return vectors
+        try:
+            vectors = self.embedder.embed(chunks)
+        except Exception as e:
+            util.log(1, f"生成知识库文件 {file_name} 的向量时出错: {str(e)}")
+            return None
+        if self.parse_cache is not None:
+            self.parse_cache.put_vectors(file_path, stat, backend, vectors)
+        return vectors
+
+    def _save_cache(self):
+        if self.parse_cache is None:
+            return
+        try:
+            self.parse_cache.save()
+        except Exception as e:
+            util.log(1, f"保存知识库解析缓存出错: {str(e)}")
+
+    def _parse_in_pool(self, pending, on_parsed):
+        """
+        用进程池并行解析pending中的文件，进程池不可用时在当前线程逐个解析。
+        进程池固定用spawn启动：本进程已有Flask、MCP等线程，fork出的子进程可能卡在复制来的锁上；
+        spawn的子进程只导入parse_file所在的模块（以及以__mp_main__导入入口文件，其服务启动都在__main__判断下）
+        """
+        remaining = dict(pending)
+        if self.workers > 1 and len(pending) > 1:
+            try:
+                with ProcessPoolExecutor(max_workers=min(self.workers, len(pending)),
+                                         mp_context=multiprocessing.get_context("spawn")) as pool:
+                    futures = {pool.submit(self.parse_file, file_path): file_name
+                               for file_name, (file_path, _) in pending.items()}
+                    for future in as_completed(futures):
+                        file_name = futures[future]
+                        file_path, stat = remaining.pop(file_name)
+                        try:
+                            content = future.result()
+                        except Exception as e:
+                            util.log(1, f"加载知识库文件 {file_name} 时出错: {str(e)}")
+                            content = None
+                        on_parsed(file_name, file_path, stat, self._parsed(file_name, file_path, stat, content))
+            except Exception as e:
+                util.log(1, f"知识库并行解析不可用（{str(e)}），改为逐个解析")
+        for file_name, (file_path, stat) in remaining.items():
+            on_parsed(file_name, file_path, stat, self._read(file_name, file_path, stat))
+
+    def load(self):
+        """
+        完整加载一次知识库，返回最终快照。
+
+        已解析过且未变化的文件直接读缓存并立即发布，其余文件并行解析，
+        每隔PUBLISH_INTERVAL秒把已解析完的部分发布一次。
+        """
+        with self._refresh_lock:
+            if not os.path.exists(self.data_dir):
+                util.log(1, f"知识库目录不存在: {self.data_dir}")
+            files = self._scan()
+            self._status.update(state='loading', total=len(files), done=0, cached=0,
+                                skipped=0, failed=0, started_at=time.time(), finished_at=None)
+            # 重新加载时继续使用完整的旧快照，只在首次加载时发布部分结果
+            partial = not self.loaded
+            building = KnowledgeBase()
+            contents, vectors, added, pending = {}, {}, [], {}
+            last_publish = time.time()
+
+            def publish():
+                nonlocal building, last_publish
+                snapshot_contents = dict(contents)
+                index = building.index.updated(snapshot_contents, added,
+                                               vectors={name: vectors[name] for name in added if name in vectors})
+                building = KnowledgeBase(snapshot_contents, index)
+                added.clear()
+                last_publish = time.time()
+                if partial:
+                    self.snapshot = building
+
+            def accept(file_name, file_path, stat, content):
+                self._status['done'] += 1
+                if content is None:
+                    self._status['failed'] += 1
+                elif content.strip():
+                    contents[file_name] = content
+                    file_vectors = self._chunk_vectors(file_name, file_path, stat, content)
+                    if file_vectors is not None:
+                        vectors[file_name] = file_vectors
+                    added.append(file_name)
+                    util.log(1, f"成功加载知识库文件: {file_name} ({len(content)} 字符)")
+                if added and time.time() - last_publish >= self.PUBLISH_INTERVAL:
+                    publish()
+
+            for file_name, (file_path, stat) in files.items():
+                if self._too_large(file_name, stat):
+                    self._status['skipped'] += 1
+                    self._status['done'] += 1
+                    continue
+                content = self._cached(file_path, stat)
+                if content is None:
+                    pending[file_name] = (file_path, stat)
+                else:
+                    self._status['cached'] += 1
+                    accept(file_name, file_path, stat, content)
+            if added:
+                publish()
+
+            self._parse_in_pool(pending, accept)
+            if added:
+                publish()
+            self._save_cache()
+
+            self._file_times = {name: (stat.st_mtime, stat.st_size) for name, (_, stat) in files.items()}
+            self.snapshot = building
+            self.loaded = True
+            self._status.update(state='ready', finished_at=time.time())
+            return self.snapshot
+
+    def refresh(self):
+        """
+        检查一次文件变化，只重新解析和索引变化的文件，返回是否有变化
+        """
+        with self._refresh_lock:
+            files = self._scan()
+            file_times = {name: (stat.st_mtime, stat.st_size) for name, (_, stat) in files.items()}
+            changed = [name for name, times in file_times.items() if self._file_times.get(name) != times]
+            removed = [name for name in self._file_times if name not in file_times]
+            if not changed and not removed:
+                return False
+
+            util.log(1, f"检测到知识库文件变化（{len(changed)} 个新增或修改，{len(removed)} 个删除），正在重新加载...")
+            old = self.snapshot
+            contents, vectors = dict(old), {}
+            for file_name in removed:
+                contents.pop(file_name, None)
+                if self.parse_cache is not None:
+                    self.parse_cache.discard(os.path.join(self.data_dir, file_name))
+                util.log(1, f"知识库文件已移除: {file_name}")
+            for file_name in changed:
+                file_path, stat = files[file_name]
+                content = None
+                if not self._too_large(file_name, stat):
+                    content = self._read(file_name, file_path, stat)
+                if content and content.strip():
+                    contents[file_name] = content
+                    file_vectors = self._chunk_vectors(file_name, file_path, stat, content)
+                    if file_vectors is not None:
+                        vectors[file_name] = file_vectors
+                    util.log(1, f"成功加载知识库文件: {file_name} ({len(content)} 字符)")
+                else:
+                    contents.pop(file_name, None)
+            self._save_cache()
+
+            index = old.index.updated(contents, changed, removed, vectors)
+            self._file_times = file_times
+            self.snapshot = KnowledgeBase(contents, index)
+            util.log(1, f"知识库重新加载完成，共 {len(contents)} 个文件")
+            return True
+
+    def _run(self):
+        if not self.loaded:
+            try:
+                knowledge_base = self.load()
+                util.log(1, f"知识库加载完成，共 {len(knowledge_base)} 个文件，"
+                            f"耗时 {self._status['finished_at'] - self._status['started_at']:.1f} 秒")
+            except Exception as e:
+                util.log(1, f"加载知识库出错: {str(e)}")
+        while not self._stop_event.wait(self.interval):
+            try:
+                self.refresh()
+            except Exception as e:
+                util.log(1, f"检查知识库文件变化出错: {str(e)}")
+
+    def start(self):
+        """
+        启动后台线程：尚未加载时先在后台完整加载，之后轮询文件变化（已启动时不重复启动）
+        """
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = MyThread(target=self._run, daemon=True)
+        self._thread.start()
+
+    @property
+    def started(self):
+        return self._thread is not None
+
+    def stop(self):
+        self._stop_event.set()
+
+    def status(self):
+        """
+        返回加载进度：状态、文件总数、已处理/命中缓存/跳过/失败的文件数、当前可检索的文件数
+        """
+        status = dict(self._status)
+        status['indexed'] = len(self.snapshot)
+        if status['started_at'] is not None:
+            status['elapsed'] = round((status['finished_at'] or time.time()) - status['started_at'], 2)
+        return status
@@ -0,0 +1,212 @@
+import threading
+
+from utils import util
+import utils.config_util as cfg
+
+# 空闲的keep-alive连接保留多久（秒）
+KEEPALIVE_EXPIRY = 60.0
+# 连接、读取超时（秒）
+CONNECT_TIMEOUT = 10.0
+READ_TIMEOUT = 120.0
+
+
+def role_settings(role):
+    """
+    从当前配置读取某种用途的LLM参数，每次调用都重新读取，配置重新加载后立即生效
+
+    用途:
+        chat: 最终回复和直接对话，流式输出，回复长度限制为chat_max_tokens
+        planner: 工具规划，可单独配置更小、更快的模型（planner_*），未配置时使用对话模型
+        direct: 控制台直接调用（不限制回复长度，不流式）
+    返回:
+        (base_url, api_key, model, params)，params为ChatOpenAI的其他参数
+    """
+    base_url = cfg.gpt_base_url
+    api_key = cfg.key_gpt_api_key
+    model = cfg.gpt_model_engine
+    if role == "planner":
+        if cfg.planner_base_url:
+            base_url = cfg.planner_base_url
+            api_key = cfg.planner_api_key or api_key
+        model = cfg.planner_model_engine or model
+        params = {"streaming": False, "max_tokens": cfg.planner_max_tokens or None}
+    elif role == "direct":
+        model = model or "gpt-3.5-turbo"
+        params = {"streaming": False}
+    else:
+        params = {"streaming": True, "max_tokens": cfg.chat_max_tokens or None}
+    return base_url, api_key, model, params
+
+
+class _Endpoint:
+    """同一base_url的所有客户端共用的HTTP连接池"""
+    __slots__ = ("base_url", "http_client", "in_flight", "requests", "errors", "retired")
+
+    def __init__(self, base_url, http_client):
+        self.base_url = base_url
+        self.http_client = http_client
+        self.in_flight = 0
+        self.requests = 0
+        self.errors = 0
+        self.retired = False
+
+
+class LLMClientRegistry:
+    """
+    按(base_url, 模型, 参数)缓存的LLM客户端，替代模块加载时创建的全局ChatOpenAI。
+
+    同一base_url的客户端共用一个带keep-alive的HTTP连接池。每次调用都按当前配置
+    解析客户端：配置重新加载后，新的请求使用新的客户端，进行中的请求不受影响；
+    不再被任何用途使用的连接池在其上的请求全部结束后关闭。invoke/stream统计
+    每个端点进行中的请求数。
+    """
+    def __init__(self, client_factory=None, http_client_factory=None):
+        self._client_factory = client_factory or _create_chat_client
+        self._http_client_factory = http_client_factory or _create_http_client
+        self._clients = {}
+        self._endpoints = {}
+        self._roles = {}
+        self._lock = threading.Lock()
+
+    def _resolve(self, role):
+        """
+        解析本次调用使用的客户端，并在持有锁时把请求计入端点的进行中请求数，
+        避免同时发生的配置切换在计数之前关闭连接池；调用方结束时须调用_end()
+        """
+        base_url, api_key, model, params = role_settings(role)
+        key = (base_url, api_key, model, tuple(sorted(params.items())))
+        with self._lock:
+            client = self._clients.get(key)
+            endpoint = self._endpoints.get(base_url)
+            if endpoint is None or endpoint.retired:
+                endpoint = _Endpoint(base_url, self._http_client_factory())
+                self._endpoints[base_url] = endpoint
+                client = None
+            if client is None:
+                client = self._client_factory(base_url, api_key, model, params, endpoint.http_client)
+                self._clients[key] = client
+                util.log(1, f"[LLM] 创建{role}客户端：{base_url} {model}")
+            previous = self._roles.get(role)
+            if previous != key:
+                self._roles[role] = key
+                if previous is not None:
+                    self._release_unused(previous)
+            endpoint.in_flight += 1
+            endpoint.requests += 1
+            return client, endpoint
+
+    def _release_unused(self, key):
+        # 调用时已持有self._lock
+        if key in self._roles.values():
+            return
+        self._clients.pop(key, None)
+        base_url = key[0]
+        if any(role_key[0] == base_url for role_key in self._roles.values()):
+            return
+        endpoint = self._endpoints.pop(base_url, None)
+        if endpoint is not None:
+            endpoint.retired = True
+            if endpoint.in_flight == 0:
+                _close_endpoint(endpoint)
+
+    def _end(self, endpoint, failed):
+        with self._lock:
+            endpoint.in_flight -= 1
+            if failed:
+                endpoint.errors += 1
+            close = endpoint.retired and endpoint.in_flight == 0
+        if close:
+            _close_endpoint(endpoint)
+
+    def invoke(self, role, messages):
+        """
+        用指定用途的客户端同步调用LLM，返回模型消息
+        """
+        client, endpoint = self._resolve(role)
+        failed = True
+        try:
+            result = client.invoke(messages)
+            failed = False
+            return result
+        finally:
+            self._end(endpoint, failed)
+
+    def stream(self, role, messages):
+        """
+        用指定用途的客户端流式调用LLM，逐个返回输出块；
+        请求在流读完、出错或生成器被关闭时结束
+        """
+        client, endpoint = self._resolve(role)
+        failed = True
+        try:
+            yield from client.stream(messages)
+            failed = False
+        except GeneratorExit:
+            failed = False
+            raise
+        finally:
+            self._end(endpoint, failed)
+
+    def stats(self):
+        """
+        返回各端点的进行中请求数、累计请求数、失败数，以及各用途当前使用的模型
+        """
+        with self._lock:
+            return {
+                "endpoints": {
+                    base_url: {
+                        "in_flight": endpoint.in_flight,
+                        "requests": endpoint.requests,
+                        "errors": endpoint.errors,
+                    }
+                    for base_url, endpoint in self._endpoints.items()
+                },
+                "roles": {role: {"base_url": key[0], "model": key[2]} for role, key in self._roles.items()},
+            }
+
+
+def _create_http_client():
+    import httpx
+    max_connections = cfg.llm_max_connections or 20
+    return httpx.Client(
+        limits=httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_connections,
+            keepalive_expiry=KEEPALIVE_EXPIRY,
+        ),
+        timeout=httpx.Timeout(READ_TIMEOUT, connect=CONNECT_TIMEOUT),
+    )
+
+
+def _create_chat_client(base_url, api_key, model, params, http_client):
+    from langchain_openai import ChatOpenAI
+    return ChatOpenAI(
+        model=model,
+        base_url=base_url,
+        api_key=api_key,
+        http_client=http_client,
+        **params,
+    )
+
+
+def _close_endpoint(endpoint):
+    try:
+        endpoint.http_client.close()
+    except Exception as e:
+        util.log(1, f"[LLM] 关闭连接池出错: {str(e)}")
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_llm_registry():
+    """
+    获取进程内共用的LLM客户端注册表
+    """
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = LLMClientRegistry()
+    return _registry
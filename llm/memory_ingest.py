@@ -0,0 +1,101 @@
+import time
+import queue
+import threading
+
+from scheduler.thread_manager import MyThread
+from utils import util
+
+# 批量评分失败或返回条数不符时使用的重要性分数（与单条评分的兜底值一致）
+FALLBACK_IMPORTANCE = 25
+
+
+class MemoryIngestQueue:
+    """
+    记忆写入的后台批处理队列。
+
+    remember不再在对话线程里逐条同步调用LLM评分：submit只把观察放进队列，
+    后台线程把各用户的待写入观察攒成一批（最多batch_size条，或等待max_wait秒），
+    一次调用score_fn评分，再逐条回调on_scored写入记忆。LLM请求期间不持有任何锁，
+    锁只由回调在真正插入节点时短暂获取。
+    """
+    def __init__(self, score_fn, batch_size=16, max_wait=2.0):
+        self.score_fn = score_fn
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self._queue = queue.Queue()
+        self._pending = 0
+        self._pending_lock = threading.Condition()
+        self._worker = None
+        self._start_lock = threading.Lock()
+
+    def _ensure_worker(self):
+        with self._start_lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = MyThread(target=self._run, daemon=True)
+                self._worker.start()
+
+    def submit(self, content, on_scored):
+        """
+        放入一条待评分的观察，评分后在后台线程中调用on_scored(importance)
+        """
+        with self._pending_lock:
+            self._pending += 1
+        self._queue.put((content, on_scored))
+        self._ensure_worker()
+
+    def _next_batch(self):
+        batch = [self._queue.get()]
+        deadline = time.time() + self.max_wait
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _score(self, contents):
+        try:
+            scores = self.score_fn(contents)
+        except Exception as e:
+            util.log(1, f"批量评估记忆重要性出错: {str(e)}")
+            scores = None
+        if not isinstance(scores, (list, tuple)):
+            scores = []
+        scores = list(scores)[:len(contents)]
+        scores += [FALLBACK_IMPORTANCE] * (len(contents) - len(scores))
+        return scores
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            try:
+                scores = self._score([content for content, _ in batch])
+                for (content, on_scored), score in zip(batch, scores):
+                    try:
+                        on_scored(score)
+                    except Exception as e:
+                        util.log(1, f"写入记忆出错: {str(e)}")
+            finally:
+                with self._pending_lock:
+                    self._pending -= len(batch)
+                    self._pending_lock.notify_all()
+
+    def flush(self, timeout=30):
+        """
+        等待已提交的观察全部写入（最多等待timeout秒），返回是否已全部写入
+        """
+        deadline = time.time() + timeout
+        with self._pending_lock:
+            while self._pending > 0:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+                self._pending_lock.wait(remaining)
+        return True
+
+    def pending(self):
+        with self._pending_lock:
+            return self._pending
@@ -7,39 +7,29 @@ import requests
 import datetime
 import schedule
 import textwrap
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 from typing import Any, Callable, Dict, List, Literal, Optional, TypedDict, Tuple
 from collections.abc import Mapping, Sequence
-from langchain_openai import ChatOpenAI
 from langchain_core.messages import HumanMessage, SystemMessage
 from langgraph.graph import END, START, StateGraph
 
-# 新增：本地知识库相关导入
-import re
-from pathlib import Path
-import docx
-from docx.document import Document
-from docx.oxml.table import CT_Tbl
-from docx.oxml.text.paragraph import CT_P
-from docx.table import _Cell, Table
-from docx.text.paragraph import Paragraph
-try:
-    from pptx import Presentation
-    PPTX_AVAILABLE = True
-except ImportError:
-    PPTX_AVAILABLE = False
-
-# 用于处理 .doc 文件的库
-try:
-    import win32com.client
-    WIN32COM_AVAILABLE = True
-except ImportError:
-    WIN32COM_AVAILABLE = False
-
 from utils import util
 import utils.config_util as cfg
 from genagents.genagents import GenerativeAgent
-from genagents.modules.memory_stream import ConceptNode
+from genagents.modules.memory_stream import ConceptNode, generate_importance_score
+from genagents.modules.embedding_store import has_embedding_store, load_embeddings, save_embeddings
+from genagents.modules.node_journal import NodeJournal, has_nodes, load_nodes
+from genagents.modules.memory_tiering import MemoryTiering
+from llm.agent_cache import AgentCache, agent_is_dirty
+from llm.memory_ingest import MemoryIngestQueue
+from llm.context_assembly import CONTEXT_STAGE_TIMEOUTS, ContextAssembler
+from llm.prompt_budget import log_dropped, pack
+from llm.llm_clients import get_llm_registry
+from llm.tool_router import ToolRouter
+from utils.sentence_segmenter import SentenceSegmenter
+from llm.knowledge_index import ChunkEmbedder, KnowledgeIndex, KnowledgeBaseWatcher, ParsedDocumentCache
+from llm.document_parser import read_doc_file, read_docx_file, read_pptx_file, parse_knowledge_file
 from urllib3.exceptions import InsecureRequestWarning
 from scheduler.thread_manager import MyThread
 from core import content_db
@@ -56,8 +46,22 @@ cfg.load_config()
 # 禁用不安全请求警告
 requests.packages.urllib3.disable_warnings(category=InsecureRequestWarning)
 
-agents = {}  # type: dict[str, GenerativeAgent]
+def _flush_evicted_agent(agent_key, agent):
+    """淘汰代理前把未保存的记忆写回它加载时的目录"""
+    if memory_cleared:
+        return
+    journal = agent.memory_stream.journal if agent.memory_stream else None
+    if journal is None or not agent_is_dirty(agent):
+        return
+    agent.save(os.path.dirname(journal.memory_stream_dir))
+
+# 按LRU淘汰的代理缓存，被淘汰的代理在下次create_agent时从磁盘重新加载
+agents = AgentCache(max_agents=cfg.agent_cache_max_agents or 0,
+                    memory_budget_mb=cfg.agent_cache_memory_mb or 0,
+                    on_evict=_flush_evicted_agent)  # type: AgentCache
 agent_lock = threading.RLock()  # 使用可重入锁保护agent对象
+# 对话记忆的后台批量评分队列，LLM评分期间不持有agent_lock
+memory_ingest_queue = MemoryIngestQueue(generate_importance_score)
 reflection_lock = threading.RLock()  # 使用可重入锁保护reflection_time
 save_lock = threading.RLock()  # 使用可重入锁保护save_time
 reflection_time = None
@@ -67,13 +71,11 @@ memory_cleared = False  # 添加记忆清除标记
 # 新增: 当前会话用户名及按用户获取memory目录的辅助函数
 current_username = None  # 当前会话用户名
 
-llm = ChatOpenAI(
-        model=cfg.gpt_model_engine,
-        base_url=cfg.gpt_base_url,
-        api_key=cfg.key_gpt_api_key,
-        streaming=True,
-        max_tokens=200  # 限制回复长度为200 tokens，使回复更简短，更符合人与人之间的对话
-    )
+# 按用途（chat、planner）取LLM客户端，配置重新加载后自动切换；
+# chat的回复长度限制为chat_max_tokens（默认200 tokens），使回复更简短，更符合人与人之间的对话
+llm_clients = get_llm_registry()
+# 工具规划前的快速路由，闲聊等不需要工具的提问不经过规划器；tool_router_threshold为0（默认）时不启用
+tool_router = ToolRouter(threshold=cfg.tool_router_threshold or 0)
 
 
 @dataclass
@@ -108,7 +110,8 @@ class AgentState(TypedDict, total=False):
     messages: List[ConversationMessage]
     tool_results: List[ToolResult]
     next_action: Optional[ToolCall]
-    status: Literal["planning", "needs_tool", "completed", "failed"]
+    next_actions: Optional[List[ToolCall]]
+    status: Literal["planning", "needs_tool", "needs_tools", "completed", "failed"]
     final_response: Optional[str]
     final_messages: Optional[List[SystemMessage | HumanMessage]]
     planner_preview: Optional[str]
@@ -260,6 +263,10 @@ def _format_tool_block(spec: WorkflowToolSpec) -> str:
     return "\n".join(lines)
 
 
+# MCP服务不在本进程时，通过本机HTTP接口调用工具，复用连接
+_mcp_http_session = requests.Session()
+
+
 def _build_workflow_tool_spec(tool_def: Dict[str, Any]) -> Optional[WorkflowToolSpec]:
     if not tool_def:
         return None
@@ -271,8 +278,17 @@ def _build_workflow_tool_spec(tool_def: Dict[str, Any]) -> Optional[WorkflowTool
     example_args = _generate_example_args(schema)
 
     def _executor(args: Dict[str, Any], attempt: int) -> Tuple[bool, Optional[str], Optional[str]]:
+        # MCP服务运行在本进程内时直接通过客户端调用，不经过本机HTTP接口
+        success, result, server_id = mcp_tool_registry.call_tool(name, args)
+        if server_id is not None:
+            if success:
+                return True, _normalize_tool_output(result), None
+            error_msg = str(result or "未知错误")
+            util.log(1, f"调用工具 {name} 失败: {error_msg}")
+            return False, None, error_msg
+
         try:
-            resp = requests.post(
+            resp = _mcp_http_session.post(
                 f"http://127.0.0.1:5010/api/mcp/tools/{name}",
                 json=args,
                 timeout=120,
@@ -307,11 +323,57 @@ def _format_tools_for_prompt(tool_specs: Dict[str, WorkflowToolSpec]) -> str:
     return "\n".join(_format_tool_block(spec) for spec in tool_specs.values())
 
 
+# 按工具注册表的刷新时间缓存的工具说明与工具目录文本：(刷新时间, 工具说明, 工具目录)
+_tool_catalogue: Tuple[Optional[float], Dict[str, WorkflowToolSpec], str] = (None, {}, _format_tools_for_prompt({}))
+_tool_catalogue_lock = threading.Lock()
+
+
+def get_workflow_tools() -> Tuple[Dict[str, WorkflowToolSpec], str]:
+    """
+    获取已启用MCP工具的说明和渲染好的工具目录文本。
+    结果按工具注册表的刷新时间缓存，只有工具列表变化时才重新生成，
+    每轮规划使用字节相同的工具目录。
+    """
+    global _tool_catalogue
+    # 先取刷新时间再取工具列表：期间注册表有变化时，下次调用会重新生成
+    stamp = mcp_tool_registry.get_cache_timestamp()
+    with _tool_catalogue_lock:
+        cached_stamp, specs, tools_text = _tool_catalogue
+        if cached_stamp == stamp:
+            return dict(specs), tools_text
+
+    specs = {}
+    for tool_def in get_mcp_tools():
+        spec = _build_workflow_tool_spec(tool_def)
+        if spec:
+            specs[spec.name] = spec
+    tools_text = _format_tools_for_prompt(specs)
+    with _tool_catalogue_lock:
+        _tool_catalogue = (stamp, specs, tools_text)
+    util.log(1, f"[工具] 工具目录已更新，共 {len(specs)} 个工具")
+    return dict(specs), tools_text
+
+
+def _budget_conversation(conversation: List[ConversationMessage]) -> List[ConversationMessage]:
+    """按历史消息的token预算从最近的消息往前保留，最新一条（本轮提问）始终保留"""
+    packed = pack(
+        reversed(conversation),
+        cfg.prompt_history_tokens,
+        text=lambda msg: f"{msg['role']}: {msg['content']}",
+        contiguous=True,
+    )
+    log_dropped("历史消息", packed)
+    if not packed.kept:
+        return conversation[-1:]
+    return packed.kept[::-1]
+
+
 def _build_planner_messages(state: AgentState) -> List[SystemMessage | HumanMessage]:
     context = state.get("context", {}) or {}
     system_prompt = context.get("system_prompt", "")
     request = state.get("request", "")
     tool_specs = context.get("tool_registry", {}) or {}
+    tools_text = context.get("tools_text") or _format_tools_for_prompt(tool_specs)
     planner_preview = state.get("planner_preview")
     conversation = state.get("messages", []) or []
     history = state.get("tool_results", []) or []
@@ -319,9 +381,8 @@ def _build_planner_messages(state: AgentState) -> List[SystemMessage | HumanMess
     knowledge_context = context.get("knowledge_context", "")
     observation = context.get("observation", "")
 
-    convo_text = "\n".join(f"{msg['role']}: {msg['content']}" for msg in conversation) or "（暂无对话）"
+    convo_text = "\n".join(f"{msg['role']}: {msg['content']}" for msg in _budget_conversation(conversation)) or "（暂无对话）"
     history_text = _truncate_history(history)
-    tools_text = _format_tools_for_prompt(tool_specs)
     preview_section = f"\n（规划器预览：{planner_preview}）" if planner_preview else ""
 
     user_block = textwrap.dedent(
@@ -346,22 +407,22 @@ def _build_planner_messages(state: AgentState) -> List[SystemMessage | HumanMess
 对话及工具记录：
 {convo_text}
 
-可用工具：
-{tools_text}
-
 历史工具执行：
 {history_text}{preview_section}
 
-请返回 JSON，格式如下：
+请从系统消息列出的可用工具中选择，返回 JSON，格式如下：
 - 若需要调用工具：
     {{"action": "tool", "tool": "工具名", "args": {{...}}}}
+- 若需要同时调用多个互不依赖的工具（后一个调用不需要前一个的结果）：
+    {{"action": "tools", "calls": [{{"tool": "工具名", "args": {{...}}}}, ...]}}
 - 若直接回复：
     {{"action": "finish_text"}}
         """
     ).strip()
 
+    # 工具目录只在工具列表变化时改变，放在最前面作为每轮相同的前缀，便于服务端复用提示词缓存
     return [
-        SystemMessage(content="你负责规划下一步行动，请严格输出合法 JSON。"),
+        SystemMessage(content=f"你负责规划下一步行动，请严格输出合法 JSON。\n\n可用工具：\n{tools_text}"),
         HumanMessage(content=user_block),
     ]
 
@@ -374,7 +435,7 @@ def _build_final_messages(state: AgentState) -> List[SystemMessage | HumanMessag
     observation = context.get("observation", "")
     conversation = state.get("messages", []) or []
     planner_preview = state.get("planner_preview")
-    conversation_block = "\n".join(f"{msg['role']}: {msg['content']}" for msg in conversation) or "（暂无对话）"
+    conversation_block = "\n".join(f"{msg['role']}: {msg['content']}" for msg in _budget_conversation(conversation)) or "（暂无对话）"
     history_text = _truncate_history(state.get("tool_results", []))
     preview_section = f"\n（规划器建议：{planner_preview}）" if planner_preview else ""
 
@@ -409,7 +470,9 @@ def _build_final_messages(state: AgentState) -> List[SystemMessage | HumanMessag
 
 
 def _call_planner_llm(state: AgentState) -> Dict[str, Any]:
-    response = llm.invoke(_build_planner_messages(state))
+    started = time.time()
+    response = llm_clients.invoke("planner", _build_planner_messages(state))
+    tool_router.record_planner_latency((time.time() - started) * 1000)
     content = getattr(response, "content", None)
     if not isinstance(content, str):
         raise RuntimeError("规划器返回内容异常，未获得字符串。")
@@ -422,6 +485,61 @@ def _call_planner_llm(state: AgentState) -> Dict[str, Any]:
     return decision
 
 
+def _parse_tool_batch(calls: Any) -> List[ToolCall]:
+    """解析规划器返回的批量调用，去掉重复的调用，保持原有顺序"""
+    parsed: List[ToolCall] = []
+    seen = set()
+    for call in calls if isinstance(calls, list) else []:
+        if not isinstance(call, Mapping):
+            continue
+        name = call.get("tool") or call.get("name")
+        args = call.get("args") or {}
+        if not name:
+            continue
+        key = (name, json.dumps(args, ensure_ascii=False, sort_keys=True, default=str))
+        if key in seen:
+            continue
+        seen.add(key)
+        parsed.append({"name": name, "args": args})
+    return parsed
+
+
+def _run_tool_call(spec: WorkflowToolSpec, name: str, args: Dict[str, Any], attempts: int) -> ToolResult:
+    try:
+        success, output, error = spec.executor(args, attempts)
+    except Exception as exc:
+        util.log(1, f"调用工具 {name} 异常: {exc}")
+        success, output, error = False, None, str(exc)
+    return {
+        "call": {"name": name, "args": args},
+        "success": success,
+        "output": output,
+        "error": error,
+        "attempt": attempts + 1,
+    }
+
+
+def _record_tool_result(
+    result: ToolResult,
+    history: List[ToolResult],
+    audit_log: List[str],
+    conversation: List[ConversationMessage],
+) -> None:
+    name = result["call"]["name"]
+    success = result["success"]
+    history.append(result)
+    audit_log.append(f"执行器：{name} 第 {result['attempt']} 次 -> {'成功' if success else '失败'}")
+
+    message_lines = [
+        f"[TOOL] {name} {'成功' if success else '失败'}。",
+    ]
+    if result.get("output"):
+        message_lines.append(f"[TOOL] 输出：{_truncate_text(result['output'], 200)}")
+    if result.get("error"):
+        message_lines.append(f"[TOOL] 错误：{_truncate_text(result['error'], 200)}")
+    conversation.append({"role": "assistant", "content": "\n".join(message_lines)})
+
+
 def _plan_next_action(state: AgentState) -> AgentState:
     context = state.get("context", {}) or {}
     audit_log = list(state.get("audit_log", []))
@@ -440,6 +558,30 @@ def _plan_next_action(state: AgentState) -> AgentState:
     audit_log.append(f"规划器：决策 -> {decision.get('_raw', decision)}")
 
     action = decision.get("action")
+    if action == "tools":
+        calls = _parse_tool_batch(decision.get("calls"))
+        if len(calls) == 1:
+            action = "tool"
+            decision = {"tool": calls[0]["name"], "args": calls[0]["args"]}
+        else:
+            tool_registry: Dict[str, WorkflowToolSpec] = context.get("tool_registry", {})
+            unknown = [call["name"] for call in calls if call["name"] not in tool_registry]
+            if not calls or unknown:
+                error = f"未知工具 {', '.join(unknown)}" if unknown else "批量调用中没有有效的工具"
+                audit_log.append(f"规划器：{error}")
+                return {
+                    "status": "failed",
+                    "audit_log": audit_log,
+                    "error": error,
+                    "context": context,
+                }
+            return {
+                "next_actions": calls,
+                "status": "needs_tools",
+                "audit_log": audit_log,
+                "context": context,
+            }
+
     if action == "tool":
         tool_name = decision.get("tool")
         tool_registry: Dict[str, WorkflowToolSpec] = context.get("tool_registry", {})
@@ -530,59 +672,104 @@ def _execute_tool(state: AgentState) -> AgentState:
         }
 
     attempts = sum(1 for item in history if item.get("call", {}).get("name") == name)
-    success, output, error = spec.executor(args, attempts)
-    result: ToolResult = {
-        "call": {"name": name, "args": args},
-        "success": success,
-        "output": output,
-        "error": error,
-        "attempt": attempts + 1,
+    result = _run_tool_call(spec, name, args, attempts)
+    _record_tool_result(result, history, audit_log, conversation)
+
+    return {
+        "tool_results": history,
+        "messages": conversation,
+        "next_action": None,
+        "audit_log": audit_log,
+        "status": "planning",
+        "error": result["error"] if not result["success"] else None,
+        "context": context,
     }
-    history.append(result)
-    audit_log.append(f"执行器：{name} 第 {result['attempt']} 次 -> {'成功' if success else '失败'}")
 
-    message_lines = [
-        f"[TOOL] {name} {'成功' if success else '失败'}。",
-    ]
-    if output:
-        message_lines.append(f"[TOOL] 输出：{_truncate_text(output, 200)}")
-    if error:
-        message_lines.append(f"[TOOL] 错误：{_truncate_text(error, 200)}")
-    conversation.append({"role": "assistant", "content": "\n".join(message_lines)})
+
+def _execute_tools(state: AgentState) -> AgentState:
+    """并发执行规划器给出的一批互不依赖的工具调用，结果按调用顺序写入tool_results"""
+    context = dict(state.get("context", {}) or {})
+    actions = state.get("next_actions") or []
+    if not actions:
+        return {
+            "status": "failed",
+            "error": "缺少要执行的工具指令",
+            "context": context,
+        }
+
+    history = list(state.get("tool_results", []) or [])
+    audit_log = list(state.get("audit_log", []) or [])
+    conversation = list(state.get("messages", []) or [])
+    tool_registry: Dict[str, WorkflowToolSpec] = context.get("tool_registry", {})
+
+    attempts: Dict[str, int] = {}
+    for item in history:
+        called = item.get("call", {}).get("name")
+        attempts[called] = attempts.get(called, 0) + 1
+
+    futures = []
+    for action in actions:
+        name = action.get("name")
+        args = action.get("args", {})
+        spec = tool_registry.get(name)
+        if not spec:
+            return {
+                "status": "failed",
+                "error": f"未知工具 {name}",
+                "context": context,
+            }
+        attempt = attempts.get(name, 0)
+        attempts[name] = attempt + 1
+        futures.append(_tool_executor.submit(_run_tool_call, spec, name, args, attempt))
+
+    results = [future.result() for future in futures]
+    for result in results:
+        _record_tool_result(result, history, audit_log, conversation)
+    errors = [result["error"] for result in results if not result["success"] and result["error"]]
 
     return {
         "tool_results": history,
         "messages": conversation,
-        "next_action": None,
+        "next_actions": None,
         "audit_log": audit_log,
         "status": "planning",
-        "error": error if not success else None,
+        "error": "；".join(errors) if errors else None,
         "context": context,
     }
 
 
 def _route_decision(state: AgentState) -> str:
-    return "call_tool" if state.get("status") == "needs_tool" else "end"
+    status = state.get("status")
+    if status == "needs_tool":
+        return "call_tool"
+    if status == "needs_tools":
+        return "call_tools"
+    return "end"
 
 
 def _build_workflow_app() -> StateGraph:
     graph = StateGraph(AgentState)
     graph.add_node("plan_next", _plan_next_action)
     graph.add_node("call_tool", _execute_tool)
+    graph.add_node("call_tools", _execute_tools)
     graph.add_edge(START, "plan_next")
     graph.add_conditional_edges(
         "plan_next",
         _route_decision,
         {
             "call_tool": "call_tool",
+            "call_tools": "call_tools",
             "end": END,
         },
     )
     graph.add_edge("call_tool", "plan_next")
+    graph.add_edge("call_tools", "plan_next")
     return graph.compile()
 
 
 _WORKFLOW_APP = _build_workflow_app()
+# 工作流中批量工具调用使用的线程池，限制同时进行的工具请求数
+_tool_executor = ThreadPoolExecutor(max_workers=cfg.workflow_tool_workers or 8, thread_name_prefix="workflow_tool")
 
 def get_user_memory_dir(username=None, model_id=None):
     """根据配置决定是否按用户名和模型ID隔离记忆目录"""
@@ -632,173 +819,24 @@ def get_current_time_step(username=None):
         return 0
 
 # 新增：本地知识库相关函数
-def read_doc_file(file_path):
-    """
-    读取doc文件内容
-    
-    参数:
-        file_path: doc文件路径
-        
-    返回:
-        str: 文档内容
-    """
-    try:
-        # 方法1: 使用 win32com.client（Windows系统，推荐用于.doc文件）
-        if WIN32COM_AVAILABLE:
-            word = None
-            doc = None
-            try:
-                import pythoncom
-                pythoncom.CoInitialize()  # 初始化COM组件
-                
-                word = win32com.client.Dispatch("Word.Application")
-                word.Visible = False
-                doc = word.Documents.Open(file_path)
-                content = doc.Content.Text
-                
-                # 先保存内容，再尝试关闭
-                if content and content.strip():
-                    try:
-                        doc.Close()
-                        word.Quit()
-                    except Exception as close_e:
-                        util.log(1, f"关闭Word应用程序时出错: {str(close_e)}，但内容已成功提取")
-                    
-                    try:
-                        pythoncom.CoUninitialize()  # 清理COM组件
-                    except:
-                        pass
-                    
-                    return content.strip()
-                
-            except Exception as e:
-                util.log(1, f"使用 win32com 读取 .doc 文件失败: {str(e)}")
-            finally:
-                # 确保资源被释放
-                try:
-                    if doc:
-                        doc.Close()
-                except:
-                    pass
-                try:
-                    if word:
-                        word.Quit()
-                except:
-                    pass
-                try:
-                    pythoncom.CoUninitialize()
-                except:
-                    pass
-        
-        # 方法2: 简单的二进制文本提取（备选方案）
-        try:
-            with open(file_path, 'rb') as f:
-                raw_data = f.read()
-                # 尝试提取可打印的文本
-                text_parts = []
-                current_text = ""
-                
-                for byte in raw_data:
-                    char = chr(byte) if 32 <= byte <= 126 or byte in [9, 10, 13] else None
-                    if char:
-                        current_text += char
-                    else:
-                        if len(current_text) > 3:  # 只保留长度大于3的文本片段
-                            text_parts.append(current_text.strip())
-                        current_text = ""
-                
-                if len(current_text) > 3:
-                    text_parts.append(current_text.strip())
-                
-                # 过滤和清理文本
-                filtered_parts = []
-                for part in text_parts:
-                    # 移除过多的重复字符和无意义的片段
-                    if (len(part) > 5 and 
-                        not part.startswith('Microsoft') and 
-                        not all(c in '0123456789-_.' for c in part) and
-                        len(set(part)) > 3):  # 字符种类要多样
-                        filtered_parts.append(part)
-                
-                if filtered_parts:
-                    return '\n'.join(filtered_parts)
-                    
-        except Exception as e:
-            util.log(1, f"使用二进制方法读取 .doc 文件失败: {str(e)}")
-        
-        util.log(1, f"无法读取 .doc 文件 {file_path}，建议转换为 .docx 格式")
-        return ""
-        
-    except Exception as e:
-        util.log(1, f"读取doc文件 {file_path} 时出错: {str(e)}")
-        return ""
-
-def read_docx_file(file_path):
-    """
-    读取docx文件内容
-    
-    参数:
-        file_path: docx文件路径
-        
-    返回:
-        str: 文档内容
-    """
-    try:
-        doc = docx.Document(file_path)
-        content = []
-        
-        for element in doc.element.body:
-            if isinstance(element, CT_P):
-                paragraph = Paragraph(element, doc)
-                if paragraph.text.strip():
-                    content.append(paragraph.text.strip())
-            elif isinstance(element, CT_Tbl):
-                table = Table(element, doc)
-                for row in table.rows:
-                    row_text = []
-                    for cell in row.cells:
-                        if cell.text.strip():
-                            row_text.append(cell.text.strip())
-                    if row_text:
-                        content.append(" | ".join(row_text))
-        
-        return "\n".join(content)
-    except Exception as e:
-        util.log(1, f"读取docx文件 {file_path} 时出错: {str(e)}")
-        return ""
-    
-def read_pptx_file(file_path):
-    """
-    读取pptx文件内容
-    
-    参数:
-        file_path: pptx文件路径
-        
-    返回:
-        str: 演示文稿内容
-    """
-    if not PPTX_AVAILABLE:
-        util.log(1, "python-pptx 库未安装，无法读取 PowerPoint 文件")
-        return ""
-        
-    try:
-        prs = Presentation(file_path)
-        content = []
-        
-        for i, slide in enumerate(prs.slides):
-            slide_content = [f"第{i+1}页："]
-            
-            for shape in slide.shapes:
-                if hasattr(shape, "text") and shape.text.strip():
-                    slide_content.append(shape.text.strip())
-                    
-            if len(slide_content) > 1:  # 有内容才添加
-                content.append("\n".join(slide_content))
-        
-        return "\n\n".join(content)
-    except Exception as e:
-        util.log(1, f"读取pptx文件 {file_path} 时出错: {str(e)}")
-        return ""
+def get_knowledge_data_dir():
+    """知识库目录：llm/data"""
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+
+# 知识库分块的向量使用与记忆流相同的embedding后端
+_knowledge_embedder = ChunkEmbedder()
+
+# 知识库由后台线程加载（进程池并行解析）并轮询llm/data的变化，整体替换快照；解析结果和分块向量缓存在磁盘上
+_knowledge_watcher = KnowledgeBaseWatcher(
+    get_knowledge_data_dir(),
+    parse_knowledge_file,
+    ParsedDocumentCache(os.path.join(
+        os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        "cache_data", "knowledge_base_cache.json")),
+    interval=cfg.knowledge_watch_interval or 5.0,
+    workers=cfg.knowledge_ingest_workers or 0,
+    max_file_mb=cfg.knowledge_max_file_mb or 0,
+    embedder=_knowledge_embedder)
 
 def load_local_knowledge_base():
     """
@@ -807,52 +845,7 @@ def load_local_knowledge_base():
     返回:
         dict: 文件名到内容的映射
     """
-    knowledge_base = {}
-    
-    # 获取llm/data目录路径
-    current_dir = os.path.dirname(os.path.abspath(__file__))
-    data_dir = os.path.join(current_dir, "data")
-    
-    if not os.path.exists(data_dir):
-        util.log(1, f"知识库目录不存在: {data_dir}")
-        return knowledge_base
-    
-    # 遍历data目录中的文件
-    for file_path in Path(data_dir).iterdir():
-        if not file_path.is_file():
-            continue
-            
-        file_name = file_path.name
-        file_extension = file_path.suffix.lower()
-        
-        try:
-            if file_extension == '.docx':
-                content = read_docx_file(str(file_path))
-            elif file_extension == '.doc':
-                content = read_doc_file(str(file_path))
-            elif file_extension == '.pptx':
-                content = read_pptx_file(str(file_path))
-            else:
-                # 尝试作为文本文件读取
-                try:
-                    with open(file_path, 'r', encoding='utf-8') as f:
-                        content = f.read()
-                except UnicodeDecodeError:
-                    try:
-                        with open(file_path, 'r', encoding='gbk') as f:
-                            content = f.read()
-                    except UnicodeDecodeError:
-                        util.log(1, f"无法解码文件: {file_name}")
-                        continue
-            
-            if content.strip():
-                knowledge_base[file_name] = content
-                util.log(1, f"成功加载知识库文件: {file_name} ({len(content)} 字符)")
-            
-        except Exception as e:
-            util.log(1, f"加载知识库文件 {file_name} 时出错: {str(e)}")
-    
-    return knowledge_base
+    return _knowledge_watcher.load()
 
 def search_knowledge_base(query, knowledge_base, max_results=3):
     """
@@ -869,155 +862,44 @@ def search_knowledge_base(query, knowledge_base, max_results=3):
     if not knowledge_base:
         return []
     
-    results = []
-    query_lower = query.lower()
-    
-    # 搜索关键词
-    query_keywords = re.findall(r'\w+', query_lower)
-    
-    for file_name, content in knowledge_base.items():
-        content_lower = content.lower()
-        
-        # 计算匹配度
-        score = 0
-        matched_sentences = []
-        
-        # 按句子分割内容
-        sentences = re.split(r'[。！？\n]', content)
-        
-        for sentence in sentences:
-            if not sentence.strip():
-                continue
-                
-            sentence_lower = sentence.lower()
-            sentence_score = 0
-            
-            # 计算关键词匹配度
-            for keyword in query_keywords:
-                if keyword in sentence_lower:
-                    sentence_score += 1
-            
-            # 如果句子有匹配，记录
-            if sentence_score > 0:
-                matched_sentences.append((sentence.strip(), sentence_score))
-                score += sentence_score
-        
-        # 如果有匹配的内容
-        if score > 0:
-            # 按匹配度排序句子
-            matched_sentences.sort(key=lambda x: x[1], reverse=True)
-            
-            # 取前几个最相关的句子
-            relevant_sentences = [sent[0] for sent in matched_sentences[:5] if sent[0]]
-            
-            if relevant_sentences:
-                results.append({
-                    'file_name': file_name,
-                    'score': score,
-                    'content': '\n'.join(relevant_sentences)
-                })
-    
-    # 按匹配度排序
-    results.sort(key=lambda x: x['score'], reverse=True)
+    # 知识库快照自带加载时构建的索引；传入普通字典时临时构建（只有词法检索）
+    index = getattr(knowledge_base, 'index', None)
+    if index is None:
+        index = KnowledgeIndex(knowledge_base)
     
-    return results[:max_results]
-
-# 全局知识库缓存
-_knowledge_base_cache = None
-_knowledge_base_load_time = None
-_knowledge_base_file_times = {}  # 存储文件的最后修改时间
-
-def check_knowledge_base_changes():
-    """
-    检查知识库文件是否有变化
-    
-    返回:
-        bool: 如果有文件变化返回True，否则返回False
-    """
-    global _knowledge_base_file_times
-    
-    # 获取llm/data目录路径
-    current_dir = os.path.dirname(os.path.abspath(__file__))
-    data_dir = os.path.join(current_dir, "data")
-    
-    if not os.path.exists(data_dir):
-        return False
-    
-    current_file_times = {}
-    
-    # 遍历data目录中的文件
-    for file_path in Path(data_dir).iterdir():
-        if not file_path.is_file():
-            continue
-        
-        file_name = file_path.name
-        file_extension = file_path.suffix.lower()
-        
-        # 只检查支持的文件格式
-        if file_extension in ['.docx', '.doc', '.pptx', '.txt'] or file_extension == '':
-            try:
-                mtime = os.path.getmtime(str(file_path))
-                current_file_times[file_name] = mtime
-            except OSError:
-                continue
-    
-    # 检查是否有变化
-    if not _knowledge_base_file_times:
-        # 第一次检查，保存文件时间
-        _knowledge_base_file_times = current_file_times
-        return True
-    
-    # 比较文件时间
-    if set(current_file_times.keys()) != set(_knowledge_base_file_times.keys()):
-        # 文件数量发生变化
-        _knowledge_base_file_times = current_file_times
-        return True
-    
-    for file_name, mtime in current_file_times.items():
-        if file_name not in _knowledge_base_file_times or _knowledge_base_file_times[file_name] != mtime:
-            # 文件被修改
-            _knowledge_base_file_times = current_file_times
-            return True
-    
-    return False
+    # 词法与向量检索融合排序；查询向量走embedding的LRU缓存，不读文件
+    query_vector = _knowledge_embedder.embed_query(query) if index.has_vectors else None
+    return index.search(query, max_results=max_results, query_vector=query_vector)
 
 def init_knowledge_base():
     """
-    初始化知识库，在系统启动时调用
+    初始化知识库，在系统启动时调用：在后台线程中加载知识库并监视文件变化，
+    不阻塞启动；加载期间问答使用已经解析完的部分
     """
-    global _knowledge_base_cache, _knowledge_base_load_time
-    
     util.log(1, "初始化本地知识库...")
-    _knowledge_base_cache = load_local_knowledge_base()
-    _knowledge_base_load_time = time.time()
-    
-    # 初始化文件修改时间跟踪
-    check_knowledge_base_changes()
-    
-    util.log(1, f"知识库初始化完成，共 {len(_knowledge_base_cache)} 个文件")
+    _knowledge_watcher.start()
+    util.log(1, "知识库正在后台加载")
 
 def get_knowledge_base():
     """
-    获取知识库，使用缓存机制
+    获取知识库的当前快照。加载和文件变化检测都在后台线程进行，这里只读取快照
     
     返回:
         dict: 知识库内容
     """
-    global _knowledge_base_cache, _knowledge_base_load_time
-    
-    # 如果缓存为空，先初始化
-    if _knowledge_base_cache is None:
+    # 如果尚未初始化，先初始化
+    if not _knowledge_watcher.started:
         init_knowledge_base()
-        return _knowledge_base_cache
-    
-    # 检查文件是否有变化
-    if check_knowledge_base_changes():
-        util.log(1, "检测到知识库文件变化，正在重新加载...")
-        _knowledge_base_cache = load_local_knowledge_base()
-        _knowledge_base_load_time = time.time()
-        util.log(1, f"知识库重新加载完成，共 {len(_knowledge_base_cache)} 个文件")
+    return _knowledge_watcher.snapshot
+
+def get_knowledge_base_status():
+    """
+    获取知识库的加载进度
     
-    return _knowledge_base_cache
+    返回:
+        dict: 状态、文件总数、已处理数、可检索的文件数等
+    """
+    return _knowledge_watcher.status()
 
 
 # 定时保存记忆的线程
@@ -1098,19 +980,13 @@ def check_memory_files(username=None, model_id=None):
         os.makedirs(memory_stream_dir)
         util.log(1, f"创建memory_stream目录: {memory_stream_dir}")
     
-    # 检查必要的文件是否存在
-    embeddings_path = os.path.join(memory_stream_dir, "embeddings.json")
+    # 检查必要的文件是否存在（节点可以在nodes.json快照或追加日志中）
     nodes_path = os.path.join(memory_stream_dir, "nodes.json")
     
     # 检查文件是否存在且不为空
-    is_complete = (os.path.exists(embeddings_path) and os.path.getsize(embeddings_path) > 2 and
-                  os.path.exists(nodes_path) and os.path.getsize(nodes_path) > 2)
+    is_complete = has_nodes(memory_stream_dir)
     
     # 如果文件不存在，创建空的JSON文件
-    if not os.path.exists(embeddings_path):
-        with open(embeddings_path, 'w', encoding='utf-8') as f:
-            f.write('{}')
-    
     if not os.path.exists(nodes_path):
         with open(nodes_path, 'w', encoding='utf-8') as f:
             f.write('[]')
@@ -1138,8 +1014,9 @@ def create_agent(username=None, model_id=None):
     
     # 创建/复用代理
     with agent_lock:
-        if agent_key in agents:
-            return agents[agent_key]
+        agent = agents.lookup(agent_key)
+        if agent is not None:
+            return agent
         
         memory_dir, is_exist = check_memory_files(username, model_id)
         agent = GenerativeAgent(memory_dir)
@@ -1233,28 +1110,28 @@ def load_agent_memory(agent, username=None, model_id=None):
         memory_dir = get_user_memory_dir(username, model_id)
         memory_stream_dir = os.path.join(memory_dir, "memory_stream")
         
-        # 加载nodes.json
-        nodes_path = os.path.join(memory_stream_dir, "nodes.json")
-        if os.path.exists(nodes_path) and os.path.getsize(nodes_path) > 2:  # 文件存在且不为空
-            with open(nodes_path, 'r', encoding='utf-8') as f:
-                nodes_data = json.load(f)
-                
-                # 清空当前的seq_nodes
-                agent.memory_stream.seq_nodes = []
-                agent.memory_stream.id_to_node = {}
-                
-                # 重新创建节点
-                for node_dict in nodes_data:
-                    new_node = ConceptNode(node_dict)
-                    agent.memory_stream.seq_nodes.append(new_node)
-                    agent.memory_stream.id_to_node[new_node.node_id] = new_node
+        # 加载nodes.json快照并重放追加日志
+        if has_nodes(memory_stream_dir):
+            nodes_data = load_nodes(memory_stream_dir)
+            
+            # 清空当前的seq_nodes
+            agent.memory_stream.seq_nodes = []
+            agent.memory_stream.id_to_node = {}
+            
+            # 重新创建节点
+            for node_dict in nodes_data:
+                new_node = ConceptNode(node_dict)
+                agent.memory_stream.seq_nodes.append(new_node)
+                agent.memory_stream.id_to_node[new_node.node_id] = new_node
         
-        # 加载embeddings.json
-        embeddings_path = os.path.join(memory_stream_dir, "embeddings.json")
-        if os.path.exists(embeddings_path) and os.path.getsize(embeddings_path) > 2:  # 文件存在且不为空
-            with open(embeddings_path, 'r', encoding='utf-8') as f:
-                embeddings_data = json.load(f)
-                agent.memory_stream.embeddings = embeddings_data
+        # 加载embeddings（二进制存储按需内存映射，旧版embeddings.json会在下次保存时转换）
+        if has_embedding_store(memory_stream_dir):
+            agent.memory_stream.embeddings = load_embeddings(memory_stream_dir, agent.memory_stream.seq_nodes)
+        agent.memory_stream.restore_embeddings()
+        
+        # 之后的新节点和检索时间实时写入该目录的追加日志
+        agent.memory_stream.journal = NodeJournal(memory_stream_dir)
+        agent.memory_stream.tiering = MemoryTiering(memory_stream_dir)
         
         util.log(1, f"已加载代理记忆")
     except Exception as e:
@@ -1273,26 +1150,85 @@ def remember_conversation_thread(username, content, response_text, model_id=None
     """
     global agents
     try:
-        with agent_lock:
-            # 构建agent的缓存key
-            agent_key = f"{username}_{model_id}" if model_id else username
-            ag = agents.get(agent_key)
-            if ag is None:
-                return
-            time_step = get_current_time_step(username)
-            name = "主人" if username == "User" else username
-            # 记录对话内容
-            memory_content = f"在对话中，我回答了{name}的问题：{content}\n，我的回答是：{response_text}"
-            ag.remember(memory_content, time_step)
+        # 构建agent的缓存key
+        agent_key = f"{username}_{model_id}" if model_id else username
+        name = "主人" if username == "User" else username
+        # 记录对话内容
+        memory_content = f"在对话中，我回答了{name}的问题：{content}\n，我的回答是：{response_text}"
+
+        def _insert(importance):
+            # 评分完成后才获取agent_lock，只在插入节点时短暂持有
+            with agent_lock:
+                # 代理可能已被缓存淘汰，重新加载后再记忆
+                ag = agents.get(agent_key) or create_agent(username, model_id)
+                time_step = get_current_time_step(username)
+                ag.remember(memory_content, time_step, importance)
+
+        # 放入后台队列，与其他用户的对话一起批量评估重要性
+        memory_ingest_queue.submit(memory_content, _insert)
     except Exception as e:
         util.log(1, f"记忆对话内容出错: {str(e)}")
 
-def question(content, username, observation=None, pure_mode=False):
-    """处理用户提问并返回回复。"""
+# question()上下文准备阶段使用的线程池
+_context_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix="question_context")
+
+def _get_current_model_id(username):
+    """获取用户当前选择的模型ID"""
+    from core import member_db
+    return member_db.new_instance().get_current_model(username)
+
+def _retrieve_memory_context(agent, username, content):
+    """
+    检索与本轮提问相关的记忆，返回(记忆上下文, 检索到的记忆, 检索时的time_step)。
+    检索不修改记忆（stateless），上下文阶段超时被丢弃时不影响记忆的最近检索时间；
+    结果被采用后由调用方用memory_stream.mark_retrieved()记录本次检索。
+    """
+    if not agent.memory_stream or len(agent.memory_stream.seq_nodes) == 0:
+        return "", [], None
+    current_time_step = get_current_time_step(username)
+    query = f"{username}提出了问题：{content}"
+    related_memories = agent.memory_stream.retrieve(
+        [query],
+        current_time_step,
+        n_count=30,
+        curr_filter="all",
+        hp=[0.8, 0.5, 0.5],
+        stateless=True,
+        ranked=True,
+    )
+    if related_memories and query in related_memories:
+        # 按得分从高到低装入token预算，放入提示词时仍按时间顺序排列
+        packed = pack(related_memories[query], cfg.prompt_memory_tokens,
+                      text=lambda node: f"- {node.content}")
+        log_dropped("相关记忆", packed)
+        memory_nodes = sorted(packed.kept, key=lambda node: node.created)
+        return ("\n".join(f"- {node.content}" for node in memory_nodes),
+                related_memories[query], current_time_step)
+    return "", [], None
+
+def _search_knowledge_context(content):
+    """检索本地知识库，返回拼好的知识库上下文"""
+    knowledge_base = get_knowledge_base()
+    if not knowledge_base:
+        return ""
+    knowledge_results = search_knowledge_base(content, knowledge_base, max_results=3)
+    if not knowledge_results:
+        return ""
+    # 检索结果已按得分排序，装不下的结果跳过，继续尝试后面较短的结果
+    blocks = [f"来源文件：{result['file_name']}\n{result['content']}" for result in knowledge_results]
+    packed = pack(blocks, cfg.prompt_knowledge_tokens)
+    log_dropped("知识库信息", packed)
+    if not packed.kept:
+        return ""
+    util.log(1, f"找到 {len(knowledge_results)} 条相关知识库信息")
+    return "**本地知识库相关信息**：\n" + "\n\n".join(packed.kept)
+
+def question(content, username, observation=None, pure_mode=False, use_tools=None):
+    """处理用户提问并返回回复。use_tools为True/False时跳过快速路由，强制使用/不使用工具。"""
     global agents, current_username
     current_username = username
+    question_started = time.time()
     full_response_text = ""
-    accumulated_text = ""
     default_punctuations = [",", ".", "!", "?", "\n", "\uFF0C", "\u3002", "\uFF01", "\uFF1F"]
     is_first_sentence = True
 
@@ -1352,19 +1288,29 @@ def question(content, username, observation=None, pure_mode=False):
         
         # 纯模型模式不使用工具
         tool_registry: Dict[str, WorkflowToolSpec] = {}
+        tools_text = _format_tools_for_prompt(tool_registry)
+        persona_names = ()
         
     else:
         # 原有的角色模式逻辑
-        # 获取用户当前选择的模型ID
-        model_id = None
-        try:
-            from core import member_db
-            member_db_instance = member_db.new_instance()
-            model_id = member_db_instance.get_current_model(username)
-        except Exception as e:
-            util.log(1, f"[对话] 获取用户模型失败: {e}，使用默认配置")
+        # 相互独立的上下文获取步骤并发执行，慢的阶段超时后以空上下文继续
+        context = ContextAssembler(_context_executor, label=username)
+        context.submit("model", lambda: _get_current_model_id(username),
+                       timeout=CONTEXT_STAGE_TIMEOUTS["model"], required=True)
+        context.submit("agent", lambda model_id: create_agent(username, model_id),
+                       timeout=CONTEXT_STAGE_TIMEOUTS["agent"], after="model", required=True)
+        context.submit("memory", lambda agent: _retrieve_memory_context(agent, username, content),
+                       timeout=CONTEXT_STAGE_TIMEOUTS["memory"], default=("", [], None), after="agent")
+        context.submit("knowledge", lambda: _search_knowledge_context(content),
+                       timeout=CONTEXT_STAGE_TIMEOUTS["knowledge"], default="")
+        context.submit("history", lambda model_id: content_db.new_instance().get_recent_messages_by_user(
+                           username=username, limit=30, model_id=model_id),
+                       timeout=CONTEXT_STAGE_TIMEOUTS["history"], default=[], after="model")
+        context.submit("tools", get_workflow_tools,
+                       timeout=CONTEXT_STAGE_TIMEOUTS["tools"],
+                       default=({}, _format_tools_for_prompt({})))
         
-        agent = create_agent(username, model_id)
+        agent = context.get("agent")
 
         agent_desc = {
             "first_name": agent.scratch.get("first_name", "Fay"),
@@ -1385,40 +1331,16 @@ def question(content, username, observation=None, pure_mode=False):
             ),
         }
 
-        memory_context = ""
-        if agent.memory_stream and len(agent.memory_stream.seq_nodes) > 0:
-            current_time_step = get_current_time_step(username)
+        memory_context, retrieved_memories, retrieved_at = context.get("memory")
+        if retrieved_memories:
+            # 记忆上下文被本轮采用，才更新这些记忆的最近检索时间
             try:
-                query = f"{username}提出了问题：{content}"
-                related_memories = agent.memory_stream.retrieve(
-                    [query],
-                    current_time_step,
-                    n_count=30,
-                    curr_filter="all",
-                    hp=[0.8, 0.5, 0.5],
-                    stateless=False,
-                )
-                if related_memories and query in related_memories:
-                    memory_nodes = related_memories[query]
-                    memory_context = "\n".join(f"- {node.content}" for node in memory_nodes)
-            except Exception as exc:
-                util.log(1, f"获取相关记忆时出错: {exc}")
-
-        knowledge_context = ""
-        try:
-            knowledge_base = get_knowledge_base()
-            if knowledge_base:
-                knowledge_results = search_knowledge_base(content, knowledge_base, max_results=3)
-                if knowledge_results:
-                    parts = ["**本地知识库相关信息**："]
-                    for result in knowledge_results:
-                        parts.append(f"来源文件：{result['file_name']}")
-                        parts.append(result["content"])
-                        parts.append("")
-                    knowledge_context = "\n".join(parts).strip()
-                    util.log(1, f"找到 {len(knowledge_results)} 条相关知识库信息")
-        except Exception as exc:
-            util.log(1, f"搜索知识库时出错: {exc}")
+                agent.memory_stream.mark_retrieved(retrieved_memories, retrieved_at)
+            except Exception as e:
+                util.log(1, f"记录记忆检索时间出错: {str(e)}")
+        knowledge_context = context.get("knowledge")
+        # 角色名字出现在提问中不说明需要调用工具
+        persona_names = (agent_desc["first_name"], agent_desc["last_name"])
 
         # 根据角色名字判断是否为历史人物，调整系统提示
         character_name = agent_desc['first_name']
@@ -1462,22 +1384,9 @@ def question(content, username, observation=None, pure_mode=False):
                 "请始终以符合以上人设的身份和语气与用户交流。\n\n"
                 "重要：请保持回复简短，控制在1-3句话内，像真实的人与人之间的对话一样自然简洁。\n\n"
             )
-        if knowledge_context:
-            system_prompt = f"{system_prompt}\n{knowledge_context}"
 
-        try:
-            # 获取用户当前选择的模型ID，用于加载对应模型的历史消息
-            current_model_id = None
-            try:
-                from core import member_db
-                member_db_instance = member_db.new_instance()
-                current_model_id = member_db_instance.get_current_model(username)
-            except Exception:
-                pass
-            history_records = content_db.new_instance().get_recent_messages_by_user(username=username, limit=30, model_id=current_model_id)
-        except Exception as exc:
-            util.log(1, f"加载历史消息失败: {exc}")
-            history_records = []
+        # 历史消息按用户当前选择的模型加载
+        history_records = context.get("history")
 
         messages_buffer: List[ConversationMessage] = []
 
@@ -1501,24 +1410,26 @@ def question(content, username, observation=None, pure_mode=False):
         ):
             append_to_buffer('user', content)
 
-        messages = [SystemMessage(content=system_prompt), HumanMessage(content=content)]
+        # 规划与最终回复的提示词会单独放入知识库信息，这里只给直接调用模型时使用
+        direct_prompt = f"{system_prompt}\n{knowledge_context}" if knowledge_context else system_prompt
+        messages = [SystemMessage(content=direct_prompt), HumanMessage(content=content)]
         
-        tool_registry: Dict[str, WorkflowToolSpec] = {}
-        try:
-            mcp_tools = get_mcp_tools()
-        except Exception as exc:
-            util.log(1, f"获取工具列表失败: {exc}")
-            mcp_tools = []
-        for tool_def in mcp_tools:
-            spec = _build_workflow_tool_spec(tool_def)
-            if spec:
-                tool_registry[spec.name] = spec
+        tool_registry, tools_text = context.get("tools")
+        context.report()
+
+    # 不需要工具的提问直接走流式最终回复，不等规划器
+    use_workflow = False
+    if tool_registry:
+        route_started = time.time()
+        decision = tool_router.route(content, tool_registry, override=use_tools, persona=persona_names)
+        tool_router.log_decision(decision, (time.time() - route_started) * 1000, label=username)
+        use_workflow = decision.use_tools
 
     try:
         from utils.stream_state_manager import get_state_manager as _get_state_manager
 
         state_mgr = _get_state_manager()
-        session_label = "workflow_agent" if tool_registry else "llm_stream"
+        session_label = "workflow_agent" if use_workflow else "llm_stream"
         if not state_mgr.is_session_active(username, conversation_id=conversation_id):
             state_mgr.start_new_session(username, session_label, conversation_id=conversation_id)
     except Exception:
@@ -1532,6 +1443,9 @@ def question(content, username, observation=None, pure_mode=False):
     except Exception:
         processor = None
         punctuation_list = default_punctuations
+    # 增量分句：第一段尽早切出短分句送去TTS，之后按整句切分
+    segmenter = SentenceSegmenter(punctuation_list, started=question_started)
+
     def write_sentence(text: str, *, force_first: bool = False, force_end: bool = False) -> None:
         if text is None:
             text = ""
@@ -1557,10 +1471,16 @@ def question(content, username, observation=None, pure_mode=False):
             marked_text = f"{prefix}{text}{suffix}"
         stream_manager.new_instance().write_sentence(username, marked_text, conversation_id=conversation_id)
 
+    def write_segments(segments: List[str]) -> None:
+        nonlocal is_first_sentence
+        for sentence_text in segments:
+            write_sentence(sentence_text, force_first=is_first_sentence)
+            is_first_sentence = False
+
     def stream_response_chunks(chunks, prepend_text: str = "") -> None:
-        nonlocal accumulated_text, full_response_text, is_first_sentence
+        nonlocal full_response_text
         if prepend_text:
-            accumulated_text += prepend_text
+            write_segments(segmenter.feed(prepend_text))
             full_response_text += prepend_text
         for chunk in chunks:
             if sm.should_stop_generation(username, conversation_id=conversation_id):
@@ -1577,29 +1497,15 @@ def question(content, username, observation=None, pure_mode=False):
             if not flush_text:
                 continue
             flush_text = str(flush_text)
-            accumulated_text += flush_text
             full_response_text += flush_text
-            if len(accumulated_text) >= 20:
-                while True:
-                    last_punct_pos = -1
-                    for punct in punctuation_list:
-                        pos = accumulated_text.rfind(punct)
-                        if pos > last_punct_pos:
-                            last_punct_pos = pos
-                    if last_punct_pos > 10:
-                        sentence_text = accumulated_text[: last_punct_pos + 1]
-                        write_sentence(sentence_text, force_first=is_first_sentence)
-                        is_first_sentence = False
-                        accumulated_text = accumulated_text[last_punct_pos + 1 :].lstrip()
-                    else:
-                        break
+            write_segments(segmenter.feed(flush_text))
 
     def finalize_stream(force_end: bool = False) -> None:
-        nonlocal accumulated_text, is_first_sentence
-        if accumulated_text:
-            write_sentence(accumulated_text, force_first=is_first_sentence, force_end=force_end)
+        nonlocal is_first_sentence
+        remaining_text = segmenter.flush()
+        if remaining_text:
+            write_sentence(remaining_text, force_first=is_first_sentence, force_end=force_end)
             is_first_sentence = False
-            accumulated_text = ""
         elif force_end:
             if state_mgr is not None:
                 try:
@@ -1612,7 +1518,7 @@ def question(content, username, observation=None, pure_mode=False):
                 write_sentence("", force_end=True)
 
     def run_workflow(tool_registry: Dict[str, WorkflowToolSpec]) -> bool:
-        nonlocal accumulated_text, full_response_text, is_first_sentence, messages_buffer
+        nonlocal full_response_text, is_first_sentence, messages_buffer
 
         initial_state: AgentState = {
             "request": content,
@@ -1627,6 +1533,7 @@ def question(content, username, observation=None, pure_mode=False):
                 "observation": observation,
                 "memory_context": memory_context,
                 "tool_registry": tool_registry,
+                "tools_text": tools_text,
             },
         }
         
@@ -1635,6 +1542,7 @@ def question(content, username, observation=None, pure_mode=False):
         is_agent_think_start = False
         final_state: Optional[AgentState] = None
         final_stream_done = False
+        shown_results = 0
 
         try:
             for event in workflow_app.stream(initial_state, config=config, stream_mode="updates"):
@@ -1652,21 +1560,26 @@ def question(content, username, observation=None, pure_mode=False):
                         del messages_buffer[:-60]
 
                 if step == "plan_next":
-                    if status == "needs_tool":
-                        next_action = state.get("next_action") or {}
-                        tool_name = next_action.get("name") or "unknown_tool"
-                        tool_args = next_action.get("args") or {}
+                    if status in ("needs_tool", "needs_tools"):
+                        if status == "needs_tool":
+                            next_actions = [state.get("next_action") or {}]
+                        else:
+                            next_actions = state.get("next_actions") or []
                         audit_log = state.get("audit_log") or []
                         decision_note = audit_log[-1] if audit_log else ""
                         if "->" in decision_note:
                             decision_note = decision_note.split("->", 1)[1].strip()
-                        args_text = json.dumps(tool_args, ensure_ascii=False)
                         message_lines = [
-                            "[PLAN] Planner preparing to call a tool.",
+                            "[PLAN] Planner preparing to call a tool."
+                            if len(next_actions) == 1
+                            else f"[PLAN] Planner preparing to call {len(next_actions)} tools in parallel.",
                             f"[PLAN] Decision: {decision_note}" if decision_note else "[PLAN] Decision: (missing)",
-                            f"[PLAN] Tool: {tool_name}",
-                            f"[PLAN] Args: {args_text}",
                         ]
+                        for next_action in next_actions:
+                            tool_name = next_action.get("name") or "unknown_tool"
+                            args_text = json.dumps(next_action.get("args") or {}, ensure_ascii=False)
+                            message_lines.append(f"[PLAN] Tool: {tool_name}")
+                            message_lines.append(f"[PLAN] Args: {args_text}")
                         message = "\n".join(message_lines) + "\n"
                         if not is_agent_think_start:
                             message = "<think>" + message
@@ -1682,7 +1595,7 @@ def question(content, username, observation=None, pure_mode=False):
                         success = False
                         if final_messages:
                             try:
-                                stream_response_chunks(llm.stream(final_messages), prepend_text=closing)
+                                stream_response_chunks(llm_clients.stream("chat", final_messages), prepend_text=closing)
                                 success = True
                             except requests.exceptions.RequestException as stream_exc:
                                 util.log(1, f"最终回复流式输出失败: {stream_exc}")
@@ -1690,14 +1603,13 @@ def question(content, username, observation=None, pure_mode=False):
                             stream_response_chunks([closing + final_response])
                             success = True
                         elif closing:
-                            accumulated_text += closing
+                            write_segments(segmenter.feed(closing))
                             full_response_text += closing
                         final_stream_done = success
                         is_agent_think_start = False
-                elif step == "call_tool":
+                elif step in ("call_tool", "call_tools"):
                     history = state.get("tool_results") or []
-                    if history:
-                        last = history[-1]
+                    for last in history[shown_results:]:
                         call_info = last.get("call", {}) or {}
                         tool_name = call_info.get("name") or "unknown_tool"
                         success = last.get("success", False)
@@ -1716,26 +1628,27 @@ def question(content, username, observation=None, pure_mode=False):
                         is_first_sentence = False
                         full_response_text += message
                         append_to_buffer('assistant', message.strip())
+                    shown_results = len(history)
                 elif step == "__end__":
                     break
         except Exception as exc:
             util.log(1, f"执行工具工作流时出错: {exc}")
             if is_agent_think_start:
                 closing = "</think>"
-                accumulated_text += closing
+                write_segments(segmenter.feed(closing))
                 full_response_text += closing
             return False
 
         if final_state is None:
             if is_agent_think_start:
                 closing = "</think>"
-                accumulated_text += closing
+                write_segments(segmenter.feed(closing))
                 full_response_text += closing
             return False
 
         if not final_stream_done and is_agent_think_start:
             closing = "</think>"
-            accumulated_text += closing
+            write_segments(segmenter.feed(closing))
             full_response_text += closing
             util.log(1, f"工具工作流未能完成，状态: {final_state.get('status')}")
 
@@ -1748,10 +1661,10 @@ def question(content, username, observation=None, pure_mode=False):
         return final_stream_done
 
     def run_direct_llm() -> bool:
-        nonlocal full_response_text, accumulated_text, is_first_sentence, messages_buffer
+        nonlocal full_response_text, is_first_sentence, messages_buffer
         try:
-            if tool_registry:
-                stream_response_chunks(llm.stream(messages))
+            if use_workflow:
+                stream_response_chunks(llm_clients.stream("chat", messages))
             else:
                 summary_state: AgentState = {
                     "request": content,
@@ -1767,7 +1680,7 @@ def question(content, username, observation=None, pure_mode=False):
                 }
                 
                 final_messages = _build_final_messages(summary_state)
-                stream_response_chunks(llm.stream(final_messages))
+                stream_response_chunks(llm_clients.stream("chat", final_messages))
             return True
         except requests.exceptions.RequestException as exc:
             util.log(1, f"请求失败: {exc}")
@@ -1775,18 +1688,21 @@ def question(content, username, observation=None, pure_mode=False):
             write_sentence(error_message, force_first=is_first_sentence)
             is_first_sentence = False
             full_response_text = error_message
-            accumulated_text = ""
+            segmenter.flush()
             return False
 
     workflow_success = False
-    if tool_registry:
+    if use_workflow:
         workflow_success = run_workflow(tool_registry)
 
-    if (not tool_registry or not workflow_success) and not sm.should_stop_generation(username, conversation_id=conversation_id):
+    if (not use_workflow or not workflow_success) and not sm.should_stop_generation(username, conversation_id=conversation_id):
         run_direct_llm()
 
     if not sm.should_stop_generation(username, conversation_id=conversation_id):
         finalize_stream(force_end=True)
+    segment_metrics = segmenter.finish()
+    if segment_metrics["first_segment_ms"] is not None:
+        util.log(1, f"[分句] 首段文本 {segment_metrics['first_text_ms']:.0f}ms，首句 {segment_metrics['first_segment_ms']:.0f}ms（{segment_metrics['first_segment_chars']}字），共 {segment_metrics['segments']} 段")
 
     if state_mgr is not None:
         try:
@@ -1837,6 +1753,18 @@ def set_memory_cleared_flag(flag=True):
             except Exception as e:
                 util.log(1, f"删除记忆清除标记文件时出错: {str(e)}")
 
+def get_agent_cache_stats():
+    """
+    返回代理缓存的命中、未命中、淘汰次数及当前占用
+    """
+    return agents.stats()
+
+def get_tool_router_stats():
+    """
+    返回工具快速路由跳过规划器的次数和估算节省的时间
+    """
+    return tool_router.stats()
+
 def clear_agent_memory():
     """
     清除已加载的agent记忆，但不删除文件
@@ -1849,9 +1777,11 @@ def clear_agent_memory():
     try:
         with agent_lock:
             for agent in agents.values():
-                # 清除记忆流中的节点
+                # 清除记忆流中的节点，并停止写入追加日志
                 agent.memory_stream.seq_nodes = []
                 agent.memory_stream.id_to_node = {}
+                agent.memory_stream.journal = None
+                agent.memory_stream.tiering = None
                 
                 # 设置记忆清除标记，防止在退出时保存空记忆
                 set_memory_cleared_flag(True)
@@ -1896,6 +1826,9 @@ def perform_daily_reflection():
                 # 获取当前时间作为time_step
                 current_time_step = get_current_time_step(username)
                 agent.reflect(topic, time_step=current_time_step)
+                # 反思后把超出热记忆上限的旧观察归档并折叠为总结
+                if agent.memory_stream.tiering is not None:
+                    agent.memory_stream.tiering.run(agent.memory_stream, current_time_step)
             except KeyError as e:
                 util.log(1, f"反思时出现KeyError: {e}，跳过此次反思")
             except Exception as e:
@@ -1916,6 +1849,10 @@ def save_agent_memory():
     if memory_cleared:
         util.log(1, "检测到记忆已被清除，跳过保存操作")
         return
+
+    # 先把队列中尚未写入的对话记忆写入代理
+    if not memory_ingest_queue.flush():
+        util.log(1, "等待对话记忆写入超时，未写入的记忆将在之后写入")
     
     try:
         with save_lock:
@@ -1998,19 +1935,12 @@ def save_agent_memory():
                             os.makedirs(memory_stream_dir, exist_ok=True)
                             
                             # 保存embeddings
-                            with open(os.path.join(memory_stream_dir, "embeddings.json"), "w", encoding='utf-8') as f:
-                                json.dump(agent.memory_stream.embeddings or {}, f, ensure_ascii=False, indent=2)
+                            agent.memory_stream.embeddings = save_embeddings(
+                                agent.memory_stream.embeddings, memory_stream_dir, agent.memory_stream.seq_nodes)
                                 
-                            # 保存nodes
-                            with open(os.path.join(memory_stream_dir, "nodes.json"), "w", encoding='utf-8') as f:
-                                nodes_data = []
-                                for node in agent.memory_stream.seq_nodes:
-                                    if node is not None and hasattr(node, 'package'):
-                                        try:
-                                            nodes_data.append(node.package())
-                                        except Exception as node_e:
-                                            util.log(1, f"打包节点时出错: {str(node_e)}")
-                                json.dump(nodes_data, f, ensure_ascii=False, indent=2)
+                            # 保存nodes（写入完整快照并清空追加日志）
+                            NodeJournal(memory_stream_dir).compact(
+                                [node for node in agent.memory_stream.seq_nodes if node is not None and hasattr(node, 'package')])
                             
                             # 保存meta
                             with open(os.path.join(memory_dir, "meta.json"), "w", encoding='utf-8') as f:
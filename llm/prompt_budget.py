@@ -0,0 +1,76 @@
+import re
+from functools import lru_cache
+
+from utils import util
+
+# 中日韩文字与全角标点，按每字约1个token估算
+_WIDE_RE = re.compile(r"[　-〿㐀-䶿一-鿿豈-﫿＀-￯]")
+# 其他字符（英文、数字、空白等）按每4个字符约1个token估算
+CHARS_PER_TOKEN = 4
+
+
+@lru_cache(maxsize=8192)
+def estimate_tokens(text):
+    """
+    粗略估算文本的token数：中文与全角标点每字记1个，其余字符每4个记1个。
+    不加载分词器，结果按文本缓存，同一段记忆、知识或历史消息只计算一次。
+    """
+    if not text:
+        return 0
+    wide = len(_WIDE_RE.findall(text))
+    narrow = len(text) - wide
+    return wide + (narrow + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+class PackResult:
+    """
+    pack()的结果
+
+    属性:
+        kept: 放入预算的条目，保持传入时的优先级顺序
+        dropped: 因超出预算被丢弃的条目数
+        tokens: 放入的条目估算的token总数
+    """
+    __slots__ = ("kept", "dropped", "tokens")
+
+    def __init__(self, kept, dropped, tokens):
+        self.kept = kept
+        self.dropped = dropped
+        self.tokens = tokens
+
+
+def pack(items, budget, text=None, contiguous=False):
+    """
+    按优先级把条目装入token预算
+
+    参数:
+        items: 条目列表，按优先级从高到低排列（得分最高、或最近的在前）
+        budget: token预算，None或不大于0表示不限制
+        text: 取条目文本的函数，默认条目本身就是文本
+        contiguous: 为True时遇到第一条放不下的条目就停止（对话历史不能跳着保留），
+            否则跳过放不下的条目，继续尝试后面较短的条目
+    返回:
+        PackResult
+    """
+    items = list(items)
+    if text is None:
+        text = str
+    kept = []
+    used = 0
+    for item in items:
+        cost = estimate_tokens(text(item))
+        if budget and budget > 0 and used + cost > budget:
+            if contiguous:
+                break
+            continue
+        kept.append(item)
+        used += cost
+    return PackResult(kept, len(items) - len(kept), used)
+
+
+def log_dropped(section, result):
+    """
+    有条目因超出预算被丢弃时写日志
+    """
+    if result.dropped:
+        util.log(1, f"[上下文] {section}超出token预算，保留 {len(result.kept)} 条（约 {result.tokens} tokens），丢弃 {result.dropped} 条")
@@ -0,0 +1,223 @@
+import re
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from llm.knowledge_index import ChunkEmbedder, tokenize
+from utils import util
+
+# 提问中出现这些动作词时，认为本轮可能需要调用工具
+TOOL_CUES = (
+    "查", "搜", "找", "打开", "关闭", "播放", "暂停", "发送", "发给", "设置", "设定",
+    "提醒", "闹钟", "计算", "换算", "翻译", "下载", "上传", "预订", "预约", "导航",
+    "天气", "新闻", "股价", "汇率", "日程", "截图", "运行", "执行", "调用",
+    "记一下", "记下", "删", "取消", "修改", "添加",
+)
+# 词法匹配时忽略的常见词：只靠这些词与工具说明重合不能说明需要调用工具
+STOPWORDS = frozenset((
+    "的", "了", "吗", "呢", "啊", "吧", "呀", "我", "你", "他", "她", "它", "是", "在",
+    "有", "和", "就", "都", "也", "要", "给", "把", "好", "很",
+    "今天", "明天", "昨天", "现在", "我们", "你们", "他们", "一下", "一个", "什么",
+    "怎么", "可以", "这个", "那个", "你好", "帮我", "请问", "谢谢", "好的", "默认",
+    "the", "a", "an", "to", "of", "is", "and", "or", "in", "on", "for", "me", "you",
+))
+_ASCII_WORD_RE = re.compile(r"[a-z0-9_]+")
+# 提问与工具说明的向量余弦相似度达到此值时认为可能需要调用工具
+EMBEDDING_THRESHOLD = 0.45
+# 规划器耗时的滑动平均系数
+LATENCY_SMOOTHING = 0.2
+# 最多缓存多少个工具说明的分词和向量
+TOOL_CACHE_SIZE = 256
+
+
+class RouteDecision:
+    """
+    路由结果
+
+    属性:
+        use_tools: 是否交给工具规划器
+        score: 词法得分（提问的词在工具说明中出现的比例，提到工具名记为1）
+        similarity: 与工具说明的最大向量相似度，没有向量时为None
+        tool: 得分最高的工具名
+        reason: 判断依据，写入日志
+    """
+    __slots__ = ("use_tools", "score", "similarity", "tool", "reason")
+
+    def __init__(self, use_tools, score=0.0, similarity=None, tool=None, reason=""):
+        self.use_tools = use_tools
+        self.score = score
+        self.similarity = similarity
+        self.tool = tool
+        self.reason = reason
+
+
+class ToolRouter:
+    """
+    工具规划前的快速路由。
+
+    启用了MCP工具时，原来每轮对话都要先等规划器的一次非流式LLM调用返回JSON，
+    闲聊也不例外。route()先用关键词和工具说明做一次廉价的判断：提问中有动作词、
+    提到工具名，或与某个工具说明的词法得分达到阈值时交给规划器；只有配置了
+    向量模型、且提问与所有工具说明的相似度都低于EMBEDDING_THRESHOLD时才认为
+    不需要工具，直接走流式最终回复。拿不准的情况（包括没有配置向量模型）
+    交给规划器。threshold不大于0时每轮都交给规划器（原来的行为）。
+    """
+    def __init__(self, threshold=0.1, embedder=None):
+        self.threshold = threshold
+        self.embedder = embedder or ChunkEmbedder()
+        self._tools = OrderedDict()
+        self._lock = threading.Lock()
+        self._planner_ms = None
+        self.routed = 0
+        self.skipped = 0
+        self.saved_ms = 0.0
+
+    def _tool_entry(self, name, text):
+        key = (name, text)
+        with self._lock:
+            entry = self._tools.get(key)
+            if entry is not None:
+                self._tools.move_to_end(key)
+                return entry
+        entry = {"tokens": set(tokenize(text)), "vector": None}
+        with self._lock:
+            self._tools[key] = entry
+            while len(self._tools) > TOOL_CACHE_SIZE:
+                self._tools.popitem(last=False)
+        return entry
+
+    def _similarities(self, query, entries):
+        if not self.embedder.enabled:
+            return None
+        try:
+            missing = [(key, entry) for key, entry in entries if entry["vector"] is None]
+            if missing:
+                vectors = self.embedder.embed([key[1] for key, _ in missing])
+                for (_, entry), vector in zip(missing, vectors):
+                    entry["vector"] = vector
+            query_vector = self.embedder.embed_query(query)
+        except Exception as e:
+            util.log(1, f"[工具路由] 生成向量出错: {str(e)}")
+            return None
+        if query_vector is None:
+            return None
+        matrix = np.asarray([entry["vector"] for _, entry in entries], dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1) * float(np.linalg.norm(query_vector))
+        norms[norms == 0] = 1.0
+        return (matrix @ np.asarray(query_vector, dtype=np.float32)) / norms
+
+    def route(self, query, tool_specs, override=None, persona=()):
+        """
+        判断本轮是否需要交给工具规划器
+
+        参数:
+            query: 用户提问
+            tool_specs: 工具名到WorkflowToolSpec（有name、description、schema）的映射
+            override: True强制走规划器，False强制不调用工具，None由路由判断
+            persona: 角色名字等，词法匹配时忽略其中的词
+        返回:
+            RouteDecision
+        """
+        if not tool_specs:
+            return RouteDecision(False, reason="没有可用工具")
+        if override is not None:
+            return RouteDecision(bool(override), reason="指定")
+        if self.threshold <= 0:
+            return RouteDecision(True, reason="未启用快速路由")
+        text = (query or "").strip()
+        if not text:
+            return RouteDecision(False, reason="空提问")
+        lowered = text.lower()
+
+        for cue in TOOL_CUES:
+            if cue in text:
+                return RouteDecision(True, score=1.0, reason=f"动作词“{cue}”")
+
+        ignored = set(STOPWORDS)
+        for name in persona or ():
+            if name:
+                ignored.update(tokenize(name))
+        query_tokens = set(tokenize(text)) - ignored
+        words = set(_ASCII_WORD_RE.findall(lowered))
+        entries = []
+        best_score, best_tool = 0.0, None
+        for name, spec in tool_specs.items():
+            if name.lower() in words or (len(name) > 3 and name.lower() in lowered):
+                return RouteDecision(True, score=1.0, tool=name, reason="提到工具名")
+            key, entry = self._entry_for(name, spec)
+            entries.append((key, entry))
+            if query_tokens:
+                score = len(query_tokens & entry["tokens"]) / len(query_tokens)
+                if score > best_score:
+                    best_score, best_tool = score, name
+        if best_score >= self.threshold:
+            return RouteDecision(True, score=best_score, tool=best_tool, reason="词法匹配")
+
+        # 没有向量模型（或生成向量出错）时无法确认与工具无关，交给规划器
+        similarities = self._similarities(text, entries)
+        if similarities is None or not len(similarities):
+            return RouteDecision(True, score=best_score, tool=best_tool, reason="无法判断")
+        index = int(np.argmax(similarities))
+        similarity = float(similarities[index])
+        if similarity >= EMBEDDING_THRESHOLD:
+            return RouteDecision(True, score=best_score, similarity=similarity,
+                                 tool=entries[index][0][0], reason="语义匹配")
+        return RouteDecision(False, score=best_score, similarity=similarity, reason="与工具无关")
+
+    def _entry_for(self, name, spec):
+        properties = (getattr(spec, "schema", None) or {}).get("properties") or {}
+        parts = [name, getattr(spec, "description", "") or ""]
+        for prop_name, prop in properties.items():
+            parts.append(prop_name)
+            if isinstance(prop, dict) and prop.get("description"):
+                parts.append(str(prop["description"]))
+        text = "\n".join(parts)
+        return (name, text), self._tool_entry(name, text)
+
+    def record_planner_latency(self, elapsed_ms):
+        """
+        记录一次规划器调用的耗时，用于估算跳过规划器节省的时间
+        """
+        with self._lock:
+            if self._planner_ms is None:
+                self._planner_ms = elapsed_ms
+            else:
+                self._planner_ms += LATENCY_SMOOTHING * (elapsed_ms - self._planner_ms)
+
+    def log_decision(self, decision, elapsed_ms, label=""):
+        """
+        写路由日志；跳过规划器时按规划器平均耗时累计节省的时间
+        """
+        with self._lock:
+            self.routed += 1
+            saved = None
+            if not decision.use_tools:
+                self.skipped += 1
+                saved = self._planner_ms
+                if saved is not None:
+                    self.saved_ms += saved
+        label = f"{label} " if label else ""
+        detail = f"得分 {decision.score:.2f}"
+        if decision.similarity is not None:
+            detail += f"，相似度 {decision.similarity:.2f}"
+        if decision.tool:
+            detail += f"，工具 {decision.tool}"
+        if decision.use_tools:
+            util.log(1, f"[工具路由] {label}交给规划器（{decision.reason}，{detail}），路由耗时 {elapsed_ms:.0f}ms")
+        elif saved is None:
+            util.log(1, f"[工具路由] {label}跳过规划器（{decision.reason}，{detail}），路由耗时 {elapsed_ms:.0f}ms")
+        else:
+            util.log(1, f"[工具路由] {label}跳过规划器（{decision.reason}，{detail}），路由耗时 {elapsed_ms:.0f}ms，约节省 {saved:.0f}ms")
+
+    def stats(self):
+        """
+        返回路由次数、跳过规划器的次数、累计节省的时间和规划器平均耗时（毫秒）
+        """
+        with self._lock:
+            return {
+                "routed": self.routed,
+                "skipped": self.skipped,
+                "saved_ms": round(self.saved_ms, 1),
+                "planner_avg_ms": None if self._planner_ms is None else round(self._planner_ms, 1),
+            }
@@ -10,13 +10,6 @@ import signal
 import atexit
 import threading
 from utils import config_util, util
-from asr import ali_nls
-from core import wsa_server
-from gui import flask_server
-from core import content_db
-import fay_booter
-from scheduler.thread_manager import MyThread
-from core.interact import Interact
 
 # import sys, io, traceback
 # class StdoutInterceptor(io.TextIOBase):
@@ -84,26 +77,6 @@ def signal_handler(signum, frame):
         util.log(1, '清理超时，立即强制退出...')
         os._exit(1)
 
-# 注册退出处理和信号处理
-atexit.register(cleanup_on_exit)
-try:
-    signal.signal(signal.SIGINT, signal_handler)   # Ctrl+C
-    signal.signal(signal.SIGTERM, signal_handler)  # 终止信号
-    # Windows特有信号
-    if hasattr(signal, 'SIGBREAK'):
-        signal.signal(signal.SIGBREAK, signal_handler)
-except Exception as e:
-    util.log(1, f'注册信号处理器失败: {e}')
-
-#载入配置
-config_util.load_config()
-
-#是否为普通模式（桌面模式）
-if config_util.start_mode == 'common':
-    from PyQt5 import QtGui
-    from PyQt5.QtWidgets import QApplication
-    from gui.window import MainWindow
-
 #音频清理
 def __clear_samples():
     if not os.path.exists("./samples"):
@@ -194,7 +167,37 @@ def console_listener():
 
 
 
+# 以下只在作为入口运行时执行：知识库解析进程池（spawn）的子进程会以__mp_main__导入本文件，
+# 不能在子进程中重复加载配置、注册退出处理或导入服务模块
 if __name__ == '__main__':
+    # 注册退出处理和信号处理
+    atexit.register(cleanup_on_exit)
+    try:
+        signal.signal(signal.SIGINT, signal_handler)   # Ctrl+C
+        signal.signal(signal.SIGTERM, signal_handler)  # 终止信号
+        # Windows特有信号
+        if hasattr(signal, 'SIGBREAK'):
+            signal.signal(signal.SIGBREAK, signal_handler)
+    except Exception as e:
+        util.log(1, f'注册信号处理器失败: {e}')
+
+    from asr import ali_nls
+    from core import wsa_server
+    from gui import flask_server
+    from core import content_db
+    import fay_booter
+    from scheduler.thread_manager import MyThread
+    from core.interact import Interact
+
+    #载入配置
+    config_util.load_config()
+
+    #是否为普通模式（桌面模式）
+    if config_util.start_mode == 'common':
+        from PyQt5 import QtGui
+        from PyQt5.QtWidgets import QApplication
+        from gui.window import MainWindow
+
     __clear_samples()
     __create_memory()
     __clear_logs()
@@ -0,0 +1,250 @@
+import math
+import random
+import zlib
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+# ============================================================================
+# ######################## [SECTION 1: PROVIDERS] ############################
+# ============================================================================
+
+def normalize_text(text):
+  """
+  The form a text is embedded (and cached) in.
+  """
+  return text.replace("\n", " ").strip()
+
+
+class EmbeddingProvider:
+  """
+  A local embedding backend. embed_batch receives normalized, non-empty
+  texts and returns a float array of shape (len(texts), dim).
+  """
+  name = None
+  dim = None
+
+  def embed_batch(self, texts):
+    raise NotImplementedError
+
+
+class MockEmbeddingProvider(EmbeddingProvider):
+  """
+  The original mock: a random unit vector seeded from the SHA256 of the text.
+  The vectors are bit-for-bit the ones the per-float random.uniform loop
+  produced, so embeddings that are already stored stay comparable, but the
+  Mersenne Twister state is handed to numpy instead of reseeding the global
+  random module and drawing 1536 floats in Python.
+  """
+  name = "mock"
+
+  def __init__(self, dim=1536):
+    self.dim = dim
+    self._rng = np.random.RandomState()
+
+
+  def _seed(self, text):
+    try:
+      return int(hashlib.sha256(text.encode("utf-8")).hexdigest(), 16) % (10 ** 8)
+    except Exception as e:
+      print(f"处理文本哈希时出错: {str(e)}")
+      return 42
+
+
+  def embed_batch(self, texts):
+    out = np.empty((len(texts), self.dim), dtype=np.float64)
+    for i, text in enumerate(texts):
+      # random.seed(int) and numpy's legacy generator share MT19937 and the
+      # 53-bit double construction, so copying the seeded state over yields
+      # the same random.uniform(-1, 1) sequence.
+      version, state, gauss = random.Random(self._seed(text)).getstate()
+      self._rng.set_state(("MT19937", np.array(state[:624], dtype=np.uint32),
+                           state[624]))
+      vector = -1 + 2 * self._rng.random_sample(self.dim)
+      # Sequential sum of squares, exactly like sum(x*x for x in vector).
+      magnitude = math.sqrt(np.cumsum(vector * vector)[-1])
+      out[i] = vector / magnitude
+    return out
+
+
+class HashingEmbeddingProvider(EmbeddingProvider):
+  """
+  Hashed character n-gram projection. Texts that share characters and short
+  phrases (which works for Chinese as well as space separated languages) get
+  similar vectors, without a model or network call. Each n-gram is hashed
+  with crc32 to a signed bucket; rows are L2-normalized.
+  """
+  name = "hashing"
+
+  def __init__(self, dim=512, ngram_range=(1, 3)):
+    self.dim = dim
+    self.ngram_range = ngram_range
+
+
+  def _features(self, text):
+    text = text.lower()
+    low, high = self.ngram_range
+    for n in range(low, high + 1):
+      for start in range(0, len(text) - n + 1):
+        gram = text[start:start + n]
+        if not gram.isspace():
+          yield gram
+
+
+  def embed_batch(self, texts):
+    rows, cols, signs = [], [], []
+    for i, text in enumerate(texts):
+      for gram in self._features(text):
+        h = zlib.crc32(gram.encode("utf-8"))
+        rows.append(i)
+        cols.append(h % self.dim)
+        signs.append(1.0 if h & 0x80000000 else -1.0)
+    out = np.zeros((len(texts), self.dim), dtype=np.float64)
+    if rows:
+      np.add.at(out, (np.array(rows), np.array(cols)), np.array(signs))
+    norms = np.linalg.norm(out, axis=1, keepdims=True)
+    return out / np.where(norms == 0, 1.0, norms)
+
+
+class SentenceTransformerProvider(EmbeddingProvider):
+  """
+  A local sentence-transformers model (optional dependency).
+  """
+  name = "sentence_transformers"
+
+  def __init__(self, model_name=None):
+    from sentence_transformers import SentenceTransformer
+    self.model_name = model_name or "BAAI/bge-small-zh-v1.5"
+    self.model = SentenceTransformer(self.model_name)
+    self.dim = self.model.get_sentence_embedding_dimension()
+
+
+  def embed_batch(self, texts):
+    return np.asarray(self.model.encode(list(texts), batch_size=64,
+                                        normalize_embeddings=True),
+                      dtype=np.float64)
+
+
+PROVIDERS = {
+  MockEmbeddingProvider.name: MockEmbeddingProvider,
+  HashingEmbeddingProvider.name: HashingEmbeddingProvider,
+  SentenceTransformerProvider.name: SentenceTransformerProvider,
+}
+
+
+def create_embedding_provider(backend="mock", model=None):
+  """
+  Builds the provider for a backend name. An unknown backend, or one whose
+  optional dependency is missing, falls back to the mock.
+  """
+  provider_cls = PROVIDERS.get(backend)
+  if provider_cls is None:
+    print(f"未知的embedding后端: {backend}，使用mock")
+    return MockEmbeddingProvider()
+  try:
+    if provider_cls is SentenceTransformerProvider:
+      return provider_cls(model)
+    return provider_cls()
+  except ImportError as e:
+    print(f"embedding后端 {backend} 不可用({str(e)})，使用mock")
+    return MockEmbeddingProvider()
+
+
+# ============================================================================
+# ########################## [SECTION 2: LRU CACHE] ##########################
+# ============================================================================
+
+class EmbeddingCache:
+  """
+  Bounded LRU of normalized text -> read-only embedding array.
+  """
+  def __init__(self, maxsize=4096):
+    self.maxsize = maxsize
+    self._data = OrderedDict()
+    self._lock = threading.Lock()
+
+
+  def get(self, key):
+    with self._lock:
+      value = self._data.get(key)
+      if value is not None:
+        self._data.move_to_end(key)
+      return value
+
+
+  def put(self, key, value):
+    if self.maxsize <= 0:
+      return
+    with self._lock:
+      self._data[key] = value
+      self._data.move_to_end(key)
+      while len(self._data) > self.maxsize:
+        self._data.popitem(last=False)
+
+
+  def clear(self):
+    with self._lock:
+      self._data.clear()
+
+
+  def __len__(self):
+    return len(self._data)
+
+
+_config = {"backend": "mock", "model": None}
+_provider = None
+_provider_lock = threading.Lock()
+_cache = EmbeddingCache()
+
+
+def configure(backend="mock", model=None, cache_size=4096):
+  """
+  Selects the backend used by embed(). The provider itself is only built on
+  first use, and the cache is emptied since vectors of different backends
+  are not comparable.
+  """
+  global _provider, _cache
+  with _provider_lock:
+    _config["backend"] = backend
+    _config["model"] = model
+    _provider = None
+    _cache = EmbeddingCache(cache_size)
+
+
+def get_provider():
+  global _provider
+  if _provider is None:
+    with _provider_lock:
+      if _provider is None:
+        _provider = create_embedding_provider(_config["backend"], _config["model"])
+  return _provider
+
+
+def embed(texts):
+  """
+  Embeds normalized, non-empty texts. Cached texts are served from the LRU;
+  the rest (deduplicated) go to the provider in a single batch.
+
+  Parameters:
+    texts: list of normalized texts
+  Returns:
+    A list of read-only float arrays, one per text.
+  """
+  provider = get_provider()
+  cache = _cache
+  out = [cache.get(text) for text in texts]
+  misses = list(dict.fromkeys(text for text, vector in zip(texts, out)
+                              if vector is None))
+  if misses:
+    fresh = dict()
+    for text, vector in zip(misses, provider.embed_batch(misses)):
+      vector = np.array(vector, dtype=np.float64)
+      vector.flags.writeable = False
+      fresh[text] = vector
+      cache.put(text, vector)
+    out = [fresh[text] if vector is None else vector
+           for text, vector in zip(texts, out)]
+  return out
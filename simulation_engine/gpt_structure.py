@@ -4,6 +4,7 @@ import base64
 from typing import List, Dict, Any, Union, Optional
 import os
 from simulation_engine.settings import *
+from simulation_engine import embedding_provider
 from utils import config_util as cfg
 
 
@@ -215,67 +216,41 @@ def chat_safe_generate(prompt_input: Union[str, List[str]],
 # #################### [SECTION 3: OTHER API FUNCTIONS] ######################
 # ============================================================================
 
-# 添加模拟embedding函数
-def _create_mock_embedding(dimension=1536):
-  """创建一个模拟的embedding函数，用于替代真实API"""
-  import random
-  import math
-  import hashlib
-  
-  def _get_mock_vector(text):
-    """生成一个随机但一致的embedding向量"""
-    # 使用文本的哈希值作为随机种子，确保相同文本生成相同向量
-    # 使用hashlib代替hash()函数，确保编码一致性
-    try:
-      # 确保文本是UTF-8编码
-      if isinstance(text, str):
-        text_bytes = text.encode('utf-8')
-      else:
-        text_bytes = str(text).encode('utf-8')
-      
-      # 使用SHA256生成哈希值
-      hash_value = int(hashlib.sha256(text_bytes).hexdigest(), 16) % (10 ** 8)
-      random.seed(hash_value)
-    except Exception as e:
-      # 如果出现编码错误，使用一个固定的种子
-      print(f"处理文本哈希时出错: {str(e)}")
-      random.seed(42)
-    
-    # 生成随机向量
-    vector = [random.uniform(-1, 1) for _ in range(dimension)]
-    
-    # 归一化向量
-    magnitude = math.sqrt(sum(x*x for x in vector))
-    normalized_vector = [x/magnitude for x in vector]
-    
-    return normalized_vector
-  
-  return _get_mock_vector
+# embedding由本地后端生成（见embedding_provider），按文本做LRU缓存
+embedding_provider.configure(EMBEDDING_BACKEND, EMBEDDING_LOCAL_MODEL,
+                             EMBEDDING_CACHE_SIZE)
 
-# 创建模拟函数实例
-_mock_embedding_function = _create_mock_embedding(1536)
 
 def get_text_embedding(text: str, 
                        model: str = "text-embedding-3-small") -> List[float]:
-  """生成文本的embedding向量，使用模拟函数"""
-  try:
-    # 确保输入是有效的字符串
+  """生成文本的embedding向量"""
+  return get_text_embeddings([text], model)[0]
+
+
+def get_text_embeddings(texts: List[str],
+                        model: str = "text-embedding-3-small") -> List[List[float]]:
+  """批量生成多个文本的embedding向量，返回顺序与输入一致"""
+  # 无效输入得到默认（全零）embedding
+  embeddings = [None] * len(texts)
+  batch = []
+  for i, text in enumerate(texts):
     if not isinstance(text, str):
       print("Embedding错误: 输入必须是字符串类型")
-      return [0.0] * 1536  # 返回默认embedding
-    
-    # 处理空字符串
-    if not text.strip():
+    elif not text.strip():
       print("Embedding警告: 输入字符串为空")
-      return [0.0] * 1536  # 返回默认embedding
-    
-    # 标准化文本，替换换行符并去除首尾空格
-    text = text.replace("\n", " ").strip()
-    
-    # 使用模拟函数生成embedding
-    return _mock_embedding_function(text)
+    else:
+      # 标准化文本，替换换行符并去除首尾空格
+      batch.append((i, embedding_provider.normalize_text(text)))
+
+  try:
+    # 未命中缓存的文本一次性交给后端生成
+    vectors = embedding_provider.embed([text for _, text in batch])
+    for (i, _), vector in zip(batch, vectors):
+      embeddings[i] = vector.tolist()
   except Exception as e:
     # 捕获所有异常，确保函数不会崩溃
     print(f"生成embedding时出错: {str(e)}")
-    # 返回一个默认的embedding
-    return [0.0] * 1536
+
+  dim = embedding_provider.get_provider().dim
+  return [[0.0] * dim if embedding is None else embedding
+          for embedding in embeddings]
@@ -24,6 +24,15 @@ MAX_CHUNK_SIZE = 4
 # 使用system.conf中的模型配置
 LLM_VERS = cfg.gpt_model_engine
 
+# 本地embedding后端: mock（与已有记忆的向量一致）/ hashing / sentence_transformers
+EMBEDDING_BACKEND = cfg.embedding_backend or "mock"
+EMBEDDING_LOCAL_MODEL = cfg.embedding_local_model
+EMBEDDING_CACHE_SIZE = 4096
+
+# 记忆分层: 热记忆超过该节点数后，旧的普通观察被归档并折叠为总结（0表示不分层）
+# 默认值低于IVF索引的min_rows（4096），分层时检索始终精确；不分层或调高该值后才会启用IVF索引
+MEMORY_HOT_MAX_NODES = cfg.memory_hot_max_nodes if cfg.memory_hot_max_nodes is not None else 2000
+
 ## To do: Are the following needed in the new structure? Ideally Populations_Dir is for the user to define.
 POPULATIONS_DIR = f"{BASE_DIR}/agent_bank/populations" 
 LLM_PROMPT_DIR = f"{BASE_DIR}/simulation_engine/prompt_template" 
\ No newline at end of file
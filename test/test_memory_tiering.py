@@ -0,0 +1,59 @@
+import json
+import os
+
+import numpy as np
+
+from genagents.modules.embedding_store import EMBEDDINGS_BIN, EMBEDDINGS_INDEX, load_embeddings
+from genagents.modules.memory_stream import MemoryStream
+from genagents.modules.memory_tiering import MemoryTiering
+
+DIM = 8
+
+
+def _add_observations(memory_stream, count, rng):
+    for _ in range(count):
+        time_step = memory_stream.seq_nodes[-1].node_id + 1 if memory_stream.seq_nodes else 0
+        memory_stream._add_node(time_step, "observation", f"memory {time_step} {rng.random()}", 10, None,
+                                rng.standard_normal(DIM))
+
+
+def _hot_store(memory_stream_dir):
+    with open(os.path.join(memory_stream_dir, EMBEDDINGS_INDEX), encoding="utf-8") as f:
+        index = json.load(f)
+    return os.path.getsize(os.path.join(memory_stream_dir, EMBEDDINGS_BIN)), index
+
+
+def test_hot_store_stays_bounded_across_tiering_runs(tmp_path):
+    memory_stream_dir = str(tmp_path)
+    rng = np.random.default_rng(0)
+    memory_stream = MemoryStream([], {})
+    tiering = MemoryTiering(memory_stream_dir, max_hot=200, recent_window=50, summarize=False)
+
+    for round_ in range(5):
+        _add_observations(memory_stream, 300, rng)
+        assert tiering.run(memory_stream, round_) > 0
+        size, index = _hot_store(memory_stream_dir)
+        assert len(memory_stream.seq_nodes) <= 200
+        assert index["count"] == len(memory_stream.seq_nodes)
+        assert size == index["count"] * DIM * 4
+        assert not index["missing"]
+
+    # 重新打开后，热记忆的向量仍能按节点读到
+    store = load_embeddings(memory_stream_dir, memory_stream.seq_nodes)
+    for node in memory_stream.seq_nodes:
+        assert np.allclose(store[node.content], memory_stream.embeddings[node.content])
+    assert len(tiering.archive) == 1500 - len(memory_stream.seq_nodes)
+
+
+def test_archive_store_holds_only_archived_rows(tmp_path):
+    memory_stream_dir = str(tmp_path)
+    rng = np.random.default_rng(1)
+    memory_stream = MemoryStream([], {})
+    tiering = MemoryTiering(memory_stream_dir, max_hot=100, recent_window=20, summarize=False)
+    for round_ in range(3):
+        _add_observations(memory_stream, 150, rng)
+        tiering.run(memory_stream, round_)
+
+    size, index = _hot_store(os.path.join(memory_stream_dir, "archive"))
+    assert index["count"] == len(tiering.archive)
+    assert size == index["count"] * DIM * 4
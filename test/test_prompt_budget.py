@@ -0,0 +1,39 @@
+from llm.prompt_budget import estimate_tokens, pack
+
+
+def test_estimate_tokens():
+    assert estimate_tokens("") == 0
+    assert estimate_tokens("你好，世界") == 5
+    assert estimate_tokens("abcd") == 1
+    assert estimate_tokens("abcde") == 2
+    assert estimate_tokens("你好abcd") == 3
+
+
+def test_pack_keeps_items_that_fit_in_priority_order():
+    items = ["一二三四", "一二三四五六", "一二"]
+    packed = pack(items, 7)
+    assert packed.kept == ["一二三四", "一二"]
+    assert packed.dropped == 1
+    assert packed.tokens == 6
+
+
+def test_pack_item_exactly_filling_the_budget_is_kept():
+    packed = pack(["一二三", "四五"], 5)
+    assert packed.kept == ["一二三", "四五"]
+    assert packed.tokens == 5
+
+
+def test_contiguous_pack_stops_at_first_item_that_does_not_fit():
+    items = ["一二三四", "一二三四五六", "一二"]
+    packed = pack(items, 7, contiguous=True)
+    assert packed.kept == ["一二三四"]
+    assert packed.dropped == 2
+
+
+def test_pack_without_budget_keeps_everything():
+    items = [{"text": "一二三"}, {"text": "四五六"}]
+    for budget in (None, 0, -1):
+        packed = pack(items, budget, text=lambda item: item["text"])
+        assert packed.kept == items
+        assert packed.dropped == 0
+        assert packed.tokens == 6
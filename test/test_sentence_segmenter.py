@@ -0,0 +1,45 @@
+from utils.sentence_segmenter import AdaptivePolicy, SentencePolicy, SentenceSegmenter
+
+PUNCTUATIONS = "，。！？；,.!?;"
+
+
+def _segments(segmenter, chunks):
+    out = []
+    for chunk in chunks:
+        out.extend(segmenter.feed(chunk))
+    tail = segmenter.flush()
+    if tail:
+        out.append(tail)
+    return out
+
+
+def test_adaptive_policy_cuts_first_short_clause():
+    segmenter = SentenceSegmenter(PUNCTUATIONS, AdaptivePolicy(first_min_chars=4))
+    assert segmenter.feed("嗯，") == []
+    assert segmenter.feed("好的。我") == ["嗯，好的。"]
+    assert segmenter.metrics()["first_segment_chars"] == 5
+
+
+def test_adaptive_policy_uses_whole_sentences_after_the_first():
+    segmenter = SentenceSegmenter(PUNCTUATIONS, AdaptivePolicy(first_min_chars=4, min_chars=20, min_offset=10))
+    text = "好的，没问题。明天上午九点的会议我已经帮你记下来了，到时候会提醒你。还有别的吗"
+    segments = _segments(segmenter, [text[i:i + 3] for i in range(0, len(text), 3)])
+    assert segments[0] == "好的，没问题。"
+    assert "".join(segments) == text
+    # 之后的段都切在位于min_offset之后的标点上
+    assert all(segment[-1] in PUNCTUATIONS and len(segment) > 10 for segment in segments[1:-1])
+
+
+def test_sentence_policy_waits_for_min_chars():
+    segmenter = SentenceSegmenter(PUNCTUATIONS, SentencePolicy(min_chars=20, min_offset=10))
+    assert segmenter.feed("嗯，好的。") == []
+    segments = segmenter.feed("我已经帮你把明天的会议安排好了。")
+    assert segments == ["嗯，好的。我已经帮你把明天的会议安排好了。"]
+
+
+def test_flush_returns_rest_and_strips_leading_whitespace():
+    segmenter = SentenceSegmenter(PUNCTUATIONS, AdaptivePolicy(first_min_chars=4))
+    assert segmenter.feed("你好啊，  后面没有标点") == ["你好啊，"]
+    assert segmenter.pending == "后面没有标点"
+    assert segmenter.flush() == "后面没有标点"
+    assert segmenter.flush() == ""
@@ -0,0 +1,82 @@
+import pytest
+
+from faymcp import tool_cache, tool_registry
+
+
+@pytest.fixture(autouse=True)
+def clean_state():
+    tool_registry.reset()
+    tool_cache.reset()
+    yield
+    tool_registry.reset()
+    tool_cache.reset()
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(tool_cache.time, "time", lambda: now[0])
+    return now
+
+
+def _counting(result):
+    calls = []
+
+    def invoke():
+        calls.append(1)
+        return True, result
+    return invoke, calls
+
+
+def _register(server_id, *tools):
+    tool_registry.set_server_tools(server_id, [dict(tool) for tool in tools])
+
+
+def test_cached_until_ttl_expires(clock):
+    _register(1, {"name": "get_schedules", "read_only": True})
+    tool_registry.set_tool_cache_ttl(1, "get_schedules", 30)
+    invoke, calls = _counting("schedules")
+
+    assert tool_cache.call(1, "get_schedules", {"uid": 0, "status": "active"}, invoke) == (True, "schedules")
+    assert tool_cache.call(1, "get_schedules", {"status": "active", "uid": 0}, invoke) == (True, "schedules")
+    assert len(calls) == 1
+
+    clock[0] += 31
+    tool_cache.call(1, "get_schedules", {"uid": 0, "status": "active"}, invoke)
+    assert len(calls) == 2
+    stats = tool_cache.stats(1)
+    assert (stats["hits"], stats["misses"]) == (1, 2)
+
+
+def test_write_tool_invalidates_its_server(clock):
+    _register(1, {"name": "get_schedules"}, {"name": "add_schedule"})
+    _register(2, {"name": "read_page"})
+    tool_registry.set_tool_cache_ttl(1, "get_schedules", 30)
+    tool_registry.set_tool_cache_ttl(2, "read_page", 30)
+    tool_cache.call(1, "get_schedules", {}, _counting("before")[0])
+    tool_cache.call(2, "read_page", {}, _counting("page")[0])
+
+    tool_cache.call(1, "add_schedule", {"title": "report"}, _counting("ok")[0])
+    assert tool_cache.call(1, "get_schedules", {}, _counting("after")[0]) == (True, "after")
+    assert tool_cache.stats(2)["entries"] == 1
+
+
+def test_read_only_and_failed_calls_do_not_invalidate(clock):
+    _register(1, {"name": "get_schedules"}, {"name": "now", "read_only": True}, {"name": "add_schedule"})
+    tool_registry.set_tool_cache_ttl(1, "get_schedules", 30)
+    tool_cache.call(1, "get_schedules", {}, _counting("cached")[0])
+
+    tool_cache.call(1, "now", {}, _counting("12:00")[0])
+    tool_cache.call(1, "add_schedule", {}, lambda: (False, "error"))
+    assert tool_cache.call(1, "get_schedules", {}, _counting("fresh")[0]) == (True, "cached")
+
+
+def test_servers_with_same_tool_name_are_cached_separately(clock):
+    _register(1, {"name": "search"})
+    _register(2, {"name": "search"})
+    tool_registry.set_tool_cache_ttl(1, "search", 30)
+    tool_registry.set_tool_cache_ttl(2, "search", 30)
+
+    assert tool_cache.call(1, "search", {"q": "fay"}, _counting("from 1")[0]) == (True, "from 1")
+    assert tool_cache.call(2, "search", {"q": "fay"}, _counting("from 2")[0]) == (True, "from 2")
+    assert tool_cache.call(1, "search", {"q": "fay"}, _counting("again")[0]) == (True, "from 1")
@@ -0,0 +1,79 @@
+from types import SimpleNamespace
+
+from llm.tool_router import ToolRouter
+
+
+class _NoEmbedder:
+    enabled = False
+
+
+class _FixedEmbedder:
+    """每个工具说明都给同一个向量，提问的向量由测试指定"""
+    enabled = True
+
+    def __init__(self, query_vector):
+        self.query_vector = query_vector
+
+    def embed(self, texts):
+        return [[1.0, 0.0] for _ in texts]
+
+    def embed_query(self, query):
+        return self.query_vector
+
+
+def _schedule_tools():
+    specs = [
+        ("add_schedule", "添加新的日程安排", {
+            "title": "日程标题",
+            "content": "日程详细内容",
+            "schedule_time": "执行时间，格式: YYYY-MM-DD HH:MM 或 HH:MM（默认今天）",
+        }),
+        ("get_schedules", "获取日程列表", {"status": "日程状态筛选: active(活跃), completed(已完成), deleted(已删除)"}),
+        ("update_schedule", "更新日程信息", {"schedule_id": "日程ID", "title": "新的标题"}),
+        ("delete_schedule", "删除日程（软删除）", {"schedule_id": "要删除的日程ID"}),
+        ("send_message_to_fay", "直接发送消息给Fay", {"message": "要发送的消息内容"}),
+    ]
+    return {
+        name: SimpleNamespace(
+            name=name,
+            description=description,
+            schema={"properties": {field: {"type": "string", "description": text} for field, text in fields.items()}},
+        )
+        for name, description, fields in specs
+    }
+
+
+def test_schedule_requests_go_to_planner():
+    router = ToolRouter(threshold=0.1, embedder=_NoEmbedder())
+    for query in ("帮我记一下周五要交报告", "把我周三的会删掉", "我明天有什么日程"):
+        assert router.route(query, _schedule_tools()).use_tools, query
+
+
+def test_no_signal_goes_to_planner_without_embeddings():
+    router = ToolRouter(threshold=0.1, embedder=_NoEmbedder())
+    decision = router.route("周末想去爬山", _schedule_tools())
+    assert decision.use_tools
+    assert decision.reason == "无法判断"
+
+
+def test_stopwords_and_persona_do_not_count_as_lexical_match():
+    router = ToolRouter(threshold=0.1, embedder=_FixedEmbedder([0.0, 1.0]))
+    assert not router.route("今天好累啊", _schedule_tools()).use_tools
+    assert not router.route("Fay你好", _schedule_tools(), persona=("Fay", "")).use_tools
+
+
+def test_embedding_similarity_decides_when_available():
+    tools = _schedule_tools()
+    assert not ToolRouter(0.1, _FixedEmbedder([0.0, 1.0])).route("周末想去爬山", tools).use_tools
+    decision = ToolRouter(0.1, _FixedEmbedder([1.0, 0.0])).route("周末想去爬山", tools)
+    assert decision.use_tools
+    assert decision.reason == "语义匹配"
+
+
+def test_overrides_and_disabled_router():
+    tools = _schedule_tools()
+    router = ToolRouter(threshold=0.1, embedder=_FixedEmbedder([0.0, 1.0]))
+    assert router.route("周末想去爬山", tools, override=True).use_tools
+    assert not router.route("帮我记一下周五要交报告", tools, override=False).use_tools
+    assert not router.route("帮我记一下周五要交报告", {}).use_tools
+    assert ToolRouter(threshold=0, embedder=_FixedEmbedder([0.0, 1.0])).route("周末想去爬山", tools).use_tools
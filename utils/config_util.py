@@ -52,6 +52,27 @@ volcano_tts_voice_type = None
 start_mode = None
 fay_url = None
 hunyuan3d_api_url = None
+embedding_backend = None
+embedding_local_model = None
+agent_cache_max_agents = None
+agent_cache_memory_mb = None
+memory_hot_max_nodes = None
+knowledge_watch_interval = None
+knowledge_ingest_workers = None
+knowledge_max_file_mb = None
+prompt_memory_tokens = None
+prompt_knowledge_tokens = None
+prompt_history_tokens = None
+planner_model_engine = None
+planner_base_url = None
+planner_api_key = None
+planner_max_tokens = None
+chat_max_tokens = None
+llm_max_connections = None
+tts_first_segment_chars = None
+tts_segment_chars = None
+tool_router_threshold = None
+workflow_tool_workers = None
 system_conf_path = None
 config_json_path = None
 
@@ -177,6 +198,27 @@ def load_config():
     global volcano_tts_voice_type
     global start_mode
     global fay_url
+    global embedding_backend
+    global embedding_local_model
+    global agent_cache_max_agents
+    global agent_cache_memory_mb
+    global memory_hot_max_nodes
+    global knowledge_watch_interval
+    global knowledge_ingest_workers
+    global knowledge_max_file_mb
+    global prompt_memory_tokens
+    global prompt_knowledge_tokens
+    global prompt_history_tokens
+    global planner_model_engine
+    global planner_base_url
+    global planner_api_key
+    global planner_max_tokens
+    global chat_max_tokens
+    global llm_max_connections
+    global tts_first_segment_chars
+    global tts_segment_chars
+    global tool_router_threshold
+    global workflow_tool_workers
 
     global CONFIG_SERVER
     global system_conf_path
@@ -253,6 +295,27 @@ def load_config():
         system_config.set('key', 'fay_url', fay_url)
     
     hunyuan3d_api_url = system_config.get('key', 'hunyuan3d_api_url', fallback='http://localhost:8081')
+    embedding_backend = system_config.get('key', 'embedding_backend', fallback='mock')
+    embedding_local_model = system_config.get('key', 'embedding_local_model', fallback=None)
+    agent_cache_max_agents = system_config.getint('key', 'agent_cache_max_agents', fallback=64)
+    agent_cache_memory_mb = system_config.getint('key', 'agent_cache_memory_mb', fallback=0)
+    memory_hot_max_nodes = system_config.getint('key', 'memory_hot_max_nodes', fallback=2000)
+    knowledge_watch_interval = system_config.getfloat('key', 'knowledge_watch_interval', fallback=5.0)
+    knowledge_ingest_workers = system_config.getint('key', 'knowledge_ingest_workers', fallback=0)
+    knowledge_max_file_mb = system_config.getint('key', 'knowledge_max_file_mb', fallback=50)
+    prompt_memory_tokens = system_config.getint('key', 'prompt_memory_tokens', fallback=1000)
+    prompt_knowledge_tokens = system_config.getint('key', 'prompt_knowledge_tokens', fallback=1500)
+    prompt_history_tokens = system_config.getint('key', 'prompt_history_tokens', fallback=2000)
+    planner_model_engine = system_config.get('key', 'planner_model_engine', fallback=None)
+    planner_base_url = system_config.get('key', 'planner_base_url', fallback=None)
+    planner_api_key = system_config.get('key', 'planner_api_key', fallback=None)
+    planner_max_tokens = system_config.getint('key', 'planner_max_tokens', fallback=512)
+    chat_max_tokens = system_config.getint('key', 'chat_max_tokens', fallback=200)
+    llm_max_connections = system_config.getint('key', 'llm_max_connections', fallback=20)
+    tts_first_segment_chars = system_config.getint('key', 'tts_first_segment_chars', fallback=4)
+    tts_segment_chars = system_config.getint('key', 'tts_segment_chars', fallback=20)
+    tool_router_threshold = system_config.getfloat('key', 'tool_router_threshold', fallback=0)
+    workflow_tool_workers = system_config.getint('key', 'workflow_tool_workers', fallback=8)
     
     # 读取用户配置
     with codecs.open(config_json_path, encoding='utf-8') as f:
@@ -290,6 +353,27 @@ def load_config():
 
         'start_mode': start_mode,
         'fay_url': fay_url,
+        'embedding_backend': embedding_backend,
+        'embedding_local_model': embedding_local_model,
+        'agent_cache_max_agents': agent_cache_max_agents,
+        'agent_cache_memory_mb': agent_cache_memory_mb,
+        'memory_hot_max_nodes': memory_hot_max_nodes,
+        'knowledge_watch_interval': knowledge_watch_interval,
+        'knowledge_ingest_workers': knowledge_ingest_workers,
+        'knowledge_max_file_mb': knowledge_max_file_mb,
+        'prompt_memory_tokens': prompt_memory_tokens,
+        'prompt_knowledge_tokens': prompt_knowledge_tokens,
+        'prompt_history_tokens': prompt_history_tokens,
+        'planner_model_engine': planner_model_engine,
+        'planner_base_url': planner_base_url,
+        'planner_api_key': planner_api_key,
+        'planner_max_tokens': planner_max_tokens,
+        'chat_max_tokens': chat_max_tokens,
+        'llm_max_connections': llm_max_connections,
+        'tts_first_segment_chars': tts_first_segment_chars,
+        'tts_segment_chars': tts_segment_chars,
+        'tool_router_threshold': tool_router_threshold,
+        'workflow_tool_workers': workflow_tool_workers,
         'source': 'local'  # 标记配置来源
     }
     
@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+import time
+import threading
+from collections import deque
+
+import utils.config_util as cfg
+
+# 首句统计保留最近多少轮对话
+STATS_WINDOW = 200
+
+
+class SegmentationPolicy:
+    """
+    分句策略：决定缓冲区中的文本在哪个断句点切出一段送去TTS
+    """
+    def cut(self, text, breaks, index):
+        """
+        参数:
+            text: 缓冲区中尚未送出的文本
+            breaks: 缓冲区中断句标点的位置，从小到大
+            index: 本轮回复已经切出的段数
+        返回:
+            切分位置（该段结束位置，不含），不切分时返回None
+        """
+        raise NotImplementedError
+
+
+class SentencePolicy(SegmentationPolicy):
+    """
+    按整句切分：缓冲区满min_chars个字符后，切到最后一个位于min_offset之后的标点
+    """
+    def __init__(self, min_chars=20, min_offset=10):
+        self.min_chars = min_chars
+        self.min_offset = min_offset
+
+    def cut(self, text, breaks, index):
+        if len(text) >= self.min_chars and breaks and breaks[-1] > self.min_offset:
+            return breaks[-1] + 1
+        return None
+
+
+class AdaptivePolicy(SentencePolicy):
+    """
+    第一段在出现至少first_min_chars个字符的短分句时立即切出，让TTS尽早开始合成；
+    之后按整句切分，减少TTS请求次数
+    """
+    def __init__(self, first_min_chars=4, min_chars=20, min_offset=10):
+        super().__init__(min_chars, min_offset)
+        self.first_min_chars = first_min_chars
+
+    def cut(self, text, breaks, index):
+        if index == 0:
+            for pos in breaks:
+                if pos + 1 >= self.first_min_chars:
+                    return pos + 1
+            return None
+        return super().cut(text, breaks, index)
+
+
+def default_policy():
+    """
+    按配置创建分句策略：tts_first_segment_chars为0时不单独处理第一段
+    """
+    first_min_chars = cfg.tts_first_segment_chars
+    min_chars = cfg.tts_segment_chars or 20
+    if first_min_chars is None:
+        first_min_chars = 4
+    if first_min_chars <= 0:
+        return SentencePolicy(min_chars)
+    return AdaptivePolicy(first_min_chars, min_chars)
+
+
+class SentenceSegmenter:
+    """
+    流式回复的增量分句器。
+
+    feed()追加LLM输出的文本块，只扫描新追加的字符记录断句标点的位置，
+    由分句策略决定切出哪些段；flush()取出剩余文本。同时记录从started起
+    收到第一块文本和切出第一段的耗时。
+
+    参数:
+        punctuations: 断句标点（单个字符）
+        policy: 分句策略，默认按配置创建
+        started: 计时起点（一般为收到提问的时间），默认为创建时
+    """
+    def __init__(self, punctuations, policy=None, started=None):
+        self.punctuations = frozenset(p for p in punctuations if len(p) == 1)
+        self.policy = policy or default_policy()
+        self.started = started or time.time()
+        self.segments = 0
+        self.first_text_at = None
+        self.first_segment_at = None
+        self.first_segment_chars = None
+        self._buffer = ""
+        self._breaks = []
+        self._finished = False
+
+    @property
+    def pending(self):
+        return self._buffer
+
+    def feed(self, text):
+        """
+        追加一块文本，返回可以送出的段（可能为空列表）
+        """
+        if not text:
+            return []
+        if self.first_text_at is None:
+            self.first_text_at = time.time()
+        start = len(self._buffer)
+        self._buffer += text
+        for offset, char in enumerate(text):
+            if char in self.punctuations:
+                self._breaks.append(start + offset)
+        segments = []
+        while self._buffer:
+            end = self.policy.cut(self._buffer, self._breaks, self.segments)
+            if not end:
+                break
+            segments.append(self._take(end))
+        return segments
+
+    def flush(self):
+        """
+        取出缓冲区中剩余的文本（没有时返回空字符串）
+        """
+        if not self._buffer:
+            return ""
+        return self._take(len(self._buffer))
+
+    def _take(self, end):
+        segment = self._buffer[:end]
+        rest = self._buffer[end:]
+        self._buffer = rest.lstrip()
+        shift = end + len(rest) - len(self._buffer)
+        self._breaks = [pos - shift for pos in self._breaks if pos >= shift]
+        if self.segments == 0:
+            self.first_segment_at = time.time()
+            self.first_segment_chars = len(segment)
+        self.segments += 1
+        return segment
+
+    def metrics(self):
+        """
+        返回首块文本、首段的耗时（毫秒，未发生时为None）和首段长度
+        """
+        def elapsed(at):
+            return None if at is None else round((at - self.started) * 1000, 1)
+        return {
+            "first_text_ms": elapsed(self.first_text_at),
+            "first_segment_ms": elapsed(self.first_segment_at),
+            "first_segment_chars": self.first_segment_chars,
+            "segments": self.segments,
+        }
+
+    def finish(self):
+        """
+        本轮回复结束：把首句指标计入统计（只计一次），返回metrics()
+        """
+        metrics = self.metrics()
+        if not self._finished and metrics["first_segment_ms"] is not None:
+            self._finished = True
+            segmentation_stats.record(metrics)
+        return metrics
+
+
+def _percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class SegmentationStats:
+    """
+    最近STATS_WINDOW轮回复的首块文本、首段耗时统计，用于按部署调整分句参数
+    """
+    def __init__(self, window=STATS_WINDOW):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, metrics):
+        with self._lock:
+            self._samples.append(metrics)
+
+    def summary(self):
+        with self._lock:
+            samples = list(self._samples)
+        result = {"count": len(samples)}
+        for key in ("first_text_ms", "first_segment_ms", "first_segment_chars"):
+            values = [sample[key] for sample in samples if sample.get(key) is not None]
+            if not values:
+                result[key] = None
+                continue
+            result[key] = {
+                "avg": round(sum(values) / len(values), 1),
+                "p50": _percentile(values, 0.5),
+                "p90": _percentile(values, 0.9),
+                "max": max(values),
+            }
+        return result
+
+
+segmentation_stats = SegmentationStats()
+
+
+def get_segmentation_stats():
+    """
+    获取首句耗时统计
+    """
+    policy = default_policy()
+    summary = segmentation_stats.summary()
+    summary["policy"] = {
+        "type": type(policy).__name__,
+        "first_min_chars": getattr(policy, "first_min_chars", None),
+        "min_chars": policy.min_chars,
+    }
+    return summary